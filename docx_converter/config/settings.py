@@ -69,6 +69,12 @@ DATABASES = {
     )
 }
 
+if DATABASES["default"]["ENGINE"] == "django.db.backends.sqlite3":
+    # В SQLite пишут несколько процессов-воркеров: ждём блокировку, а не падаем
+    DATABASES["default"].setdefault("OPTIONS", {}).update(
+        {"transaction_mode": "IMMEDIATE", "timeout": 30}
+    )
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -103,6 +109,105 @@ STATICFILES_DIRS = [
 # Media files
 MEDIA_URL = "/media/"
 MEDIA_ROOT = config("MEDIA_ROOT", default=os.path.join(BASE_DIR, "media"))
+# Unreferenced images wait this long in media/images/trash: a conversion that
+# found an image in the store just before it was released takes it back from there
+IMAGE_TRASH_TTL = config("IMAGE_TRASH_TTL", default=24 * 3600, cast=int)
+
+# Background conversion queue
+CONVERSION_QUEUE_ENABLED = config("CONVERSION_QUEUE_ENABLED", default=True, cast=bool)
+CONVERSION_WORKERS = config("CONVERSION_WORKERS", default=2, cast=int)
+CONVERSION_POLL_INTERVAL = config("CONVERSION_POLL_INTERVAL", default=1.0, cast=float)
+CONVERSION_JOB_TIMEOUT = config("CONVERSION_JOB_TIMEOUT", default=900, cast=int)
+# Warn when a conversion's peak memory growth exceeds this many times the .docx size
+CONVERSION_RSS_RATIO_TARGET = config(
+    "CONVERSION_RSS_RATIO_TARGET", default=150, cast=float
+)
+
+# Bulk uploads: limits per request and how long the response streams results
+BULK_UPLOAD_MAX_FILES = config("BULK_UPLOAD_MAX_FILES", default=100, cast=int)
+BULK_UPLOAD_MAX_BYTES = config("BULK_UPLOAD_MAX_BYTES", default=500 * 1024**2, cast=int)
+BULK_UPLOAD_WAIT_TIMEOUT = config("BULK_UPLOAD_WAIT_TIMEOUT", default=600, cast=int)
+
+# Content-addressed cache of finished conversions
+CONVERSION_CACHE_ENABLED = config("CONVERSION_CACHE_ENABLED", default=True, cast=bool)
+CONVERSION_CACHE_MAX_BYTES = config(
+    "CONVERSION_CACHE_MAX_BYTES", default=2 * 1024**3, cast=int
+)
+
+# Image pipeline: downscale to IMAGE_MAX_WIDTH, recompress, optionally add
+# WebP and smaller srcset variants; the zip gets originals when
+# IMAGE_ZIP_ORIGINALS is set
+IMAGE_OPTIMIZE = config("IMAGE_OPTIMIZE", default=True, cast=bool)
+IMAGE_WORKERS = config("IMAGE_WORKERS", default=4, cast=int)
+IMAGE_MAX_WIDTH = config("IMAGE_MAX_WIDTH", default=1000, cast=int)
+IMAGE_QUALITY = config("IMAGE_QUALITY", default=85, cast=int)
+IMAGE_WEBP = config("IMAGE_WEBP", default=False, cast=bool)
+IMAGE_SRCSET_WIDTHS = config("IMAGE_SRCSET_WIDTHS", default="500", cast=Csv(int))
+IMAGE_ZIP_ORIGINALS = config("IMAGE_ZIP_ORIGINALS", default=False, cast=bool)
+
+# Post-process documents whose mammoth HTML is at least
+# POSTPROCESS_PARALLEL_MIN_BYTES in chunks across this many processes;
+# 0 or 1 keeps post-processing in the converting process. Off by default:
+# the speedup has not been measured on a multi-core host yet (bench_parallel)
+POSTPROCESS_WORKERS = config("POSTPROCESS_WORKERS", default=0, cast=int)
+POSTPROCESS_PARALLEL_MIN_BYTES = config(
+    "POSTPROCESS_PARALLEL_MIN_BYTES", default=4 * 1024**2, cast=int
+)
+
+# Write .br/.gz copies of the HTML and its download version in the background,
+# served by nginx (gzip_static) and send_file
+PRECOMPRESS_ENABLED = config("PRECOMPRESS_ENABLED", default=True, cast=bool)
+PRECOMPRESS_MIN_BYTES = config("PRECOMPRESS_MIN_BYTES", default=1024, cast=int)
+
+# Async views hand blocking file I/O and CPU-heavy calls (conversion, edit
+# saves, PDF rendering) to these per-process thread pools
+ASYNC_IO_WORKERS = config("ASYNC_IO_WORKERS", default=16, cast=int)
+ASYNC_CPU_WORKERS = config("ASYNC_CPU_WORKERS", default=2, cast=int)
+
+# Rendered result pages and edit page content, checked against the HTML
+# file's mtime and size on every request. LocMemCache is per process; point
+# PAGE_CACHE_BACKEND at FileBasedCache to share one directory between workers
+PAGE_CACHE_ENABLED = config("PAGE_CACHE_ENABLED", default=True, cast=bool)
+PAGE_CACHE_ALIAS = "pages"
+PAGE_CACHE_MAX_BYTES = config("PAGE_CACHE_MAX_BYTES", default=2 * 1024**2, cast=int)
+CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    PAGE_CACHE_ALIAS: {
+        "BACKEND": config(
+            "PAGE_CACHE_BACKEND",
+            default="django.core.cache.backends.locmem.LocMemCache",
+        ),
+        "LOCATION": config("PAGE_CACHE_LOCATION", default="pages"),
+        "TIMEOUT": config("PAGE_CACHE_TIMEOUT", default=3600, cast=int),
+        "OPTIONS": {
+            "MAX_ENTRIES": config("PAGE_CACHE_MAX_ENTRIES", default=100, cast=int)
+        },
+    },
+}
+
+# Render the PDF in the background after conversion and after each edit
+PDF_PRERENDER = config("PDF_PRERENDER", default=False, cast=bool)
+
+# Dedicated PDF renderer pool (run_pdf_workers); when disabled, PDFs are
+# rendered inside the web process
+PDF_POOL_ENABLED = config("PDF_POOL_ENABLED", default=False, cast=bool)
+PDF_WORKERS = config("PDF_WORKERS", default=2, cast=int)
+PDF_JOB_TIMEOUT = config("PDF_JOB_TIMEOUT", default=300, cast=int)
+PDF_WAIT_TIMEOUT = config("PDF_WAIT_TIMEOUT", default=60, cast=int)
+PDF_WORKER_MAX_RSS_MB = config("PDF_WORKER_MAX_RSS_MB", default=1024, cast=int)
+PDF_WORKER_MAX_JOBS = config("PDF_WORKER_MAX_JOBS", default=500, cast=int)
+
+# Downloads: "django" streams files with FileResponse,
+# "accel" hands them to nginx through X-Accel-Redirect
+DOWNLOAD_DELIVERY = config("DOWNLOAD_DELIVERY", default="django")
+DOWNLOAD_ACCEL_PREFIX = config("DOWNLOAD_ACCEL_PREFIX", default="/protected-media/")
+
+# Per-process metric snapshots merged by /metrics; must be shared by the
+# web and worker processes
+METRICS_DIR = config("METRICS_DIR", default=os.path.join(MEDIA_ROOT, "metrics"))
+# Snapshots of processes on other hosts that have not written for this long
+# are folded into retired.json; dead processes on this host are folded at once
+METRICS_SNAPSHOT_TTL = config("METRICS_SNAPSHOT_TTL", default=3600, cast=int)
 
 # Default primary key field type
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
@@ -124,13 +229,26 @@ SECURE_HSTS_PRELOAD = not DEBUG
 LOGGING = {
     "version": 1,
     "disable_existing_loggers": False,
+    "formatters": {
+        "default": {
+            "format": "{asctime} level={levelname} logger={name} pid={process} {message}",
+            "style": "{",
+        },
+    },
     "handlers": {
         "console": {
             "class": "logging.StreamHandler",
+            "formatter": "default",
         },
     },
     "root": {
         "handlers": ["console"],
         "level": "DEBUG" if DEBUG else "INFO",
     },
+    "loggers": {
+        # Поячеечный отладочный вывод постобработки включается отдельно
+        "converter.postprocess": {
+            "level": config("POSTPROCESS_LOG_LEVEL", default="INFO"),
+        },
+    },
 }
@@ -1,3 +1,9 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import ConversionProfile
+
+
+@admin.register(ConversionProfile)
+class ConversionProfileAdmin(admin.ModelAdmin):
+    list_display = ["name", "description", "version", "updated_at"]
+    readonly_fields = ["version", "updated_at"]
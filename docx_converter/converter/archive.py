@@ -0,0 +1,74 @@
+import base64
+import json
+from datetime import datetime
+
+from django.db.models import Q
+
+from .models import DocumentUpload
+
+# Архив листается по ключу (значение сортировки, id), без OFFSET:
+# каждая страница - один проход по индексу
+ARCHIVE_PAGE_SIZE = 50
+
+# Сортировка -> (поле, по убыванию ли); у каждого поля есть индекс (поле, id)
+SORTS = {
+    "-uploaded_at": ("uploaded_at", True),
+    "uploaded_at": ("uploaded_at", False),
+    "name": ("search_name", False),
+    "-name": ("search_name", True),
+}
+DEFAULT_SORT = "-uploaded_at"
+
+# Верхняя граница для поиска по префиксу диапазоном
+_PREFIX_END = "\U0010ffff"
+
+
+def encode_cursor(upload, sort):
+    field, _ = SORTS[sort]
+    value = getattr(upload, field)
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    raw = json.dumps([value, str(upload.id)]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def decode_cursor(cursor, sort):
+    try:
+        value, upload_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if SORTS[sort][0] == "uploaded_at":
+            value = datetime.fromisoformat(value)
+        return value, upload_id
+    except (ValueError, TypeError):
+        return None
+
+
+def archive_page(query="", sort=DEFAULT_SORT, cursor=None, page_size=None):
+    page_size = page_size or ARCHIVE_PAGE_SIZE
+    if sort not in SORTS:
+        sort = DEFAULT_SORT
+    field, descending = SORTS[sort]
+
+    uploads = DocumentUpload.objects.all()
+    query = query.strip().lower()
+    if query:
+        # Префикс имени как диапазон: индекс используется и в PostgreSQL, и в SQLite
+        uploads = uploads.filter(
+            search_name__gte=query, search_name__lt=query + _PREFIX_END
+        )
+
+    position = decode_cursor(cursor, sort) if cursor else None
+    if position is not None:
+        value, upload_id = position
+        after = "lt" if descending else "gt"
+        uploads = uploads.filter(
+            Q(**{f"{field}__{after}": value})
+            | Q(**{field: value, f"id__{after}": upload_id})
+        )
+
+    prefix = "-" if descending else ""
+    uploads = list(uploads.order_by(f"{prefix}{field}", f"{prefix}id")[: page_size + 1])
+    next_cursor = None
+    if len(uploads) > page_size:
+        uploads = uploads[:page_size]
+        next_cursor = encode_cursor(uploads[-1], sort)
+    return uploads, sort, next_cursor
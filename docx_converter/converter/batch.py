@@ -0,0 +1,351 @@
+import glob
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.core.files import File
+from django.db import close_old_connections, connections, transaction
+from django.utils import timezone
+
+from .jobs import run_job
+from .models import ConversionJob, DocumentUpload
+
+logger = logging.getLogger(__name__)
+
+# Пакетная конвертация каталогов .docx в пуле процессов.
+# Ход работы пишется в журнал состояния (JSON Lines, по строке на событие),
+# поэтому прерванный запуск продолжается с того же места
+CREATE_BATCH_SIZE = 100
+SLOWEST_FILES = 10
+
+STATE_CREATED = "created"
+STATE_DONE = ConversionJob.STATUS_DONE
+STATE_FAILED = ConversionJob.STATUS_FAILED
+
+
+def default_workers():
+    return os.cpu_count() or 1
+
+
+def collect_sources(patterns):
+    sources = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, "**", "*.docx")
+        for path in glob.glob(pattern, recursive=True):
+            # ~$name.docx - блокировки Word, а не документы
+            if os.path.isfile(path) and not os.path.basename(path).startswith("~$"):
+                sources.add(os.path.abspath(path))
+    return sorted(sources)
+
+
+def fingerprint(path):
+    stat = os.stat(path)
+    return f"{stat.st_size:x}-{stat.st_mtime_ns:x}"
+
+
+def load_state(state_path):
+    # Последняя запись по файлу побеждает
+    state = {}
+    try:
+        with open(state_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Оборванная последняя строка после прерывания
+                    continue
+                state[record["path"]] = record
+    except FileNotFoundError:
+        pass
+    return state
+
+
+def append_state(state_path, records):
+    with open(state_path, "a", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _reusable(record, source_fingerprint):
+    # Загрузку из прошлого запуска берём, если файл не менялся и запись в БД жива
+    return (
+        record is not None
+        and record.get("fingerprint") == source_fingerprint
+        and record.get("job_id")
+        and ConversionJob.objects.filter(pk=record["job_id"]).exists()
+    )
+
+
+def _create_uploads(sources):
+    uploads = []
+    jobs = []
+    field = DocumentUpload._meta.get_field("docx_file")
+    for path in sources:
+        filename = os.path.basename(path)
+        with open(path, "rb") as f:
+            name = field.storage.save(field.generate_filename(None, filename), File(f))
+        upload = DocumentUpload(
+            docx_file=name,
+            filename=filename,
+            search_name=filename.lower(),
+            docx_size=os.path.getsize(path),
+        )
+        uploads.append(upload)
+        # Задачи вида batch очередь не забирает, их выполняет этот запуск
+        jobs.append(
+            ConversionJob(
+                upload=upload,
+                kind=ConversionJob.KIND_BATCH,
+                original_filename=filename,
+            )
+        )
+    with transaction.atomic():
+        DocumentUpload.objects.bulk_create(uploads)
+        ConversionJob.objects.bulk_create(jobs)
+    return jobs
+
+
+def _unfinished(job_ids):
+    return ConversionJob.objects.filter(
+        pk__in=job_ids,
+        kind=ConversionJob.KIND_BATCH,
+        status__in=[ConversionJob.STATUS_QUEUED, ConversionJob.STATUS_RUNNING],
+    )
+
+
+def fail_jobs(job_ids, error):
+    for start in range(0, len(job_ids), CREATE_BATCH_SIZE):
+        _unfinished(job_ids[start : start + CREATE_BATCH_SIZE]).update(
+            status=ConversionJob.STATUS_FAILED, finished_at=timezone.now(), error=error
+        )
+
+
+def prepare_jobs(sources, state, state_path, resume=True):
+    # Возвращает [(путь, id задачи)] к конвертации и число пропущенных файлов.
+    # Задачи прошлого запуска, которые не продолжаем, отмечаются упавшими
+    pending = []
+    to_create = []
+    skipped = 0
+    for path in sources:
+        source_fingerprint = fingerprint(path)
+        record = state.get(path) if resume else None
+        if _reusable(record, source_fingerprint):
+            if record["status"] == STATE_DONE:
+                skipped += 1
+                continue
+            pending.append((path, record["job_id"]))
+            continue
+        to_create.append((path, source_fingerprint))
+
+    resumed = [job_id for _, job_id in pending]
+    for start in range(0, len(resumed), CREATE_BATCH_SIZE):
+        ConversionJob.objects.filter(
+            pk__in=resumed[start : start + CREATE_BATCH_SIZE],
+            kind=ConversionJob.KIND_BATCH,
+        ).update(
+            status=ConversionJob.STATUS_QUEUED,
+            started_at=None,
+            finished_at=None,
+            error="",
+        )
+    resumed = set(resumed)
+    superseded = [
+        record["job_id"]
+        for record in state.values()
+        if record.get("job_id")
+        and record["job_id"] not in resumed
+        and record.get("status") != STATE_DONE
+    ]
+    fail_jobs(superseded, "Superseded by a later batch run")
+
+    for start in range(0, len(to_create), CREATE_BATCH_SIZE):
+        chunk = to_create[start : start + CREATE_BATCH_SIZE]
+        jobs = _create_uploads([path for path, _ in chunk])
+        records = []
+        for (path, source_fingerprint), job in zip(chunk, jobs):
+            records.append(
+                {
+                    "path": path,
+                    "fingerprint": source_fingerprint,
+                    "upload_id": str(job.upload_id),
+                    "job_id": str(job.id),
+                    "status": STATE_CREATED,
+                }
+            )
+            pending.append((path, str(job.id)))
+        for record in records:
+            state[record["path"]] = record
+        append_state(state_path, records)
+    return pending, skipped
+
+
+def _init_worker():
+    # Ctrl+C обрабатывает родитель: он дожидается начатых файлов
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def convert_one(job_id):
+    close_old_connections()
+    worker_name = f"{socket.gethostname()}-{os.getpid()}-batch"
+    ConversionJob.objects.filter(pk=job_id).update(
+        status=ConversionJob.STATUS_RUNNING,
+        started_at=timezone.now(),
+        worker=worker_name,
+        error="",
+    )
+    job = ConversionJob.objects.select_related("upload").get(pk=job_id)
+    job = run_job(job)
+    return {
+        "job_id": str(job.id),
+        "upload_id": str(job.upload_id),
+        "status": job.status,
+        "error": job.error,
+        "seconds": job.stage_timings.get("total"),
+        "timings": job.stage_timings,
+    }
+
+
+def _collect(future, path, job_id):
+    try:
+        result = future.result()
+    except Exception as e:
+        logger.exception(f"Batch conversion of {path} crashed")
+        result = {
+            "job_id": job_id,
+            "status": STATE_FAILED,
+            "error": str(e),
+            "seconds": None,
+            "timings": {},
+        }
+    result["path"] = path
+    return result
+
+
+def run_batch(pending, workers):
+    # Выдаёт результаты по мере готовности. При Ctrl+C новые файлы не
+    # начинаются, начатые дорабатываются и тоже попадают в результаты
+    connections.close_all()
+    executor = ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("fork"),
+        initializer=_init_worker,
+    )
+    futures = {
+        executor.submit(convert_one, job_id): (path, job_id) for path, job_id in pending
+    }
+    try:
+        for future in as_completed(futures):
+            yield _collect(future, *futures.pop(future))
+    except KeyboardInterrupt:
+        for future in futures:
+            future.cancel()
+        for future in as_completed(futures):
+            if not future.cancelled():
+                yield _collect(future, *futures[future])
+        raise
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def summarize(results, sources, skipped, elapsed, workers):
+    converted = [result for result in results if result["status"] == STATE_DONE]
+    failed = [result for result in results if result["status"] != STATE_DONE]
+    total_bytes = sum(os.path.getsize(result["path"]) for result in converted)
+    stages = {}
+    for result in converted:
+        for stage, seconds in result["timings"].items():
+            if isinstance(seconds, bool) or not isinstance(seconds, (int, float)):
+                continue
+            stages[stage] = stages.get(stage, 0) + seconds
+    timed = [result for result in converted if result["seconds"] is not None]
+    slowest = sorted(timed, key=lambda result: result["seconds"], reverse=True)
+    return {
+        "finished_at": timezone.now().isoformat(),
+        "workers": workers,
+        "files": len(sources),
+        "converted": len(converted),
+        "failed": len(failed),
+        "skipped": skipped,
+        "not_started": len(sources) - skipped - len(results),
+        "elapsed_seconds": round(elapsed, 3),
+        "files_per_second": round(len(converted) / elapsed, 3) if elapsed else None,
+        "megabytes_per_second": (
+            round(total_bytes / 1024**2 / elapsed, 3) if elapsed else None
+        ),
+        "stage_seconds": {stage: round(value, 3) for stage, value in stages.items()},
+        "slowest": [
+            {"path": result["path"], "seconds": result["seconds"]}
+            for result in slowest[:SLOWEST_FILES]
+        ],
+        "failures": [
+            {
+                "path": result["path"],
+                "upload_id": result.get("upload_id"),
+                "job_id": result["job_id"],
+                "error": result["error"],
+            }
+            for result in failed
+        ],
+    }
+
+
+def convert_batch(patterns, state_path, workers=None, resume=True, progress=None):
+    workers = workers or default_workers()
+    sources = collect_sources(patterns)
+    os.makedirs(os.path.dirname(os.path.abspath(state_path)), exist_ok=True)
+    # Без resume журнал всё равно читаем: задачи из него отмечаются упавшими
+    state = load_state(state_path)
+    pending, skipped = prepare_jobs(sources, state, state_path, resume)
+    logger.info(
+        f"Batch: {len(sources)} files, {len(pending)} to convert, {skipped} done"
+    )
+
+    results = []
+    started = time.perf_counter()
+    interrupted = False
+    if progress is not None:
+        progress.reset(total=len(pending))
+    try:
+        for result in run_batch(pending, min(workers, len(pending) or 1)):
+            results.append(result)
+            record = state[result["path"]]
+            append_state(
+                state_path,
+                [
+                    {
+                        "path": result["path"],
+                        "fingerprint": record["fingerprint"],
+                        "upload_id": record["upload_id"],
+                        "job_id": result["job_id"],
+                        "status": result["status"],
+                        "seconds": result["seconds"],
+                        "timings": result["timings"],
+                        "error": result["error"],
+                    }
+                ],
+            )
+            if progress is not None:
+                progress.update(1)
+                progress.set_postfix(
+                    failed=sum(r["status"] != STATE_DONE for r in results)
+                )
+    except KeyboardInterrupt:
+        interrupted = True
+        logger.warning("Batch interrupted, rerun the command to resume")
+        finished = {result["job_id"] for result in results}
+        fail_jobs(
+            [job_id for _, job_id in pending if job_id not in finished],
+            "Batch run interrupted; run convert_batch again to resume",
+        )
+    elapsed = time.perf_counter() - started
+    summary = summarize(results, sources, skipped, elapsed, workers)
+    summary["interrupted"] = interrupted
+    return summary
@@ -0,0 +1,130 @@
+import random
+from html import escape
+
+from converter.postprocess import parse_fragment
+
+# Синтетический HTML в том виде, в каком его выдаёт mammoth: абзацы, заголовки,
+# списки, XML-фрагменты, серии кода и таблицы (в том числе вложенные).
+
+_WORDS = (
+    "configure server request response element value attribute parser "
+    "document section table image code module client default option"
+).split()
+
+
+def _sentence(rnd, words=8):
+    return " ".join(rnd.choice(_WORDS) for _ in range(words)).capitalize() + "."
+
+
+def _xml_snippet(rnd, index):
+    name = rnd.choice(["config", "item", "bean", "property", "entry"])
+    kind = rnd.random()
+    if kind < 0.4:
+        return f'<{name} id="{index}"><value>{rnd.randint(0, 999)}</value></{name}>'
+    if kind < 0.6:
+        return f'<{name} key="{rnd.choice(_WORDS)}"/>'
+    if kind < 0.7:
+        return '<?xml version="1.0" encoding="UTF-8"?>'
+    if kind < 0.8:
+        return f"</{name}>"
+    return f"<{name}>{rnd.choice(_WORDS)}</{name}>"
+
+
+def _cell(rnd, index):
+    kind = rnd.random()
+    if kind < 0.25:
+        return f"<p>{escape(_xml_snippet(rnd, index), quote=False)}</p>"
+    if kind < 0.3:
+        return "<p>---</p>"
+    if kind < 0.35:
+        return "<p>...</p>"
+    if kind < 0.4:
+        return ""
+    if kind < 0.5:
+        return (
+            f"<p>{escape(_sentence(rnd, 3))}</p>"
+            f"<p>{escape(_xml_snippet(rnd, index), quote=False)}</p>"
+        )
+    return f"<p>{escape(_sentence(rnd, 4))}</p>"
+
+
+def _table(rnd, rows, cols, index, nested=True):
+    parts = ["<table>"]
+    if rnd.random() < 0.2:
+        header = "".join(f"<th><p>Column {c}</p></th>" for c in range(cols))
+        parts.append(f"<thead><tr>{header}</tr></thead>")
+    for r in range(rows):
+        parts.append("<tr>")
+        for c in range(cols):
+            cell = _cell(rnd, index + r * cols + c)
+            if nested and rnd.random() < 0.02:
+                cell += _table(rnd, 2, 2, index, nested=False)
+            parts.append(f"<td>{cell}</td>")
+        parts.append("</tr>")
+    parts.append("</table>")
+    return "".join(parts)
+
+
+# Текст из одних пробелов, который mammoth выдаёт между форматированными
+# фрагментами и в пустых абзацах и ячейках: html.parser сводит его к одному
+# символу, и parse_fragment должен делать так же
+WHITESPACE_HTML = "".join(
+    [
+        "<p><strong>Bold</strong>   <em>italic</em></p>",
+        "<p>    </p>",
+        "<p>\t<strong>a</strong>\n\n<em>b</em> </p>",
+        "<p>Two  spaces inside</p>",
+        "<p>\r\n</p>",
+        "<p>&#160; </p>",
+        "<p>  <br />  </p>",
+        "<ul> <li> </li> <li>  Item  </li> </ul>",
+        "<table> <tr> <td>  </td> <td> <p>  </p> </td> </tr> </table>",
+        '<pre class="code">  <b> </b>  </pre>  ',
+        "<p>&lt;config&gt;</p>   <p>&lt;/config&gt;</p>",
+    ]
+)
+
+
+def synthetic_html(paragraphs=1000, tables=10, rows=6, cols=3, seed=0):
+    rnd = random.Random(seed)
+    table_every = max(1, paragraphs // tables) if tables else 0
+    parts = ['<h1 class="title">Synthetic document</h1>']
+    for i in range(paragraphs):
+        kind = rnd.random()
+        if kind < 0.15:
+            parts.append(f"<p>{escape(_xml_snippet(rnd, i), quote=False)}</p>")
+        elif kind < 0.2:
+            parts.append(f'<pre class="code">{escape(_xml_snippet(rnd, i))}</pre>')
+        elif kind < 0.23:
+            parts.append("<p></p>")
+        elif kind < 0.26:
+            parts.append(f'<h2 class="subtitle">{escape(_sentence(rnd, 3))}</h2>')
+        elif kind < 0.3:
+            items = "".join(f"<li>{escape(_sentence(rnd, 4))}</li>" for _ in range(3))
+            parts.append(f"<ul>{items}</ul>")
+        elif kind < 0.32:
+            parts.append(f'<div class="warning"><p>{escape(_sentence(rnd))}</p></div>')
+        elif kind < 0.34:
+            parts.append(f'<p><img alt="" src="/media/output/x/images/{i}.png" /></p>')
+        elif kind < 0.4:
+            parts.append(
+                f"<p><strong>{escape(_sentence(rnd, 2))}</strong> "
+                f"<em>{escape(_sentence(rnd, 3))}</em></p>"
+            )
+        else:
+            parts.append(f"<p>{escape(_sentence(rnd, rnd.randint(4, 20)))}</p>")
+        if table_every and i % table_every == table_every - 1:
+            parts.append(_table(rnd, rows, cols, i))
+    return "".join(parts)
+
+
+def classifier_corpus(paragraphs=5000, tables=50, seed=0):
+    # Строки, которые видит is_xml_like: тексты абзацев и дочерних узлов ячеек
+    root = parse_fragment(synthetic_html(paragraphs, tables, seed=seed))
+    texts = []
+    for element in root.iter("p", "pre", "td"):
+        if element.tag == "td":
+            texts.extend("".join(child.itertext()) for child in element)
+        else:
+            texts.append("".join(element.itertext()))
+    return texts
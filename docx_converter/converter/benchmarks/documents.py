@@ -0,0 +1,111 @@
+import io
+import os
+import random
+from datetime import datetime
+
+from docx import Document
+from docx.shared import Inches
+from PIL import Image
+
+from .corpus import _WORDS, _sentence, _xml_snippet
+
+# Детерминированные .docx для бенчмарков: один и тот же профиль, масштаб и seed
+# дают один и тот же документ. Меняем GENERATOR_VERSION при изменении генератора,
+# чтобы не брать старые файлы из каталога корпуса
+
+GENERATOR_VERSION = "1"
+
+# Профиль -> параметры при масштабе 1
+PROFILES = {
+    "paragraphs": {"paragraphs": 5000},
+    "tables": {"paragraphs": 20, "tables": 1, "rows": 800, "cols": 5},
+    "images": {"paragraphs": 400, "images": 150},
+    "xml": {"paragraphs": 300, "xml": 3000},
+}
+
+# Не масштабируются: форма документа, а не его размер
+_FIXED_PARAMS = {"tables", "cols"}
+_FIXED_DATE = datetime(2024, 1, 1)
+
+
+def _image_bytes(rnd, index):
+    # Увеличенный шум: картинки не сжимаются в ноль и не совпадают между собой
+    size = (80 + index % 7 * 4, 50)
+    noise = bytes(rnd.getrandbits(8) for _ in range(size[0] * size[1] * 3))
+    image = Image.frombytes("RGB", size, noise).resize((size[0] * 4, size[1] * 4))
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def _add_paragraph(document, rnd, index):
+    kind = rnd.random()
+    if kind < 0.05:
+        document.add_heading(_sentence(rnd, 3), level=2)
+    elif kind < 0.1:
+        document.add_paragraph(_xml_snippet(rnd, index))
+    elif kind < 0.2:
+        paragraph = document.add_paragraph(_sentence(rnd, 6) + " ")
+        paragraph.add_run(rnd.choice(_WORDS)).bold = True
+    else:
+        document.add_paragraph(_sentence(rnd, rnd.randint(6, 30)))
+
+
+def _add_table(document, rnd, rows, cols, index):
+    table = document.add_table(rows=rows, cols=cols)
+    for r, row in enumerate(table.rows):
+        for c, cell in enumerate(row.cells):
+            kind = rnd.random()
+            if kind < 0.3:
+                cell.text = _xml_snippet(rnd, index + r * cols + c)
+            elif kind < 0.35:
+                cell.text = "..."
+            else:
+                cell.text = _sentence(rnd, 4)
+            if kind > 0.9:
+                cell.add_paragraph(_xml_snippet(rnd, index + r))
+
+
+def build_document(paragraphs=0, tables=0, rows=0, cols=0, images=0, xml=0, seed=0):
+    rnd = random.Random(seed)
+    document = Document()
+    properties = document.core_properties
+    properties.author = properties.last_modified_by = "benchmark"
+    properties.created = properties.modified = _FIXED_DATE
+    document.add_heading("Benchmark document", level=1)
+
+    image_blobs = [_image_bytes(rnd, index) for index in range(min(images, 20))]
+    image_every = max(1, paragraphs // images) if images else 0
+    table_every = max(1, paragraphs // tables) if tables else 0
+    for index in range(paragraphs):
+        _add_paragraph(document, rnd, index)
+        if image_every and index % image_every == 0 and images > 0:
+            # Повторы одних и тех же картинок тоже встречаются в реальных документах
+            blob = image_blobs[index // image_every % len(image_blobs)]
+            document.add_picture(io.BytesIO(blob), width=Inches(3))
+            images -= 1
+        if table_every and index % table_every == table_every - 1:
+            _add_table(document, rnd, rows, cols, index)
+    for index in range(xml):
+        # Плотные XML-фрагменты, иногда по два в одном абзаце
+        paragraph = document.add_paragraph(_xml_snippet(rnd, index))
+        if index % 5 == 0:
+            paragraph.add_run(" " + _xml_snippet(rnd, index + 1))
+    return document
+
+
+def generate(profile, directory, scale=1.0, seed=0):
+    # Готовый файл из каталога корпуса переиспользуется
+    params = {
+        name: value if name in _FIXED_PARAMS else max(1, int(value * scale))
+        for name, value in PROFILES[profile].items()
+    }
+    path = os.path.join(
+        directory, f"{profile}-x{scale:g}-s{seed}-v{GENERATOR_VERSION}.docx"
+    )
+    if not os.path.exists(path):
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        build_document(seed=seed, **params).save(tmp_path)
+        os.replace(tmp_path, path)
+    return path
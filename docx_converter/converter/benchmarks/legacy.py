@@ -0,0 +1,126 @@
+import re
+from html import unescape
+
+from bs4 import BeautifulSoup
+
+# Прежний многопроходный конвейер постобработки на BeautifulSoup, без изменений
+# (кроме отладочных print). Эталон для проверки побайтного совпадения
+# converter.postprocess и для замеров ускорения.
+
+
+def legacy_is_xml_like(text):
+    text = text.strip()
+    html_tags = ["p", "b", "i", "div", "span", "a", "strong", "em"]
+    return bool(
+        text
+        and (
+            re.match(r"^\s*<\w+\b[^>]*>.*</\w+>\s*$", text, re.DOTALL)
+            or re.search(r"<\w+\b[^>]*>|</\w+>|<\?[\w-]+", text)
+        )
+        and not any(
+            re.match(rf"^\s*<{tag}\b", text, re.IGNORECASE) for tag in html_tags
+        )
+    )
+
+
+def legacy_postprocess(html_content):
+    soup = BeautifulSoup(html_content, "html.parser")
+
+    def is_xml_like(text):
+        text = text.strip()
+        html_tags = ["p", "b", "i", "div", "span", "a", "strong", "em"]
+        return bool(
+            text
+            and (
+                re.match(r"^\s*<\w+\b[^>]*>.*</\w+>\s*$", text, re.DOTALL)
+                or re.search(r"<\w+\b[^>]*>|</\w+>|<\?[\w-]+", text)
+            )
+            and not any(
+                re.match(rf"^\s*<{tag}\b", text, re.IGNORECASE) for tag in html_tags
+            )
+        )
+
+    # Обработка параграфов и pre
+    for tag in soup.find_all(["p", "pre"]):
+        text = tag.get_text().strip()
+        if tag.name == "pre" or is_xml_like(text):
+            new_pre = soup.new_tag("pre")
+            new_pre["class"] = ["code", "language-markup"]
+            new_code = soup.new_tag("code", attrs={"class": "language-markup"})
+            new_code.string = text
+            new_pre.append(new_code)
+            tag.replace_with(new_pre)
+
+    # Объединяем последовательные <pre> вне таблиц
+    pre_tags = soup.find_all("pre", recursive=True)
+    i = 0
+    while i < len(pre_tags):
+        current_pre = pre_tags[i]
+        if current_pre.find_parent("table") is None:
+            xml_content = [current_pre.code.text]
+            j = i + 1
+            while j < len(pre_tags) and pre_tags[j].find_parent("table") is None:
+                # Пропускаем незначительные элементы (пустые <p>, <br>)
+                prev_sibling = pre_tags[j].find_previous_sibling()
+                if (
+                    prev_sibling is None
+                    or prev_sibling.name in ["pre", "br"]
+                    or (
+                        prev_sibling.name == "p" and not prev_sibling.get_text().strip()
+                    )
+                ):
+                    xml_content.append(pre_tags[j].code.text)
+                    pre_tags[j].decompose()
+                    j += 1
+                else:
+                    break
+            current_pre.code.string = "\n".join(xml_content)
+            i = j
+        else:
+            i += 1
+
+    # Обработка таблиц
+    for table in soup.find_all("table"):
+        table["class"] = table.get("class", []) + ["default-bordered-table"]
+        if "mce-item-table" in table["class"]:
+            table["class"].remove("mce-item-table")
+        has_th = bool(table.find("th"))
+        if not has_th:
+            first_tr = table.find("tr")
+            if first_tr:
+                for td in first_tr.find_all("td"):
+                    td["class"] = td.get("class", []) + ["table-header"]
+        for td in table.find_all("td"):
+            xml_content = []
+            non_xml_content = []
+            for child in td.children:
+                child_text = unescape(child.get_text().strip())
+                if child_text:
+                    if is_xml_like(child_text):
+                        xml_content.append(child_text)
+                    elif re.match(r"^\s*-+\s*$", child_text) or re.match(
+                        r"^\s*\.{3,}\s*$", child_text
+                    ):
+                        xml_content.append(f"<!-- {child_text} -->")
+                    else:
+                        non_xml_content.append(child_text)
+            if xml_content:
+                new_pre = soup.new_tag("pre")
+                new_pre["class"] = ["code", "language-markup"]
+                new_code = soup.new_tag("code", attrs={"class": "language-markup"})
+                new_code.string = "\n".join(xml_content)
+                new_pre.append(new_code)
+                td.clear()
+                td.append(new_pre)
+                for non_xml in non_xml_content:
+                    new_p = soup.new_tag("p")
+                    new_p.string = non_xml
+                    td.append(new_p)
+
+    # Удаляем вложенные <p>
+    for p in soup.find_all("p"):
+        nested_p = p.find("p")
+        if nested_p:
+            nested_p.unwrap()
+
+    return str(soup)
@@ -0,0 +1,127 @@
+import socket
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from itertools import cycle
+
+# Нагрузочный прогон против запущенного сервера: concurrency потоков
+# отправляют запросы, пока не наберётся total. Каждый запрос - новое
+# соединение, чтобы sync-воркеры gunicorn (без keep-alive) и uvicorn
+# сравнивались в одинаковых условиях.
+# Медленные клиенты параллельно качают большой файл с ограниченной скоростью:
+# так видно, сколько запросов сервер обслуживает, пока занят отдачей
+
+SLOW_CHUNK = 4096
+
+
+def _fetch(url, timeout):
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            size = 0
+            while chunk := response.read(64 * 1024):
+                size += len(chunk)
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status, size = e.code, 0
+    except (urllib.error.URLError, OSError):
+        status, size = None, 0
+    return status, size, time.perf_counter() - started
+
+
+def _slow_reader(url, rate, stop, timeout):
+    parts = urllib.parse.urlsplit(url)
+    path = parts.path + (f"?{parts.query}" if parts.query else "")
+    request = (
+        f"GET {path} HTTP/1.1\r\nHost: {parts.netloc}\r\nConnection: close\r\n\r\n"
+    ).encode("ascii")
+    while not stop.is_set():
+        try:
+            with socket.socket() as sock:
+                # Маленький буфер приёма, иначе файл целиком уйдёт в буферы ядра
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SLOW_CHUNK)
+                sock.settimeout(timeout)
+                sock.connect((parts.hostname, parts.port or 80))
+                sock.sendall(request)
+                while not stop.is_set() and sock.recv(SLOW_CHUNK):
+                    stop.wait(SLOW_CHUNK / rate)
+        except OSError:
+            stop.wait(0.1)
+
+
+def _percentile(values, percent):
+    if len(values) < 2:
+        return values[0] if values else 0.0
+    return statistics.quantiles(values, n=100, method="inclusive")[percent - 1]
+
+
+def run_load(
+    urls,
+    concurrency=32,
+    total=500,
+    timeout=60,
+    slow_url=None,
+    slow_clients=0,
+    slow_rate=64 * 1024,
+):
+    urls = cycle(urls)
+    lock = threading.Lock()
+    latencies = []
+    statuses = {}
+    transferred = 0
+    remaining = total
+
+    def worker():
+        nonlocal remaining, transferred
+        while True:
+            with lock:
+                if remaining <= 0:
+                    return
+                remaining -= 1
+                url = next(urls)
+            status, size, seconds = _fetch(url, timeout)
+            with lock:
+                latencies.append(seconds)
+                statuses[status] = statuses.get(status, 0) + 1
+                transferred += size
+
+    stop = threading.Event()
+    slow = [
+        threading.Thread(
+            target=_slow_reader, args=(slow_url, slow_rate, stop, timeout), daemon=True
+        )
+        for _ in range(slow_clients if slow_url else 0)
+    ]
+    for thread in slow:
+        thread.start()
+    if slow:
+        # Медленные клиенты успевают занять воркеры до начала замера
+        time.sleep(1)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    stop.set()
+
+    ok = sum(count for status, count in statuses.items() if status and status < 400)
+    return {
+        "requests": total,
+        "concurrency": concurrency,
+        "slow_clients": len(slow),
+        "seconds": round(elapsed, 3),
+        "requests_per_second": round(total / elapsed, 1),
+        "ok": ok,
+        "errors": total - ok,
+        "statuses": {str(status): count for status, count in statuses.items()},
+        "megabytes": round(transferred / 1024**2, 1),
+        "p50_ms": round(_percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(_percentile(latencies, 95) * 1000, 1),
+        "max_ms": round(max(latencies, default=0) * 1000, 1),
+    }
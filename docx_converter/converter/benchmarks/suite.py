@@ -0,0 +1,245 @@
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import statistics
+import tempfile
+import time
+
+from django.core.files import File
+from django.db import connections
+from django.test import override_settings
+from django.utils import timezone
+
+from converter.export import build_download_html
+from converter.memory import current_rss_mb
+from converter.models import DocumentUpload
+from converter.pdf import get_pdf, invalidate_pdf
+from converter.utils import CONVERTER_VERSION, process_docx, save_edited_html
+
+from .documents import GENERATOR_VERSION, PROFILES, generate
+
+# Набор замеров: каждый прогон - отдельный форкнутый процесс, чтобы пиковая
+# память (ru_maxrss) относилась к одной операции, а не ко всему набору.
+# Сравнивается прирост памяти за операцию: абсолютный пик зависит от того,
+# сколько успел занять родительский процесс
+
+STAGES = ["convert", "save_edited_html", "download_html", "render_pdf"]
+
+# Не считаем регрессией разницу меньше этой: шум таймера и планировщика
+MIN_REGRESSION_SECONDS = 0.02
+MIN_REGRESSION_MB = 5
+
+
+def _child(func, sender):
+    connections.close_all()
+    start_rss = current_rss_mb()
+    try:
+        started = time.perf_counter()
+        timings = func()
+        result = {"seconds": time.perf_counter() - started, "timings": timings or {}}
+    except Exception as e:
+        result = {"error": f"{type(e).__name__}: {e}"}
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    result["peak_rss_mb"] = peak_rss
+    result["memory_mb"] = max(0.0, peak_rss - start_rss)
+    sender.send(result)
+    sender.close()
+
+
+def _measure(func):
+    connections.close_all()
+    context = multiprocessing.get_context("fork")
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=_child, args=(func, sender))
+    process.start()
+    sender.close()
+    try:
+        result = receiver.recv()
+    except EOFError:
+        result = {"error": f"Benchmark process died with code {process.exitcode}"}
+    process.join()
+    return result
+
+
+def _summarize(runs):
+    errors = [run["error"] for run in runs if "error" in run]
+    if errors:
+        return {"error": errors[0]}
+    seconds = [run["seconds"] for run in runs]
+    stages = {}
+    for run in runs:
+        for stage, value in run["timings"].items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                stages.setdefault(stage, []).append(value)
+    return {
+        "repeat": len(runs),
+        "min_seconds": round(min(seconds), 4),
+        "median_seconds": round(statistics.median(seconds), 4),
+        "peak_rss_mb": round(max(run["peak_rss_mb"] for run in runs), 1),
+        "memory_mb": round(max(run["memory_mb"] for run in runs), 1),
+        "stages": {
+            stage: round(statistics.median(values), 4)
+            for stage, values in stages.items()
+        },
+    }
+
+
+def _stage_functions(upload, docx_path, html_state):
+    def convert():
+        timings = {}
+        process_docx(docx_path, upload.id, upload.filename, timings)
+        return timings
+
+    def save_edited():
+        save_edited_html(html_state["content"], upload.id, html_state["filename"])
+
+    def download_html():
+        build_download_html(html_state["content"])
+
+    def render_pdf():
+        invalidate_pdf(html_state["path"])
+        get_pdf(html_state["path"])
+
+    return {
+        "convert": convert,
+        "save_edited_html": save_edited,
+        "download_html": download_html,
+        "render_pdf": render_pdf,
+    }
+
+
+def _run_profile(profile, docx_path, stages, repeat, progress):
+    results = {}
+    filename = os.path.basename(docx_path)
+    with open(docx_path, "rb") as f:
+        upload = DocumentUpload(filename=filename, docx_size=os.path.getsize(docx_path))
+        upload.docx_file.save(filename, File(f), save=False)
+    upload.save()
+    try:
+        # Результат конвертации нужен остальным операциям
+        result = process_docx(upload.docx_file.path, upload.id, filename)
+        with open(result.html_path, "r", encoding="utf-8") as f:
+            html_state = {
+                "path": result.html_path,
+                "filename": result.html_filename,
+                "content": f.read(),
+            }
+        functions = _stage_functions(upload, upload.docx_file.path, html_state)
+        for stage in stages:
+            runs = [_measure(functions[stage]) for _ in range(repeat)]
+            results[f"{profile}/{stage}"] = _summarize(runs)
+            progress(f"{profile}/{stage}", results[f"{profile}/{stage}"])
+    finally:
+        upload.delete()
+    return results
+
+
+def run_suite(
+    profiles=None,
+    stages=None,
+    scale=1.0,
+    repeat=3,
+    seed=0,
+    corpus_dir=None,
+    progress=None,
+):
+    profiles = profiles or list(PROFILES)
+    stages = stages or STAGES
+    progress = progress or (lambda name, result: None)
+    corpus_dir = corpus_dir or os.path.join(tempfile.gettempdir(), "docx-bench-corpus")
+    documents = {
+        profile: generate(profile, corpus_dir, scale, seed) for profile in profiles
+    }
+
+    results = {}
+    # Все файлы, включая хранилище картинок и метрики, - во временном каталоге
+    media_root = tempfile.mkdtemp(prefix="docx-bench-")
+    try:
+        with override_settings(
+            MEDIA_ROOT=media_root,
+            METRICS_DIR=os.path.join(media_root, "metrics"),
+            PDF_PRERENDER=False,
+        ):
+            for profile, docx_path in documents.items():
+                results.update(
+                    _run_profile(profile, docx_path, stages, repeat, progress)
+                )
+    finally:
+        shutil.rmtree(media_root, ignore_errors=True)
+
+    return {
+        "meta": {
+            "created_at": timezone.now().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "converter_version": CONVERTER_VERSION,
+            "generator_version": GENERATOR_VERSION,
+            "database": connections["default"].vendor,
+            "scale": scale,
+            "seed": seed,
+            "repeat": repeat,
+            "documents": {
+                profile: {"path": path, "size": os.path.getsize(path)}
+                for profile, path in documents.items()
+            },
+        },
+        "results": results,
+    }
+
+
+def compare(current, baseline, threshold=0.2):
+    # Регрессия - медиана времени или пиковая память выросли больше чем на
+    # threshold и больше абсолютного порога шума
+    rows = []
+    for name, result in current["results"].items():
+        base = baseline.get("results", {}).get(name)
+        if base is None or "error" in result or "error" in base:
+            rows.append({"name": name, "status": "new" if base is None else "error"})
+            continue
+        time_ratio = result["median_seconds"] / max(base["median_seconds"], 1e-9)
+        memory_ratio = (result["memory_mb"] + 1) / (base["memory_mb"] + 1)
+        slower = (
+            time_ratio > 1 + threshold
+            and result["median_seconds"] - base["median_seconds"]
+            > MIN_REGRESSION_SECONDS
+        )
+        bigger = (
+            memory_ratio > 1 + threshold
+            and result["memory_mb"] - base["memory_mb"] > MIN_REGRESSION_MB
+        )
+        faster = time_ratio < 1 - threshold
+        rows.append(
+            {
+                "name": name,
+                "status": (
+                    "regression"
+                    if slower or bigger
+                    else ("improvement" if faster else "ok")
+                ),
+                "median_seconds": result["median_seconds"],
+                "baseline_seconds": base["median_seconds"],
+                "time_ratio": round(time_ratio, 3),
+                "memory_mb": result["memory_mb"],
+                "baseline_memory_mb": base["memory_mb"],
+                "memory_ratio": round(memory_ratio, 3),
+            }
+        )
+    return rows
+
+
+def load(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save(results, path):
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    os.replace(tmp_path, path)
@@ -0,0 +1,280 @@
+import fcntl
+import json
+import os
+import re
+import uuid
+from contextlib import contextmanager
+
+from . import compression
+from .postprocess import escape_text, parse_fragment, to_html
+
+# Поблочное редактирование: у каждого элемента верхнего уровня документа есть
+# постоянный data-block-id, а рядом с HTML лежит индекс с байтовыми смещениями
+# блоков. Правка заменяет только изменённые блоки, остальные байты документа
+# копируются как есть, без разбора
+
+BLOCK_ATTRIBUTE = "data-block-id"
+INDEX_SUFFIX = ".blocks.json"
+
+_BLOCK_ID = re.compile(r"^b(\d+)$")
+_BODY_START = re.compile(rb"<body\b[^>]*>")
+_BODY_END = b"</body>"
+
+
+class BlockEditError(Exception):
+    pass
+
+
+class VersionConflict(BlockEditError):
+    pass
+
+
+def index_path(html_path):
+    return html_path + INDEX_SUFFIX
+
+
+def _is_element(node):
+    return isinstance(node.tag, str)
+
+
+def _next_number(root, next_number=1):
+    for child in root:
+        if not _is_element(child):
+            continue
+        match = _BLOCK_ID.match(child.get(BLOCK_ATTRIBUTE) or "")
+        if match:
+            next_number = max(next_number, int(match.group(1)) + 1)
+    return next_number
+
+
+def assign_block_ids(root, next_number=None, keep=None):
+    # Без next_number размечается документ целиком и имеющиеся id сохраняются.
+    # Иначе это новые блоки из правки: id от клиента не берём (TinyMCE копирует
+    # атрибуты при разбиении абзаца), первый элемент получает keep
+    reuse = next_number is None
+    if reuse:
+        next_number = _next_number(root)
+    seen = set()
+    for child in root:
+        if not _is_element(child):
+            continue
+        block_id = child.get(BLOCK_ATTRIBUTE) if reuse else keep
+        keep = None
+        if not block_id or block_id in seen:
+            block_id = f"b{next_number}"
+            next_number += 1
+        child.set(BLOCK_ATTRIBUTE, block_id)
+        seen.add(block_id)
+    return next_number
+
+
+def _block_text(node):
+    if not _is_element(node):
+        return " ".join((node.tail or "").split())
+    return " ".join(" ".join(node.itertext()).split() + (node.tail or "").split())
+
+
+def _detach(root):
+    # Узлы отцепляются от дерева по одному и освобождаются после сериализации
+    # len(root) в lxml проходит по всем детям, поэтому берём первый через iter
+    child = next(iter(root), None)
+    while child is not None:
+        root.remove(child)
+        yield child
+        child = next(iter(root), None)
+
+
+def segments(root, consume=False):
+    # (id, html, текст) для каждого узла верхнего уровня; у комментариев id нет.
+    # consume=True разбирает дерево по ходу, чтобы не держать его и HTML сразу
+    for child in _detach(root) if consume else root:
+        block_id = child.get(BLOCK_ATTRIBUTE) if _is_element(child) else None
+        yield block_id, to_html(child).encode("utf-8"), _block_text(child)
+
+
+def document_text(index):
+    return " ".join(text for _, _, _, text in index["blocks"] if text)
+
+
+def _tmp_path(path):
+    # Своё имя на каждую запись: один документ могут сохранять параллельно
+    # потоки одного процесса
+    return f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+
+
+def _write_atomic(path, data):
+    tmp_path = _tmp_path(path)
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def write_blocks(html_path, prefix, blocks, suffix, next_number, version=1):
+    # Пишет документ и индекс; blocks - итератор (id, html в байтах, текст),
+    # блоки сразу уходят в файл, документ целиком в памяти не собирается
+    offset = len(prefix)
+    entries = []
+    tmp_path = _tmp_path(html_path)
+    with open(tmp_path, "wb") as f:
+        f.write(prefix)
+        for block_id, html, text in blocks:
+            f.write(html)
+            entries.append([block_id, offset, offset + len(html), text])
+            offset += len(html)
+        f.write(suffix)
+    os.replace(tmp_path, html_path)
+    compression.discard(html_path)
+    stat = os.stat(html_path)
+    index = {
+        "version": version,
+        "next": next_number,
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "body": [len(prefix), offset],
+        "blocks": entries,
+    }
+    _write_atomic(index_path(html_path), json.dumps(index).encode("utf-8"))
+    return index
+
+
+def _read_index(html_path):
+    try:
+        with open(index_path(html_path), "r", encoding="utf-8") as f:
+            index = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    stat = os.stat(html_path)
+    # Документ переписан целиком (форма, кэш конвертаций) - индекс устарел
+    if (index.get("size"), index.get("mtime_ns")) != (stat.st_size, stat.st_mtime_ns):
+        return dict(index, stale=True)
+    return index
+
+
+def body_range(html_path):
+    # Байтовые границы содержимого <body>; None, если индекса нет или он устарел
+    index = _read_index(html_path)
+    if index is None or index.get("stale"):
+        return None
+    return tuple(index["body"])
+
+
+def rebuild_index(html_path, version=1):
+    with open(html_path, "rb") as f:
+        data = f.read()
+    start = _BODY_START.search(data)
+    body_start = start.end() if start else 0
+    body_end = data.rfind(_BODY_END)
+    if body_end < body_start:
+        body_end = len(data)
+    root = parse_fragment(data[body_start:body_end].decode("utf-8"))
+    next_number = assign_block_ids(root)
+    prefix = data[:body_start]
+    if root.text:
+        prefix += escape_text(root.text).encode("utf-8")
+    return write_blocks(
+        html_path,
+        prefix,
+        segments(root, consume=True),
+        data[body_end:],
+        next_number,
+        version=version,
+    )
+
+
+@contextmanager
+def _locked(html_path):
+    with open(index_path(html_path) + ".lock", "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _load_index(html_path):
+    index = _read_index(html_path)
+    if index is None:
+        return rebuild_index(html_path)
+    if index.get("stale"):
+        return rebuild_index(html_path, version=index["version"] + 1)
+    return index
+
+
+def ensure_index(html_path):
+    with _locked(html_path):
+        return _load_index(html_path)
+
+
+def _position(blocks, block_id):
+    for position, (current_id, _, _) in enumerate(blocks):
+        if block_id is not None and current_id == block_id:
+            return position
+    raise BlockEditError(f"Unknown block {block_id}")
+
+
+def _parse_blocks(html_content, next_number, keep=None):
+    root = parse_fragment(html_content or "")
+    if root.text and root.text.strip():
+        # Текст вне элементов оборачиваем в абзац, чтобы у него был id
+        paragraph = root.makeelement("p")
+        paragraph.text, root.text = root.text, None
+        root.insert(0, paragraph)
+    next_number = assign_block_ids(root, next_number, keep)
+    return list(segments(root)), next_number
+
+
+def apply_changes(html_path, changes, version=None):
+    # changes - список операций по порядку:
+    #   {"op": "replace", "id": ..., "html": ...} - блок заменяется одним
+    #       или несколькими элементами, первый сохраняет id; пустой html удаляет
+    #   {"op": "insert", "after": id или None, "html": ...}
+    #   {"op": "delete", "id": ...}
+    # Возвращает новый индекс и id блоков, получившихся из каждой операции
+    with _locked(html_path):
+        index = _load_index(html_path)
+        if version is not None and version != index["version"]:
+            raise VersionConflict(
+                f"Document is at version {index['version']}, not {version}"
+            )
+        with open(html_path, "rb") as f:
+            data = f.read()
+        blocks = [
+            (block_id, data[start:end], text)
+            for block_id, start, end, text in index["blocks"]
+        ]
+        next_number = index["next"]
+        assigned = []
+        for change in changes:
+            if not isinstance(change, dict):
+                raise BlockEditError("Each change must be an object")
+            op = change.get("op")
+            if op == "delete":
+                del blocks[_position(blocks, change.get("id"))]
+                assigned.append([])
+                continue
+            if op == "replace":
+                position = _position(blocks, change.get("id"))
+                del blocks[position]
+                keep = change["id"]
+            elif op == "insert":
+                after = change.get("after")
+                position = 0 if after is None else _position(blocks, after) + 1
+                keep = None
+            else:
+                raise BlockEditError(f"Unknown operation {op!r}")
+            new_blocks, next_number = _parse_blocks(
+                change.get("html"), next_number, keep
+            )
+            blocks[position:position] = new_blocks
+            assigned.append([block_id for block_id, _, _ in new_blocks if block_id])
+
+        body_start, body_end = index["body"]
+        index = write_blocks(
+            html_path,
+            data[:body_start],
+            blocks,
+            data[body_end:],
+            next_number,
+            version=index["version"] + 1,
+        )
+    return index, assigned
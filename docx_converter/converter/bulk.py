@@ -0,0 +1,94 @@
+import logging
+import os
+import zipfile
+
+from django.conf import settings
+from django.core.files import File
+
+from .models import DocumentUpload
+
+logger = logging.getLogger(__name__)
+
+# Массовая загрузка: несколько .docx и/или .zip с ними в одном запросе
+
+
+class BulkUploadError(Exception):
+    pass
+
+
+def _is_docx(name):
+    basename = os.path.basename(name)
+    # ~$name.docx - блокировки Word, __MACOSX - служебные файлы архиватора
+    return (
+        basename.lower().endswith(".docx")
+        and not basename.startswith("~$")
+        and not name.startswith("__MACOSX/")
+    )
+
+
+def _zip_documents(uploaded):
+    # Размеры проверяем по заголовкам до распаковки: ZipExtFile не отдаёт
+    # больше заявленного file_size, так что zip-бомба не пройдёт
+    try:
+        archive = zipfile.ZipFile(uploaded)
+    except zipfile.BadZipFile:
+        raise BulkUploadError(f"{uploaded.name} is not a valid .zip archive")
+    members = [
+        member
+        for member in archive.infolist()
+        if not member.is_dir() and _is_docx(member.filename)
+    ]
+    if not members:
+        raise BulkUploadError(f"{uploaded.name} contains no .docx files")
+    return archive, members
+
+
+def collect_documents(files):
+    # Возвращает [(имя, файл)] и [(имя, ошибка)] для отклонённых файлов
+    documents = []
+    rejected = []
+    total = 0
+    for uploaded in files:
+        if uploaded.name.lower().endswith(".zip"):
+            try:
+                archive, members = _zip_documents(uploaded)
+            except BulkUploadError as e:
+                rejected.append((uploaded.name, str(e)))
+                continue
+            for member in members:
+                documents.append(
+                    (os.path.basename(member.filename), archive.open(member))
+                )
+                total += member.file_size
+        elif _is_docx(uploaded.name):
+            documents.append((uploaded.name, uploaded))
+            total += uploaded.size
+        else:
+            rejected.append((uploaded.name, "Only .docx and .zip files are accepted"))
+
+    if len(documents) > settings.BULK_UPLOAD_MAX_FILES:
+        raise BulkUploadError(
+            f"Too many documents: {len(documents)}, "
+            f"the limit is {settings.BULK_UPLOAD_MAX_FILES}"
+        )
+    if total > settings.BULK_UPLOAD_MAX_BYTES:
+        raise BulkUploadError(
+            f"Documents take {total} bytes unpacked, "
+            f"the limit is {settings.BULK_UPLOAD_MAX_BYTES}"
+        )
+    return documents, rejected
+
+
+def create_uploads(documents, profile=None):
+    uploads = []
+    for filename, document in documents:
+        upload = DocumentUpload(filename=filename, profile=profile)
+        upload.docx_file.save(filename, File(document, name=filename), save=False)
+        upload.docx_size = upload.docx_file.size
+        uploads.append(upload)
+        document.close()
+    for upload in uploads:
+        upload.search_name = upload.filename.lower()
+    DocumentUpload.objects.bulk_create(uploads)
+    logger.debug(f"Created {len(uploads)} uploads from a bulk upload")
+    return uploads
@@ -0,0 +1,184 @@
+import hashlib
+import logging
+import os
+import re
+import threading
+from collections import namedtuple
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# CSS и JS для автономной скачиваемой версии: styles.css, нужная часть
+# Bootstrap и Prism из плагина codesample собираются один раз при старте
+# процесса и хранятся в памяти по отпечатку. Экспорт вставляет готовую
+# строку, без чтения файлов и без CDN
+
+STYLESHEETS = [
+    "vendor/bootstrap/bootstrap.min.css",
+    "js/tinymce/plugins/codesample/css/prism.css",
+    "css/styles.css",
+]
+SCRIPTS = [
+    "js/tinymce/plugins/codesample/js/prism-core.js",
+    "js/tinymce/plugins/codesample/js/prism-markup.js",
+    "js/tinymce/plugins/codesample/js/prism-java.js",
+    "js/tinymce/plugins/codesample/js/prism-json.js",
+    "js/tinymce/plugins/codesample/js/prism-bash.js",
+]
+BOOTSTRAP = STYLESHEETS[0]
+
+# Классы Bootstrap, которые встречаются в экспорте; правила для остальных
+# классов выбрасываются, правила для элементов (reboot, типографика) остаются
+BOOTSTRAP_CLASSES = {"container-sm", "mt-5"}
+DROPPED_AT_RULES = ("@charset", "@keyframes", "@-webkit-keyframes")
+NESTED_AT_RULES = ("@media", "@supports", "@layer")
+
+Bundle = namedtuple("Bundle", ["fingerprint", "css", "js"])
+
+_COMMENT = re.compile(r"/\*.*?\*/", re.S)
+_CLASS = re.compile(r"\.(-?[_a-zA-Z][\w-]*)")
+
+_bundles = {}
+_current = None
+_lock = threading.Lock()
+
+
+def _keep_license(match):
+    return match.group(0) if match.group(0).startswith("/*!") else ""
+
+
+def minify_css(css):
+    css = _COMMENT.sub(_keep_license, css)
+    css = re.sub(r"\s+", " ", css)
+    css = re.sub(r"\s*([{};,>])\s*", r"\1", css)
+    css = re.sub(r"([{;]\s*[\w-]+):\s+", r"\1:", css)
+    return css.replace(";}", "}").strip()
+
+
+def _skip_string(css, position):
+    quote = css[position]
+    position += 1
+    while position < len(css) and css[position] != quote:
+        position += 2 if css[position] == "\\" else 1
+    return position + 1
+
+
+def _rules(css):
+    # (заголовок, тело) для правил верхнего уровня; у @charset и т.п. тела нет
+    depth = 0
+    start = body = 0
+    position = 0
+    while position < len(css):
+        char = css[position]
+        if char in "\"'":
+            position = _skip_string(css, position)
+            continue
+        if css.startswith("/*", position):
+            end = css.find("*/", position + 2)
+            position = len(css) if end < 0 else end + 2
+            continue
+        if char == "{":
+            if depth == 0:
+                body = position
+            depth += 1
+        elif char == "}":
+            depth -= 1
+            if depth == 0:
+                yield css[start:body], css[body + 1 : position]
+                start = position + 1
+        elif char == ";" and depth == 0:
+            yield css[start:position], None
+            start = position + 1
+        position += 1
+
+
+def _selectors(prelude):
+    # Запятые внутри :not(...) и :is(...) селекторы не разделяют
+    depth = 0
+    start = 0
+    for position, char in enumerate(prelude):
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == "," and depth == 0:
+            yield prelude[start:position]
+            start = position + 1
+    yield prelude[start:]
+
+
+def subset_css(css, classes):
+    out = []
+    for prelude, body in _rules(css):
+        out.extend(
+            comment
+            for comment in _COMMENT.findall(prelude)
+            if comment.startswith("/*!")
+        )
+        prelude = _COMMENT.sub("", prelude).strip()
+        if prelude.startswith(DROPPED_AT_RULES):
+            continue
+        if body is None:
+            out.append(f"{prelude};")
+        elif prelude.startswith(NESTED_AT_RULES):
+            inner = subset_css(body, classes)
+            if inner:
+                out.append(f"{prelude}{{{inner}}}")
+        elif prelude.startswith("@"):
+            out.append(f"{prelude}{{{body}}}")
+        else:
+            selectors = [
+                selector
+                for selector in _selectors(prelude)
+                if set(_CLASS.findall(selector)) <= classes
+            ]
+            if selectors:
+                out.append(f"{','.join(selectors)}{{{body}}}")
+    return "".join(out)
+
+
+def _read(name):
+    with open(
+        os.path.join(settings.STATICFILES_DIRS[0], name), "r", encoding="utf-8"
+    ) as f:
+        return f.read()
+
+
+def build():
+    css = []
+    for name in STYLESHEETS:
+        content = _read(name)
+        if name == BOOTSTRAP:
+            # Уже минифицирован
+            css.append(subset_css(content, BOOTSTRAP_CLASSES))
+        else:
+            css.append(minify_css(content))
+    css = "\n".join(css)
+    # Внутри <script> не должно встретиться </script
+    js = ";\n".join(_read(name).strip().rstrip(";") for name in SCRIPTS) + ";"
+    js = re.sub(r"</(script)", r"<\/\1", js, flags=re.I)
+    digest = hashlib.sha256(f"{css}\0{js}".encode("utf-8")).hexdigest()
+    return Bundle(digest[:12], css, js)
+
+
+def get_bundle():
+    global _current
+    with _lock:
+        if _current is None:
+            bundle = build()
+            _bundles[bundle.fingerprint] = bundle
+            _current = bundle.fingerprint
+            logger.info(
+                f"Built export bundle {bundle.fingerprint}: "
+                f"{len(bundle.css)} bytes of CSS, {len(bundle.js)} bytes of JS"
+            )
+        return _bundles[_current]
+
+
+def warm():
+    # Сборка при старте процесса; если статики нет, соберём при первом экспорте
+    try:
+        get_bundle()
+    except OSError as e:
+        logger.warning(f"Export bundle is not built yet: {e}")
@@ -0,0 +1,158 @@
+import hashlib
+import logging
+import os
+import shutil
+import uuid
+
+from django.conf import settings
+from django.db import IntegrityError
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from . import images as image_store
+from . import imaging
+from .models import CacheCounter, ConversionCacheEntry
+from .profiles import get_compiled
+from .utils import CONVERTER_VERSION, output_filenames
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def cache_key(docx_path, profile=None, version=CONVERTER_VERSION):
+    # profile.key - имя, версия и отпечаток правил профиля
+    profile = profile or get_compiled()
+    digest = hashlib.sha256()
+    with open(docx_path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    digest.update(b"\0" + profile.key.encode("utf-8"))
+    digest.update(b"\0" + version.encode("utf-8"))
+    digest.update(b"\0" + imaging.settings_key().encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _cache_dir(key):
+    return os.path.join(settings.MEDIA_ROOT, "cache", key[:2], key)
+
+
+def _output_dir(upload_id):
+    return os.path.join(settings.MEDIA_ROOT, "output", str(upload_id))
+
+
+def _link_or_copy(src, dst):
+    # Жёсткие ссылки делают клон почти бесплатным; между томами копируем
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def _increment(name, amount=1):
+    counters = CacheCounter.objects.filter(name=name)
+    if not counters.update(value=F("value") + amount):
+        try:
+            CacheCounter.objects.create(name=name, value=amount)
+        except IntegrityError:
+            counters.update(value=F("value") + amount)
+
+
+def _drop(entry):
+    shutil.rmtree(_cache_dir(entry.key), ignore_errors=True)
+    image_store.release(entry)
+    entry.delete()
+
+
+def lookup(key, upload_id, original_filename):
+    entry = ConversionCacheEntry.objects.filter(key=key).first()
+    cache_dir = _cache_dir(key)
+    if entry is not None and not os.path.isdir(cache_dir):
+        logger.warning(f"Conversion cache entry {key[:12]} lost its files, dropping it")
+        _drop(entry)
+        entry = None
+    if entry is None:
+        _increment("misses")
+        return None
+
+    output_dir = _output_dir(upload_id)
+    html_filename, zip_filename = output_filenames(original_filename)
+    html_path = os.path.join(output_dir, html_filename)
+    zip_path = os.path.join(output_dir, zip_filename)
+    os.makedirs(output_dir, exist_ok=True)
+    _link_or_copy(os.path.join(cache_dir, entry.zip_filename), zip_path)
+    # HTML копируем, а не линкуем: его потом правят в редакторе.
+    # Картинки лежат в общем хранилище, ссылки на них переписывать не нужно
+    shutil.copyfile(os.path.join(cache_dir, entry.html_filename), html_path)
+
+    ConversionCacheEntry.objects.filter(key=key).update(
+        hits=F("hits") + 1, last_used_at=timezone.now()
+    )
+    _increment("hits")
+    logger.debug(f"Conversion cache hit {key[:12]} for upload {upload_id}")
+    return html_path, zip_path, html_filename, image_store.refs_of(entry)
+
+
+def store(key, upload_id, html_path, zip_path, images):
+    if ConversionCacheEntry.objects.filter(key=key).exists():
+        return
+    cache_dir = _cache_dir(key)
+    # Каталог без записи в БД остался от прерванной вставки
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    tmp_dir = f"{cache_dir}.{uuid.uuid4().hex[:8]}.tmp"
+    os.makedirs(tmp_dir)
+    html_filename = os.path.basename(html_path)
+    zip_filename = os.path.basename(zip_path)
+    shutil.copyfile(html_path, os.path.join(tmp_dir, html_filename))
+    _link_or_copy(zip_path, os.path.join(tmp_dir, zip_filename))
+    size = os.path.getsize(html_path) + os.path.getsize(zip_path)
+    try:
+        os.rename(tmp_dir, cache_dir)
+        entry = ConversionCacheEntry.objects.create(
+            key=key,
+            source_upload_id=upload_id,
+            html_filename=html_filename,
+            zip_filename=zip_filename,
+            size_bytes=size,
+        )
+    except (OSError, IntegrityError):
+        # Тот же документ параллельно сконвертировал другой воркер
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        return
+    image_store.acquire(entry, images)
+    evict(settings.CONVERSION_CACHE_MAX_BYTES)
+
+
+def evict(max_bytes):
+    total = (
+        ConversionCacheEntry.objects.aggregate(total=Sum("size_bytes"))["total"] or 0
+    )
+    evicted = 0
+    for entry in ConversionCacheEntry.objects.order_by("last_used_at").iterator():
+        if total <= max_bytes:
+            break
+        _drop(entry)
+        total -= entry.size_bytes
+        evicted += 1
+    if evicted:
+        _increment("evictions", evicted)
+        logger.info(f"Evicted {evicted} conversion cache entries, {total} bytes left")
+    return evicted
+
+
+def stats():
+    counters = dict(CacheCounter.objects.values_list("name", "value"))
+    aggregate = ConversionCacheEntry.objects.aggregate(total=Sum("size_bytes"))
+    return {
+        "entries": ConversionCacheEntry.objects.count(),
+        "size_bytes": aggregate["total"] or 0,
+        "max_bytes": settings.CONVERSION_CACHE_MAX_BYTES,
+        "hits": counters.get("hits", 0),
+        "misses": counters.get("misses", 0),
+        "evictions": counters.get("evictions", 0),
+    }
+
+
+def clear():
+    for entry in ConversionCacheEntry.objects.iterator():
+        _drop(entry)
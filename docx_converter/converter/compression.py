@@ -0,0 +1,101 @@
+import logging
+import os
+import uuid
+
+import brotli
+import zopfli.gzip
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Заранее сжатые копии HTML рядом с файлом: <name>.br и <name>.gz.
+# Их отдаёт nginx (gzip_static и поиск .br через try_files) или send_file,
+# так что один и тот же файл сервер не сжимает дважды. При перезаписи
+# файла копии удаляются, новые пишет фоновая задача
+
+ENCODINGS = {"br": ".br", "gzip": ".gz"}
+
+# Zopfli медленный: на больших файлах меньше итераций
+ZOPFLI_ITERATIONS = 15
+ZOPFLI_LARGE_ITERATIONS = 5
+ZOPFLI_LARGE_BYTES = 1024**2
+
+
+def _brotli(data):
+    return brotli.compress(data, mode=brotli.MODE_TEXT, quality=11)
+
+
+def _gzip(data):
+    iterations = (
+        ZOPFLI_LARGE_ITERATIONS if len(data) > ZOPFLI_LARGE_BYTES else ZOPFLI_ITERATIONS
+    )
+    return zopfli.gzip.compress(data, numiterations=iterations)
+
+
+COMPRESSORS = {"br": _brotli, "gzip": _gzip}
+
+
+def discard(path):
+    for suffix in ENCODINGS.values():
+        try:
+            os.remove(path + suffix)
+        except FileNotFoundError:
+            pass
+
+
+def _signature(stat):
+    return stat.st_size, stat.st_mtime_ns
+
+
+def precompress(path):
+    stat = os.stat(path)
+    if stat.st_size < settings.PRECOMPRESS_MIN_BYTES:
+        discard(path)
+        return []
+    with open(path, "rb") as f:
+        data = f.read()
+    written = []
+    for encoding, suffix in ENCODINGS.items():
+        target = path + suffix
+        # Своё имя на каждую запись: файл могут сжимать параллельно потоки
+        # одного процесса
+        tmp_path = f"{target}.{uuid.uuid4().hex[:8]}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(COMPRESSORS[encoding](data))
+        os.replace(tmp_path, target)
+        written.append(target)
+    # Файл перезаписали, пока мы сжимали: копии уже устарели
+    if _signature(os.stat(path)) != _signature(stat):
+        logger.debug(f"{path} changed while compressing, dropping copies")
+        discard(path)
+        return []
+    return written
+
+
+def _accepts(accept_encoding, encoding):
+    for item in accept_encoding.lower().split(","):
+        name, *params = [part.strip() for part in item.split(";")]
+        if name != encoding:
+            continue
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    return float(param[2:]) > 0
+                except ValueError:
+                    return False
+        return True
+    return False
+
+
+def choose(path, accept_encoding, stat):
+    # (путь, кодировка) - сжатая копия, если клиент её принимает и она свежая
+    for encoding, suffix in ENCODINGS.items():
+        if not _accepts(accept_encoding or "", encoding):
+            continue
+        try:
+            compressed = os.stat(path + suffix)
+        except FileNotFoundError:
+            continue
+        if compressed.st_mtime >= stat.st_mtime:
+            return path + suffix, encoding
+    return path, None
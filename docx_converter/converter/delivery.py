@@ -0,0 +1,151 @@
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import content_disposition_header, http_date, parse_etags
+
+from . import compression
+from .offload import run_io
+
+# Отдача файлов без чтения целиком в память воркера.
+# "django" - FileResponse (sendfile через wsgi.file_wrapper), под ASGI -
+# асинхронное чтение кусками,
+# "accel" - передаём отдачу nginx через внутренний location X-Accel-Redirect
+CHUNK_SIZE = 64 * 1024
+
+_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def file_etag(stat):
+    # Тот же формат, что и у nginx для статики, чтобы ETag не менялся
+    # при переключении режима отдачи
+    return f'"{int(stat.st_mtime):x}-{stat.st_size:x}"'
+
+
+def _parse_range(header, size):
+    match = _RANGE.match(header.strip())
+    if not match:
+        return None
+    start, end = match.groups()
+    if not start:
+        if not end:
+            return None
+        length = min(int(end), size)
+        return size - length, size - 1
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    return start, end
+
+
+def _iter_range(path, start, length):
+    with open(path, "rb") as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+async def _aiter_range(path, start, length):
+    # Для ASGI: синхронный итератор Django прочитал бы файл в память целиком
+    f = await run_io(open, path, "rb")
+    try:
+        await run_io(f.seek, start)
+        while length > 0:
+            chunk = await run_io(f.read, min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        await run_io(f.close)
+
+
+def _accel_response(path, content_type):
+    relative = os.path.relpath(path, settings.MEDIA_ROOT)
+    if relative.startswith(".."):
+        raise ValueError(f"{path} is outside MEDIA_ROOT")
+    response = HttpResponse(content_type=content_type)
+    response["X-Accel-Redirect"] = settings.DOWNLOAD_ACCEL_PREFIX + quote(
+        relative.replace(os.sep, "/")
+    )
+    return response
+
+
+def send_file(request, path, content_type, filename=None, precompressed=False):
+    # precompressed - рядом могут лежать .br/.gz (см. compression)
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        raise Http404("File not found")
+    disposition = content_disposition_header(True, filename or os.path.basename(path))
+    if settings.DOWNLOAD_DELIVERY == "accel":
+        response = get_conditional_response(
+            request, etag=file_etag(stat), last_modified=int(stat.st_mtime)
+        )
+        if response is not None:
+            return response
+        # Content-Length, Range, условные запросы и выбор .br/.gz - за nginx
+        response = _accel_response(path, content_type)
+        response["Content-Disposition"] = disposition
+        return response
+
+    encoding = None
+    if precompressed and not request.headers.get("Range"):
+        path, encoding = compression.choose(
+            path, request.headers.get("Accept-Encoding"), stat
+        )
+        if encoding:
+            stat = os.stat(path)
+    etag = file_etag(stat)
+    response = get_conditional_response(
+        request, etag=etag, last_modified=int(stat.st_mtime)
+    )
+    if response is not None:
+        if precompressed:
+            patch_vary_headers(response, ["Accept-Encoding"])
+        return response
+
+    size = stat.st_size
+    byte_range = None
+    range_header = request.headers.get("Range")
+    if_range = request.headers.get("If-Range")
+    if range_header and (not if_range or etag in parse_etags(if_range)):
+        byte_range = _parse_range(range_header, size)
+
+    if byte_range is None and isinstance(request, ASGIRequest):
+        response = StreamingHttpResponse(
+            _aiter_range(path, 0, size), content_type=content_type
+        )
+        response["Content-Length"] = str(size)
+    elif byte_range is None:
+        response = FileResponse(open(path, "rb"), content_type=content_type)
+        response["Content-Length"] = str(size)
+    else:
+        start, end = byte_range
+        if start >= size or start > end:
+            response = HttpResponse(status=416)
+            response["Content-Range"] = f"bytes */{size}"
+            return response
+        length = end - start + 1
+        iter_range = _aiter_range if isinstance(request, ASGIRequest) else _iter_range
+        response = StreamingHttpResponse(
+            iter_range(path, start, length), status=206, content_type=content_type
+        )
+        response["Content-Length"] = str(length)
+        response["Content-Range"] = f"bytes {start}-{end}/{size}"
+    response["Accept-Ranges"] = "bytes"
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(stat.st_mtime)
+    response["Content-Disposition"] = disposition
+    if encoding:
+        response["Content-Encoding"] = encoding
+    if precompressed:
+        patch_vary_headers(response, ["Accept-Encoding"])
+    return response
@@ -0,0 +1,187 @@
+import logging
+import os
+import re
+import shutil
+import uuid
+
+from bs4 import BeautifulSoup
+
+from . import compression, metrics
+from .blocks import body_range
+from .bundle import get_bundle
+
+logger = logging.getLogger(__name__)
+
+# Автономная версия HTML для скачивания: CSS и JS из сборки bundle встроены
+# в <style> и <script>, внешних ссылок нет. Строится один раз при сохранении
+# документа и лежит рядом с ним в download/<отпечаток сборки>/
+
+DOWNLOAD_DIR = "download"
+
+COPY_CHUNK_SIZE = 1024**2
+
+_BODY_MARKER = "<!--document-body-->"
+_STYLE = re.compile(r"<style\b[^>]*>.*?</style>", re.S | re.I)
+_file_cache = {}
+_shells = {}
+
+
+def file_mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except FileNotFoundError:
+        return None
+
+
+def read_cached(path):
+    # Перечитываем файл только если он изменился; None - файла нет
+    mtime = file_mtime(path)
+    cached = _file_cache.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    content = None
+    if mtime is not None:
+        with open(path, "r", encoding="utf-8") as f:
+            content = f.read()
+    _file_cache[path] = (mtime, content)
+    return content
+
+
+def build_download_html(html_content):
+    assets = get_bundle()
+    soup = BeautifulSoup(html_content, "html.parser")
+    # <style> документа (CSS профиля конвертации) идут после общей сборки
+    document_styles = (
+        [style.string or "" for style in soup.head.find_all("style")]
+        if soup.head
+        else []
+    )
+    head = soup.new_tag("head")
+    head.append(soup.new_tag("meta", charset="utf-8"))
+    head.append(
+        soup.new_tag(
+            "meta",
+            attrs={
+                "name": "viewport",
+                "content": "width=device-width, initial-scale=1.0",
+            },
+        )
+    )
+    head.append(soup.new_tag("title"))
+    head.title.string = "Converted Document"
+    style = soup.new_tag("style")
+    style.string = assets.css
+    head.append(style)
+    for css in document_styles:
+        style = soup.new_tag("style")
+        style.string = css
+        head.append(style)
+    script = soup.new_tag("script")
+    script.string = assets.js
+    head.append(script)
+    if soup.head:
+        soup.head.replace_with(head)
+    else:
+        soup.html.insert(0, head)
+    body_content = soup.body.extract() if soup.body else soup
+    new_body = soup.new_tag("body")
+    container = soup.new_tag("div", attrs={"class": "container-sm mt-5"})
+    container.append(body_content)
+    new_body.append(container)
+    if soup.html.body:
+        soup.html.body.replace_with(new_body)
+    else:
+        soup.html.append(new_body)
+    return str(soup)
+
+
+def download_path(html_path):
+    directory, filename = os.path.split(html_path)
+    return os.path.join(directory, DOWNLOAD_DIR, get_bundle().fingerprint, filename)
+
+
+def download_shell(head_styles=""):
+    # Обёртка скачиваемой версии вокруг содержимого <body>: то же, что даёт
+    # build_download_html для документа, собранного конвертером.
+    # head_styles - готовые <style> из <head> документа
+    key = get_bundle().fingerprint, head_styles
+    if key not in _shells:
+        shell = build_download_html(
+            f"<!DOCTYPE html>\n<html><head>{head_styles}</head>"
+            f"<body>{_BODY_MARKER}</body></html>"
+        )
+        before, after = shell.split(_BODY_MARKER)
+        _shells[key] = before.encode("utf-8"), after.encode("utf-8")
+    return _shells[key]
+
+
+def _head_styles(source, body_start):
+    source.seek(0)
+    head = source.read(body_start).decode("utf-8")
+    return "".join(_STYLE.findall(head))
+
+
+def _remove_stale(path):
+    # Версии, собранные с прежними сборками CSS/JS
+    current = os.path.dirname(path)
+    root = os.path.dirname(current)
+    for name in os.listdir(root):
+        stale = os.path.join(root, name)
+        if stale == current:
+            continue
+        if os.path.isdir(stale):
+            shutil.rmtree(stale, ignore_errors=True)
+        else:
+            os.remove(stale)
+
+
+def _copy_range(source, target, start, end):
+    source.seek(start)
+    remaining = end - start
+    while remaining > 0:
+        chunk = source.read(min(COPY_CHUNK_SIZE, remaining))
+        if not chunk:
+            break
+        target.write(chunk)
+        remaining -= len(chunk)
+
+
+def write_download_html(html_path, html_content=None, body=None):
+    # body - байтовые границы содержимого <body> в html_path: тогда документ
+    # не разбирается, а копируется кусками между готовыми заголовком и концом
+    path = download_path(html_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Своё имя на каждую запись: сборку могут вести параллельно потоки
+    # одного процесса (пулы offload, потоки gunicorn)
+    tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+    with metrics.timed("docx_stage_seconds", stage="download_html"):
+        if body is not None:
+            with open(html_path, "rb") as source, open(tmp_path, "wb") as f:
+                before, after = download_shell(_head_styles(source, body[0]))
+                f.write(before)
+                _copy_range(source, f, *body)
+                f.write(after)
+        else:
+            if html_content is None:
+                with open(html_path, "r", encoding="utf-8") as f:
+                    html_content = f.read()
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(build_download_html(html_content))
+        os.replace(tmp_path, path)
+    compression.discard(path)
+    _remove_stale(path)
+    return path
+
+
+def ensure_download_html(html_path):
+    # Пересобираем, если документ новее готовой версии; после смены сборки
+    # готовой версии с новым отпечатком ещё нет
+    path = download_path(html_path)
+    try:
+        built = os.stat(path).st_mtime
+    except FileNotFoundError:
+        built = None
+    if built is None or built < os.stat(html_path).st_mtime:
+        logger.debug(f"Building download HTML for {html_path}")
+        return write_download_html(html_path, body=body_range(html_path))
+    return path
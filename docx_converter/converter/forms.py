@@ -1,9 +1,43 @@
 from django import forms
 
 
-class DocumentUploadForm(forms.Form):
+class ProfileChoiceMixin:
+    # Список профилей передаёт представление: async-представления не ходят
+    # в БД при отрисовке формы. Без профилей поле не показывается
+    def __init__(self, *args, profiles=(), **kwargs):
+        super().__init__(*args, **kwargs)
+        if profiles:
+            self.fields["profile"] = forms.ChoiceField(
+                choices=[("", "Default")] + [(name, name) for name in profiles],
+                required=False,
+                label="Conversion profile",
+            )
+
+
+class DocumentUploadForm(ProfileChoiceMixin, forms.Form):
     docx_file = forms.FileField(label="Upload .docx file")
 
 
+class MultipleFileInput(forms.ClearableFileInput):
+    allow_multiple_selected = True
+
+
+class MultipleFileField(forms.FileField):
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault("widget", MultipleFileInput())
+        super().__init__(*args, **kwargs)
+
+    def clean(self, data, initial=None):
+        if isinstance(data, (list, tuple)):
+            return [
+                super(MultipleFileField, self).clean(item, initial) for item in data
+            ]
+        return [super().clean(data, initial)]
+
+
+class BulkUploadForm(ProfileChoiceMixin, forms.Form):
+    files = MultipleFileField(label="Upload .docx files or .zip archives")
+
+
 class HtmlEditForm(forms.Form):
     html_content = forms.CharField(widget=forms.Textarea, label="Edit HTML")
@@ -0,0 +1,66 @@
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+from bs4.element import PreformattedString
+from pygments import highlight
+from pygments.formatters import HtmlFormatter
+from pygments.lexers import get_lexer_by_name
+
+logger = logging.getLogger(__name__)
+
+# Подсветка кода для PDF: лексеры и форматтер создаются один раз,
+# готовые фрагменты кэшируются по (язык, хэш кода)
+
+LANGUAGE_MAP = {
+    "markup": "xml",
+    "bash": "bash",
+    "java": "java",
+    "json": "json",
+}
+HIGHLIGHT_CACHE_SIZE = 4096
+
+# Без full=True: только <div class="highlight">, без документа и CSS
+_FORMATTER = HtmlFormatter(cssclass="highlight", nowrap=False, style="default")
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+class RawHTML(PreformattedString):
+    # Готовая разметка, которую BeautifulSoup выводит как есть, без разбора
+    pass
+
+
+@lru_cache(maxsize=None)
+def get_lexer(language):
+    return get_lexer_by_name(LANGUAGE_MAP.get(language, "xml"))
+
+
+def _cache_key(code, language):
+    return language, hashlib.sha1(code.encode("utf-8")).hexdigest()
+
+
+def highlight_code(code, language):
+    key = _cache_key(code, language)
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+    try:
+        highlighted = highlight(code, get_lexer(language), _FORMATTER).rstrip("\n")
+    except Exception as e:
+        logger.error(f"Could not highlight {language} code: {e}")
+        return None
+    with _cache_lock:
+        _cache[key] = highlighted
+        while len(_cache) > HIGHLIGHT_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return highlighted
+
+
+@lru_cache(maxsize=1)
+def stylesheet():
+    return _FORMATTER.get_style_defs(".highlight")
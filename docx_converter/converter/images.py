@@ -0,0 +1,180 @@
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .models import StoredImage
+
+logger = logging.getLogger(__name__)
+
+# Общее хранилище картинок: одна копия на содержимое,
+# images/<sha[:2]>/<sha[2:4]>/<sha>.<ext>. Картинка без ссылок сначала
+# уходит в images/trash: конвертация могла записать её в хранилище до того,
+# как release её удалил, и acquire вернёт файл оттуда
+STORE_DIR = "images"
+TRASH_DIR = "trash"
+CHUNK_SIZE = 64 * 1024
+
+ImageRef = namedtuple("ImageRef", ["sha256", "path", "size"])
+
+
+def _clean_ext(ext):
+    return re.sub(r"[^\w]", "", ext.lower())[:10] or "bin"
+
+
+def image_url(path):
+    return f"/media/{path}"
+
+
+def image_path(path):
+    return os.path.join(settings.MEDIA_ROOT, path)
+
+
+def store_stream(stream, ext):
+    # Пишем во временный файл по кускам и считаем хэш на лету
+    tmp_dir = os.path.join(settings.MEDIA_ROOT, STORE_DIR, "tmp")
+    os.makedirs(tmp_dir, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    with tempfile.NamedTemporaryFile(dir=tmp_dir, delete=False) as tmp:
+        for chunk in iter(lambda: stream.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+            tmp.write(chunk)
+            size += len(chunk)
+    sha = digest.hexdigest()
+    path = f"{STORE_DIR}/{sha[:2]}/{sha[2:4]}/{sha}.{_clean_ext(ext)}"
+    full_path = image_path(path)
+    if os.path.exists(full_path):
+        os.remove(tmp.name)
+    else:
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        os.replace(tmp.name, full_path)
+    return ImageRef(sha, path, size)
+
+
+def _trash_dir():
+    return os.path.join(settings.MEDIA_ROOT, STORE_DIR, TRASH_DIR)
+
+
+def _trash_path(path):
+    return os.path.join(_trash_dir(), os.path.basename(path))
+
+
+def _ensure_file(ref):
+    # Вызывается под блокировкой строки, release файл уже не тронет
+    full_path = image_path(ref.path)
+    if os.path.exists(full_path):
+        return
+    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+    # FileNotFoundError, если файл потерян совсем: без него ссылка бессмысленна
+    os.replace(_trash_path(ref.path), full_path)
+    logger.info(f"Restored image {ref.sha256[:12]} from the trash")
+
+
+def _increment(ref):
+    # update блокирует строку до конца транзакции. Строку могли удалить или
+    # одновременно создать в другой транзакции, тогда повторяем update
+    images = StoredImage.objects.filter(pk=ref.sha256)
+    while not images.update(refcount=F("refcount") + 1):
+        try:
+            with transaction.atomic():
+                StoredImage.objects.create(
+                    sha256=ref.sha256, path=ref.path, size=ref.size, refcount=1
+                )
+            break
+        except IntegrityError:
+            continue
+    _ensure_file(ref)
+
+
+def acquire(owner, refs):
+    # owner - загрузка или запись кэша с полем images
+    refs = {ref.sha256: ref for ref in refs}
+    if not refs:
+        return
+    with transaction.atomic():
+        linked = set(owner.images.filter(pk__in=refs).values_list("pk", flat=True))
+        new = [ref for sha, ref in refs.items() if sha not in linked]
+        for ref in new:
+            _increment(ref)
+        owner.images.add(*[ref.sha256 for ref in new])
+
+
+def refs_of(owner):
+    return [
+        ImageRef(image.sha256, image.path, image.size) for image in owner.images.all()
+    ]
+
+
+def _move_to_trash(path):
+    os.makedirs(_trash_dir(), exist_ok=True)
+    trash_path = _trash_path(path)
+    try:
+        os.replace(image_path(path), trash_path)
+        os.utime(trash_path)
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def _sweep_trash():
+    cutoff = time.time() - settings.IMAGE_TRASH_TTL
+    try:
+        entries = list(os.scandir(_trash_dir()))
+    except FileNotFoundError:
+        return
+    for entry in entries:
+        try:
+            if entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+        except FileNotFoundError:
+            pass
+
+
+def release(owner):
+    with transaction.atomic():
+        shas = list(owner.images.values_list("pk", flat=True))
+        if not shas:
+            return 0
+        owner.images.clear()
+        images = StoredImage.objects.select_for_update().filter(pk__in=shas)
+        images.update(refcount=F("refcount") - 1)
+        orphans = list(images.filter(refcount=0))
+        for image in orphans:
+            # Файл переносим, пока строка заблокирована: acquire её не увидит
+            _move_to_trash(image.path)
+        StoredImage.objects.filter(pk__in=[image.pk for image in orphans]).delete()
+    if orphans:
+        logger.debug(f"Moved {len(orphans)} unreferenced images to the trash")
+    _sweep_trash()
+    return len(orphans)
+
+
+def discard(refs):
+    # Картинки, которые записали в хранилище, но ссылаться на них не стали.
+    # Файл уходит в корзину, только если строки нет; пустая строка на время
+    # переноса блокирует ключ, и одновременный acquire дождётся её удаления и
+    # вернёт файл из корзины
+    moved = 0
+    for ref in {ref.sha256: ref for ref in refs}.values():
+        try:
+            with transaction.atomic():
+                StoredImage.objects.create(
+                    sha256=ref.sha256, path=ref.path, size=ref.size, refcount=0
+                )
+                moved += _move_to_trash(ref.path)
+                StoredImage.objects.filter(pk=ref.sha256).delete()
+        except IntegrityError:
+            # На картинку уже ссылаются
+            continue
+    if moved:
+        logger.debug(f"Moved {moved} unused images to the trash")
+        _sweep_trash()
+    return moved
@@ -0,0 +1,205 @@
+import io
+import json
+import logging
+import os
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from .images import image_path, image_url, store_stream
+
+logger = logging.getLogger(__name__)
+
+# Оптимизация картинок: приводим к веб-форматам, уменьшаем до IMAGE_MAX_WIDTH,
+# пережимаем и по желанию делаем WebP и уменьшенные копии для srcset.
+# Pillow отпускает GIL на декодировании, ресайзе и кодировании, поэтому
+# картинки обрабатываются в общем пуле потоков. В пул уходит уже сохранённый
+# в хранилище исходник, а не его байты; submit ждёт свободный поток, так что
+# в памяти одновременно не больше IMAGE_WORKERS картинок
+
+# Ширина картинок в styles.css (max-width: 500px)
+DISPLAY_WIDTH = 500
+PENDING_PREFIX = "pending-image:"
+
+EXTENSIONS = {"JPEG": "jpeg", "PNG": "png", "WEBP": "webp"}
+# Режимы, которые Pillow сохраняет в PNG без преобразования
+_PNG_MODES = {"1", "L", "LA", "P", "RGB", "RGBA"}
+
+Optimized = namedtuple("Optimized", ["data", "ext", "width", "variants"])
+ProcessedImage = namedtuple(
+    "ProcessedImage", ["src", "srcset", "sizes", "refs", "zip_ref"]
+)
+
+_pool = None
+_slots = None
+_pool_lock = threading.Lock()
+
+
+def _reset():
+    # Потоки пула не переживают fork
+    global _pool, _slots, _pool_lock
+    _pool = None
+    _slots = None
+    _pool_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset)
+
+
+def _get_pool():
+    global _pool, _slots
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(
+                max_workers=settings.IMAGE_WORKERS, thread_name_prefix="image"
+            )
+            _slots = threading.BoundedSemaphore(settings.IMAGE_WORKERS)
+        return _pool, _slots
+
+
+def settings_key():
+    # Настройки, от которых зависит результат конвертации: входят в ключ кэша
+    return json.dumps(
+        [
+            settings.IMAGE_OPTIMIZE,
+            settings.IMAGE_MAX_WIDTH,
+            settings.IMAGE_QUALITY,
+            settings.IMAGE_WEBP,
+            list(settings.IMAGE_SRCSET_WIDTHS),
+            settings.IMAGE_ZIP_ORIGINALS,
+        ]
+    )
+
+
+def _encode(image, fmt):
+    buffer = io.BytesIO()
+    if fmt == "JPEG":
+        image.save(
+            buffer,
+            "JPEG",
+            quality=settings.IMAGE_QUALITY,
+            optimize=True,
+            progressive=True,
+        )
+    elif fmt == "WEBP":
+        image.save(buffer, "WEBP", quality=settings.IMAGE_QUALITY, method=4)
+    else:
+        image.save(buffer, fmt, optimize=True)
+    return buffer.getvalue()
+
+
+def _normalize(image, fmt):
+    # JPEG остаётся JPEG, остальное (BMP, TIFF, GIF...) переводим в PNG без потерь
+    if fmt == "JPEG":
+        return image if image.mode in ("L", "RGB") else image.convert("RGB")
+    if image.mode in _PNG_MODES:
+        return image
+    has_alpha = "A" in image.getbands() or "transparency" in image.info
+    return image.convert("RGBA" if has_alpha else "RGB")
+
+
+def _resize(image, width):
+    height = max(1, round(image.height * width / image.width))
+    return image.resize((width, height), Image.Resampling.LANCZOS)
+
+
+def optimize(path, size):
+    # None - картинку оставляем как есть (не растр, анимация, слишком большая).
+    # data None - исходник (size байт) уже сжат не хуже
+    try:
+        with Image.open(path) as image:
+            if getattr(image, "n_frames", 1) > 1:
+                return None
+            image.load()
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError) as e:
+        logger.debug(f"Keeping image as is: {e}")
+        return None
+
+    source_format = image.format
+    fmt = "JPEG" if source_format == "JPEG" else "PNG"
+    image = _normalize(ImageOps.exif_transpose(image), fmt)
+    resized = image.width > settings.IMAGE_MAX_WIDTH
+    if resized:
+        image = _resize(image, settings.IMAGE_MAX_WIDTH)
+    encoded = _encode(image, fmt)
+    if not resized and source_format == fmt and len(encoded) >= size:
+        encoded = None
+
+    variant_format = "WEBP" if settings.IMAGE_WEBP else fmt
+    variants = [
+        (_encode(_resize(image, width), variant_format), width)
+        for width in sorted(set(settings.IMAGE_SRCSET_WIDTHS))
+        if width < image.width
+    ]
+    if settings.IMAGE_WEBP:
+        variants.append((_encode(image, "WEBP"), image.width))
+    return Optimized(encoded, EXTENSIONS[fmt], image.width, variants)
+
+
+def _store(data, ext):
+    return store_stream(io.BytesIO(data), ext)
+
+
+def process_image(source, ext):
+    # source - ImageRef исходника в хранилище. Исходник попадает в refs, только
+    # если он сам идёт в документ или в архив; иначе вызывающий отдаёт его
+    # images.discard
+    optimized = None
+    if settings.IMAGE_OPTIMIZE:
+        try:
+            optimized = optimize(image_path(source.path), source.size)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not optimize a .{ext} image: {e}")
+    if optimized is None:
+        return ProcessedImage(image_url(source.path), None, None, [source], source)
+
+    main = source
+    if optimized.data is not None:
+        main = _store(optimized.data, optimized.ext)
+    zip_ref = source if settings.IMAGE_ZIP_ORIGINALS else main
+    refs = [main] if zip_ref is main else [main, zip_ref]
+    candidates = []
+    variant_ext = "webp" if settings.IMAGE_WEBP else optimized.ext
+    for variant, width in optimized.variants:
+        ref = _store(variant, variant_ext)
+        refs.append(ref)
+        candidates.append((ref, width))
+    if candidates and not settings.IMAGE_WEBP:
+        candidates.append((main, optimized.width))
+
+    srcset = sizes = None
+    if candidates:
+        srcset = ", ".join(
+            f"{image_url(ref.path)} {width}w" for ref, width in candidates
+        )
+        width = min(optimized.width, DISPLAY_WIDTH)
+        sizes = f"(max-width: {width}px) 100vw, {width}px"
+    return ProcessedImage(image_url(main.path), srcset, sizes, refs, zip_ref)
+
+
+def submit(source, ext):
+    # Блокирует, пока в работе IMAGE_WORKERS картинок
+    pool, slots = _get_pool()
+    slots.acquire()
+    try:
+        future = pool.submit(process_image, source, ext)
+    except BaseException:
+        slots.release()
+        raise
+    future.add_done_callback(lambda future: slots.release())
+    return future
+
+
+def apply_images(root, processed):
+    # Подставляет в <img> адреса обработанных картинок вместо временных
+    for img in root.iter("img"):
+        image = processed.get(img.get("src"))
+        if image is None:
+            continue
+        img.set("src", image.src)
+        if image.srcset:
+            img.set("srcset", image.srcset)
+            img.set("sizes", image.sizes)
@@ -0,0 +1,356 @@
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+from django.utils import timezone
+
+from . import cache as conversion_cache
+from . import compression
+from . import images as image_store
+from . import metrics
+from . import profiles
+from . import search
+from .export import ensure_download_html
+from .memory import current_rss_mb
+from .models import ConversionJob, DocumentUpload
+from .pdf import get_pdf
+from .utils import process_docx
+
+logger = logging.getLogger(__name__)
+
+PDF_WAIT_POLL_INTERVAL = 0.2
+
+
+def _enqueue(job):
+    if not settings.CONVERSION_QUEUE_ENABLED:
+        if claim_job(job.pk, "inline"):
+            job.refresh_from_db()
+            run_job(job)
+    return job
+
+
+def enqueue_conversion(upload, original_filename):
+    job = ConversionJob.objects.create(
+        upload=upload, original_filename=original_filename
+    )
+    logger.debug(f"Queued conversion job {job.id} for upload {upload.id}")
+    return _enqueue(job)
+
+
+def enqueue_conversions(uploads):
+    # Пачка задач одним запросом; без очереди их выполнит iter_finished_jobs
+    jobs = ConversionJob.objects.bulk_create(
+        ConversionJob(upload=upload, original_filename=upload.filename)
+        for upload in uploads
+    )
+    logger.debug(f"Queued {len(jobs)} conversion jobs")
+    return jobs
+
+
+def _run_inline(job_id):
+    try:
+        if claim_job(job_id, "inline"):
+            return run_job(
+                ConversionJob.objects.select_related("upload").get(pk=job_id)
+            )
+        return ConversionJob.objects.get(pk=job_id)
+    finally:
+        # У каждого потока своё соединение с БД
+        connection.close()
+
+
+def iter_finished_jobs(jobs, timeout):
+    # Выдаёт задачи по мере завершения, в каком бы порядке они ни закончились.
+    # По истечении timeout выдаёт оставшиеся в текущем состоянии
+    if not settings.CONVERSION_QUEUE_ENABLED:
+        with ThreadPoolExecutor(max_workers=settings.CONVERSION_WORKERS) as executor:
+            futures = [executor.submit(_run_inline, job.pk) for job in jobs]
+            for future in as_completed(futures):
+                yield future.result()
+        return
+
+    pending = {job.pk: job for job in jobs}
+    deadline = time.monotonic() + timeout
+    while pending and time.monotonic() < deadline:
+        finished = ConversionJob.objects.filter(
+            pk__in=list(pending),
+            status__in=[ConversionJob.STATUS_DONE, ConversionJob.STATUS_FAILED],
+        )
+        for job in finished:
+            del pending[job.pk]
+            yield job
+        if pending:
+            time.sleep(settings.CONVERSION_POLL_INTERVAL)
+    for job in ConversionJob.objects.filter(pk__in=list(pending)):
+        yield job
+
+
+async def aiter_finished_jobs(jobs, timeout):
+    # iter_finished_jobs для ASGI: ожидание не занимает поток
+    if not settings.CONVERSION_QUEUE_ENABLED:
+        executor = ThreadPoolExecutor(max_workers=settings.CONVERSION_WORKERS)
+        try:
+            futures = [
+                asyncio.wrap_future(executor.submit(_run_inline, job.pk))
+                for job in jobs
+            ]
+            for future in asyncio.as_completed(futures):
+                yield await future
+        finally:
+            # Клиент мог отключиться - не ждём оставшиеся конвертации
+            executor.shutdown(wait=False, cancel_futures=True)
+        return
+
+    pending = {job.pk: job for job in jobs}
+    deadline = time.monotonic() + timeout
+    while pending and time.monotonic() < deadline:
+        finished = ConversionJob.objects.filter(
+            pk__in=list(pending),
+            status__in=[ConversionJob.STATUS_DONE, ConversionJob.STATUS_FAILED],
+        )
+        async for job in finished:
+            del pending[job.pk]
+            yield job
+        if pending:
+            await asyncio.sleep(settings.CONVERSION_POLL_INTERVAL)
+    async for job in ConversionJob.objects.filter(pk__in=list(pending)):
+        yield job
+
+
+def _enqueue_once(upload, kind):
+    # Уже стоящую в очереди задачу переиспользуем
+    pending = ConversionJob.objects.filter(
+        upload=upload, kind=kind, status=ConversionJob.STATUS_QUEUED
+    ).first()
+    if pending is not None:
+        return pending
+    job = ConversionJob.objects.create(upload=upload, kind=kind)
+    logger.debug(f"Queued {kind} job {job.id} for upload {upload.id}")
+    return _enqueue(job)
+
+
+def enqueue_pdf_render(upload):
+    return _enqueue_once(upload, ConversionJob.KIND_PDF)
+
+
+def prerender_pdf(upload):
+    if settings.PDF_PRERENDER:
+        enqueue_pdf_render(upload)
+
+
+def precompress_html(upload):
+    if settings.PRECOMPRESS_ENABLED:
+        _enqueue_once(upload, ConversionJob.KIND_COMPRESS)
+
+
+def wait_for_job(job, timeout):
+    deadline = time.monotonic() + timeout
+    while not job.is_finished and time.monotonic() < deadline:
+        time.sleep(PDF_WAIT_POLL_INTERVAL)
+        job.refresh_from_db(fields=["status", "error", "finished_at"])
+    return job
+
+
+async def await_job(job, timeout):
+    # wait_for_job для async-представлений: ожидание не занимает поток
+    deadline = time.monotonic() + timeout
+    while not job.is_finished and time.monotonic() < deadline:
+        await asyncio.sleep(PDF_WAIT_POLL_INTERVAL)
+        await job.arefresh_from_db(fields=["status", "error", "finished_at"])
+    return job
+
+
+def claim_job(job_id, worker_name):
+    # Атомарный переход queued -> running: задачу получает только один воркер
+    return bool(
+        ConversionJob.objects.filter(
+            pk=job_id, status=ConversionJob.STATUS_QUEUED
+        ).update(
+            status=ConversionJob.STATUS_RUNNING,
+            started_at=timezone.now(),
+            worker=worker_name,
+        )
+    )
+
+
+def claim_next_job(worker_name, kinds=None):
+    candidates = (
+        ConversionJob.objects.filter(status=ConversionJob.STATUS_QUEUED)
+        .exclude(kind=ConversionJob.KIND_BATCH)
+        .order_by("created_at")
+    )
+    if kinds:
+        candidates = candidates.filter(kind__in=kinds)
+    for job_id in candidates.values_list("pk", flat=True)[:10]:
+        if claim_job(job_id, worker_name):
+            return ConversionJob.objects.select_related("upload").get(pk=job_id)
+    return None
+
+
+def convert_upload(upload, original_filename, timings):
+    docx_path = upload.docx_file.path
+    profile = profiles.for_upload(upload)
+    key = None
+    if settings.CONVERSION_CACHE_ENABLED:
+        started = time.perf_counter()
+        key = conversion_cache.cache_key(docx_path, profile)
+        try:
+            cached = conversion_cache.lookup(key, upload.id, original_filename)
+        except OSError as e:
+            logger.error(f"Conversion cache lookup failed for {key[:12]}: {e}")
+            cached = None
+        timings["cache_lookup"] = round(time.perf_counter() - started, 4)
+        metrics.observe_stage("cache_lookup", timings["cache_lookup"])
+        timings["cache_hit"] = cached is not None
+        if cached:
+            html_path, zip_path, html_filename, images = cached
+            image_store.acquire(upload, images)
+            search.index_html_file(upload.id, html_path)
+            return html_path, zip_path, html_filename
+
+    result = process_docx(docx_path, upload.id, original_filename, timings, profile)
+    image_store.acquire(upload, result.images)
+    if key:
+        try:
+            conversion_cache.store(
+                key, upload.id, result.html_path, result.zip_path, result.images
+            )
+        except OSError as e:
+            logger.error(f"Could not store conversion cache entry {key[:12]}: {e}")
+    return result.html_path, result.zip_path, result.html_filename
+
+
+def _run_conversion(job, timings):
+    upload = job.upload
+    html_path, zip_path, html_filename = convert_upload(
+        upload, job.original_filename, timings
+    )
+    DocumentUpload.objects.filter(pk=upload.pk).update(
+        html_file=os.path.relpath(html_path, settings.MEDIA_ROOT),
+        images_zip=os.path.relpath(zip_path, settings.MEDIA_ROOT),
+    )
+    logger.debug(f"Job {job.id} converted upload {upload.id}, HTML: {html_filename}")
+    upload.refresh_from_db()
+    upload.refresh_file_metadata()
+    prerender_pdf(upload)
+    precompress_html(upload)
+
+
+def _run_pdf_render(job, timings):
+    started = time.perf_counter()
+    pdf_path = get_pdf(job.upload.html_file.path, timeout=settings.PDF_JOB_TIMEOUT)
+    timings["render_pdf"] = round(time.perf_counter() - started, 4)
+    logger.debug(f"Job {job.id} rendered {pdf_path}")
+
+
+def _run_precompress(job, timings):
+    # Скачиваемую версию заодно собираем здесь, а не в запросе на скачивание
+    started = time.perf_counter()
+    html_path = job.upload.html_file.path
+    written = compression.precompress(html_path)
+    written += compression.precompress(ensure_download_html(html_path))
+    timings["precompress"] = round(time.perf_counter() - started, 4)
+    logger.debug(f"Job {job.id} wrote {len(written)} precompressed files")
+
+
+RUNNERS = {
+    ConversionJob.KIND_CONVERT: _run_conversion,
+    ConversionJob.KIND_BATCH: _run_conversion,
+    ConversionJob.KIND_PDF: _run_pdf_render,
+    ConversionJob.KIND_COMPRESS: _run_precompress,
+}
+
+
+def run_job(job):
+    upload = job.upload
+    timings = {"queued": round((job.started_at - job.created_at).total_seconds(), 4)}
+    started = time.perf_counter()
+    try:
+        RUNNERS[job.kind](job, timings)
+        job.status = ConversionJob.STATUS_DONE
+    except Exception as e:
+        logger.exception(f"Job {job.id} failed for upload {upload.id}")
+        job.status = ConversionJob.STATUS_FAILED
+        job.error = str(e)
+    timings["total"] = round(time.perf_counter() - started, 4)
+    job.stage_timings = timings
+    job.finished_at = timezone.now()
+    job.save(update_fields=["status", "error", "stage_timings", "finished_at"])
+    metrics.inc("docx_jobs_total", kind=job.kind, status=job.status)
+    metrics.observe("docx_job_seconds", timings["total"], kind=job.kind)
+    metrics.observe("docx_job_queued_seconds", timings["queued"], kind=job.kind)
+    metrics.flush()
+    return job
+
+
+def requeue_stale_jobs():
+    # Задачи, чей воркер умер посреди конвертации, возвращаем в очередь.
+    # Пакетные задачи очереди не принадлежат: их отмечаем как упавшие,
+    # повторный запуск convert_batch начнёт их заново
+    deadline = timezone.now() - timedelta(seconds=settings.CONVERSION_JOB_TIMEOUT)
+    stale = ConversionJob.objects.filter(
+        status=ConversionJob.STATUS_RUNNING, started_at__lt=deadline
+    )
+    failed = stale.filter(kind=ConversionJob.KIND_BATCH).update(
+        status=ConversionJob.STATUS_FAILED,
+        finished_at=timezone.now(),
+        error="Batch run stopped; run convert_batch again to resume",
+    )
+    count = stale.exclude(kind=ConversionJob.KIND_BATCH).update(
+        status=ConversionJob.STATUS_QUEUED, started_at=None, worker=""
+    )
+    if failed:
+        logger.warning(f"Marked {failed} stale batch jobs as failed")
+    if count:
+        logger.warning(f"Requeued {count} stale conversion jobs")
+    return count
+
+
+def conversion_kinds():
+    # При отдельном пуле рендеринга PDF-задачи забирает только он
+    if settings.PDF_POOL_ENABLED:
+        return [ConversionJob.KIND_CONVERT, ConversionJob.KIND_COMPRESS]
+    return None
+
+
+def work(worker_name, should_stop, kinds=None, should_recycle=None):
+    logger.info(f"Conversion worker {worker_name} started")
+    while not should_stop():
+        close_old_connections()
+        try:
+            job = claim_next_job(worker_name, kinds)
+        except Exception as e:
+            logger.error(f"Worker {worker_name} could not poll the queue: {e}")
+            job = None
+        if job is None:
+            time.sleep(settings.CONVERSION_POLL_INTERVAL)
+            continue
+        run_job(job)
+        if should_recycle is not None and should_recycle():
+            logger.info(f"Worker {worker_name} is recycling")
+            return
+    logger.info(f"Conversion worker {worker_name} stopped")
+
+
+def conversion_work(worker_name, should_stop):
+    work(worker_name, should_stop, kinds=conversion_kinds())
+
+
+def pdf_work(worker_name, should_stop):
+    jobs_done = 0
+
+    def should_recycle():
+        nonlocal jobs_done
+        jobs_done += 1
+        rss = current_rss_mb()
+        if rss > settings.PDF_WORKER_MAX_RSS_MB:
+            logger.info(f"{worker_name} uses {rss:.0f} MiB after {jobs_done} jobs")
+            return True
+        return jobs_done >= settings.PDF_WORKER_MAX_JOBS
+
+    work(worker_name, should_stop, [ConversionJob.KIND_PDF], should_recycle)
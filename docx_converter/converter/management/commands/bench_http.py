@@ -0,0 +1,68 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from converter.benchmarks import suite
+from converter.benchmarks.load import run_load
+
+
+class Command(BaseCommand):
+    help = (
+        "Send concurrent requests to a running server and report throughput; "
+        "run it against the WSGI and ASGI deployments and compare the two"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("urls", nargs="+", help="URLs requested in turn")
+        parser.add_argument("--concurrency", type=int, default=32)
+        parser.add_argument("--requests", type=int, default=500)
+        parser.add_argument("--timeout", type=float, default=60)
+        parser.add_argument(
+            "--slow-url", help="Large file downloaded by slow clients during the run"
+        )
+        parser.add_argument("--slow-clients", type=int, default=0)
+        parser.add_argument(
+            "--slow-rate",
+            type=int,
+            default=64 * 1024,
+            help="Bytes per second read by each slow client",
+        )
+        parser.add_argument("--label", default="", help="Name of this run")
+        parser.add_argument("--output", help="Results JSON file")
+        parser.add_argument(
+            "--baseline", help="Results of another run (e.g. WSGI) to compare with"
+        )
+
+    def handle(self, *args, **options):
+        if options["concurrency"] < 1 or options["requests"] < 1:
+            raise CommandError("--concurrency and --requests must be at least 1")
+        # Прогрев: первые запросы собирают бандл, индексы и кэши
+        run_load(options["urls"], concurrency=1, total=len(options["urls"]))
+        result = run_load(
+            options["urls"],
+            concurrency=options["concurrency"],
+            total=options["requests"],
+            timeout=options["timeout"],
+            slow_url=options["slow_url"],
+            slow_clients=options["slow_clients"],
+            slow_rate=options["slow_rate"],
+        )
+        result["label"] = options["label"]
+        result["urls"] = options["urls"]
+        self.stdout.write(
+            f"{options['label'] or 'run'}: {result['requests_per_second']} req/s, "
+            f"p50 {result['p50_ms']} ms, p95 {result['p95_ms']} ms, "
+            f"{result['errors']} errors ({result['statuses']})"
+        )
+        if options["output"]:
+            suite.save(result, options["output"])
+            self.stdout.write(f"Results written to {options['output']}")
+        if options["baseline"]:
+            baseline = suite.load(options["baseline"])
+            ratio = result["requests_per_second"] / max(
+                baseline["requests_per_second"], 1e-9
+            )
+            self.stdout.write(
+                f"x{ratio:.2f} throughput vs {baseline.get('label') or 'baseline'} "
+                f"({baseline['requests_per_second']} -> "
+                f"{result['requests_per_second']} req/s), p95 "
+                f"{baseline['p95_ms']} -> {result['p95_ms']} ms"
+            )
@@ -0,0 +1,67 @@
+import time
+from html import unescape
+
+from django.core.management.base import BaseCommand, CommandError
+
+from converter import postprocess
+from converter.benchmarks.corpus import classifier_corpus
+from converter.benchmarks.legacy import legacy_is_xml_like
+
+
+def _run(func, texts, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for text in texts:
+            func(text)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+class Command(BaseCommand):
+    help = "Micro-benchmark is_xml_like on paragraph and table cell strings"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--paragraphs", type=int, default=5000)
+        parser.add_argument("--tables", type=int, default=100)
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument(
+            "--max-ns",
+            type=float,
+            help="Fail if the classifier needs more than this many ns per string",
+        )
+
+    def handle(self, *args, **options):
+        texts = [
+            unescape(text.strip())
+            for text in classifier_corpus(options["paragraphs"], options["tables"])
+        ]
+        mismatches = [
+            text
+            for text in texts
+            if legacy_is_xml_like(text) != postprocess.is_xml_like(text)
+        ]
+        if mismatches:
+            raise CommandError(f"Classifier disagrees with legacy on: {mismatches[:5]}")
+
+        legacy_time = _run(legacy_is_xml_like, texts, options["repeat"])
+        postprocess._classify_cached.cache_clear()
+        cold_time = _run(postprocess.is_xml_like, texts, 1)
+        warm_time = _run(postprocess.is_xml_like, texts, options["repeat"])
+        per_call = warm_time / len(texts) * 1e9
+        cache = postprocess._classify_cached.cache_info()
+        markup = sum(postprocess.is_xml_like(text) for text in texts)
+        self.stdout.write(
+            f"{len(texts)} strings ({markup} markup, {len(set(texts))} distinct)\n"
+            f"legacy: {legacy_time * 1000:.1f} ms\n"
+            f"compiled, cold cache: {cold_time * 1000:.1f} ms "
+            f"(x{legacy_time / cold_time:.1f})\n"
+            f"compiled, warm cache: {warm_time * 1000:.1f} ms "
+            f"(x{legacy_time / warm_time:.1f}, {per_call:.0f} ns/string)\n"
+            f"cache: {cache.hits} hits, {cache.misses} misses, {cache.currsize} entries"
+        )
+        if options["max_ns"] and per_call > options["max_ns"]:
+            raise CommandError(
+                f"is_xml_like regressed: {per_call:.0f} ns/string > {options['max_ns']}"
+            )
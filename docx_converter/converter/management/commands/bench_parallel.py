@@ -0,0 +1,109 @@
+import os
+import time
+
+import mammoth
+from django.core.management.base import BaseCommand, CommandError
+
+from converter.benchmarks import suite
+from converter.benchmarks.corpus import synthetic_html
+from converter.parallel import postprocess_chunked
+from converter.postprocess import children_html, parse_fragment, postprocess
+from converter.profiles import STYLE_MAP, get_compiled
+
+
+def _timed(func, html_content, repeat):
+    # Разбор не входит в замер: он одинаков для обоих вариантов
+    best = None
+    output = None
+    for _ in range(repeat):
+        root = parse_fragment(html_content)
+        started = time.perf_counter()
+        func(root)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+        output = children_html(root)
+    return output, best
+
+
+class Command(BaseCommand):
+    help = (
+        "Post-process documents in chunks across a growing number of processes, "
+        "check the output against the single-process run and report the speedup"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("docx", nargs="*", help=".docx files to add to the corpus")
+        parser.add_argument(
+            "--workers",
+            default="2,4,8",
+            help="Comma-separated process counts to measure",
+        )
+        parser.add_argument(
+            "--sizes",
+            default="20000",
+            help="Comma-separated paragraph counts of the synthetic documents",
+        )
+        parser.add_argument("--repeat", type=int, default=3)
+        parser.add_argument("--output", help="Results JSON file")
+
+    def handle(self, *args, **options):
+        workers = [int(count) for count in options["workers"].split(",") if count]
+        if not workers or min(workers) < 2:
+            raise CommandError("--workers takes process counts of at least 2")
+        corpus = []
+        for size in [int(size) for size in options["sizes"].split(",") if size]:
+            html_content = synthetic_html(paragraphs=size, tables=size // 100, seed=0)
+            corpus.append((f"synthetic-{size}", html_content))
+        for path in options["docx"]:
+            with open(path, "rb") as docx_file:
+                result = mammoth.convert_to_html(
+                    docx_file,
+                    style_map=STYLE_MAP,
+                    convert_image=mammoth.images.img_element(
+                        lambda image: {"src": "/media/image"}
+                    ),
+                )
+            corpus.append((os.path.basename(path), result.value))
+
+        rules = get_compiled().rules
+        cpus = os.cpu_count() or 1
+        self.stdout.write(f"{cpus} CPU cores")
+        results = {"cpus": cpus, "documents": {}}
+        mismatches = 0
+        for name, html_content in corpus:
+            expected, single = _timed(
+                lambda root: postprocess(root, rules), html_content, options["repeat"]
+            )
+            runs = {1: single}
+            line = [f"{name}: {len(html_content) // 1024} KiB, 1 process {single:.3f}s"]
+            for count in workers:
+                # Первый проход запускает процессы пула, он не в счёт
+                _timed(
+                    lambda root: postprocess_chunked(root, rules, count),
+                    html_content,
+                    1,
+                )
+                actual, elapsed = _timed(
+                    lambda root: postprocess_chunked(root, rules, count),
+                    html_content,
+                    options["repeat"],
+                )
+                same = actual == expected
+                mismatches += not same
+                runs[count] = elapsed
+                line.append(
+                    f"{count}: {elapsed:.3f}s x{single / elapsed:.2f}"
+                    f"{'' if same else ' OUTPUT DIFFERS'}"
+                )
+            self.stdout.write(", ".join(line))
+            results["documents"][name] = {
+                "html_bytes": len(html_content),
+                "seconds": runs,
+            }
+        if options["output"]:
+            suite.save(results, options["output"])
+            self.stdout.write(f"Results written to {options['output']}")
+        if mismatches:
+            raise CommandError(
+                f"{mismatches} runs differ from the single-process output"
+            )
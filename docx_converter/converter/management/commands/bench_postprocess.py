@@ -0,0 +1,79 @@
+import time
+
+import mammoth
+from django.core.management.base import BaseCommand, CommandError
+
+from converter.benchmarks.corpus import WHITESPACE_HTML, synthetic_html
+from converter.benchmarks.legacy import legacy_postprocess
+from converter.postprocess import children_html, parse_fragment, postprocess
+from converter.profiles import STYLE_MAP
+
+
+def _single_pass(html_content):
+    root = parse_fragment(html_content)
+    postprocess(root)
+    return children_html(root)
+
+
+def _timed(func, html_content, repeat):
+    best = None
+    output = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        output = func(html_content)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return output, best
+
+
+class Command(BaseCommand):
+    help = (
+        "Check that the single-pass post-processing matches the legacy "
+        "BeautifulSoup pipeline byte for byte and measure the speedup"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("docx", nargs="*", help=".docx files to add to the corpus")
+        parser.add_argument(
+            "--sizes",
+            default="1000,10000,20000",
+            help="Comma-separated paragraph counts of the synthetic documents",
+        )
+        parser.add_argument("--seeds", type=int, default=3)
+        parser.add_argument("--repeat", type=int, default=3)
+
+    def handle(self, *args, **options):
+        corpus = [("whitespace", WHITESPACE_HTML)]
+        for size in [int(size) for size in options["sizes"].split(",") if size]:
+            for seed in range(options["seeds"]):
+                html_content = synthetic_html(
+                    paragraphs=size, tables=max(1, size // 100), seed=seed
+                )
+                corpus.append((f"synthetic-{size}-{seed}", html_content))
+        for path in options["docx"]:
+            with open(path, "rb") as docx_file:
+                result = mammoth.convert_to_html(
+                    docx_file,
+                    style_map=STYLE_MAP,
+                    convert_image=mammoth.images.img_element(
+                        lambda image: {"src": "/media/image"}
+                    ),
+                )
+            corpus.append((path, result.value))
+
+        mismatches = 0
+        for name, html_content in corpus:
+            expected, legacy_time = _timed(
+                legacy_postprocess, html_content, options["repeat"]
+            )
+            actual, new_time = _timed(_single_pass, html_content, options["repeat"])
+            same = expected == actual
+            mismatches += not same
+            self.stdout.write(
+                f"{name}: {len(html_content) // 1024} KiB, "
+                f"legacy {legacy_time:.3f}s, single-pass {new_time:.3f}s, "
+                f"x{legacy_time / new_time:.1f}, "
+                f"{'identical' if same else 'OUTPUT DIFFERS'}"
+            )
+        if mismatches:
+            raise CommandError(f"{mismatches} documents differ from the legacy output")
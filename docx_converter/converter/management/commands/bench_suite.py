@@ -0,0 +1,118 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from converter.benchmarks import suite
+from converter.benchmarks.documents import PROFILES
+
+
+def _names(value, allowed):
+    names = [name for name in value.split(",") if name]
+    unknown = sorted(set(names) - set(allowed))
+    if unknown:
+        raise CommandError(f"Unknown names: {', '.join(unknown)}")
+    return names
+
+
+class Command(BaseCommand):
+    help = (
+        "Time conversion, edit saves, download assembly and PDF rendering on a "
+        "generated .docx corpus and compare the results with a baseline"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--profiles",
+            default=",".join(PROFILES),
+            help=f"Comma-separated document shapes ({', '.join(PROFILES)})",
+        )
+        parser.add_argument(
+            "--stages",
+            default=",".join(suite.STAGES),
+            help=f"Comma-separated operations ({', '.join(suite.STAGES)})",
+        )
+        parser.add_argument("--scale", type=float, default=1.0)
+        parser.add_argument("--repeat", type=int, default=3)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--corpus-dir", help="Where generated documents are kept")
+        parser.add_argument(
+            "--output", default="benchmark-results.json", help="Results JSON file"
+        )
+        parser.add_argument(
+            "--baseline",
+            default="benchmark-baseline.json",
+            help="Baseline JSON to compare against",
+        )
+        parser.add_argument(
+            "--update-baseline",
+            action="store_true",
+            help="Store these results as the new baseline",
+        )
+        parser.add_argument(
+            "--threshold",
+            type=float,
+            default=0.2,
+            help="Relative slowdown or memory growth treated as a regression",
+        )
+
+    def handle(self, *args, **options):
+        if options["repeat"] < 1:
+            raise CommandError("--repeat must be at least 1")
+
+        def progress(name, result):
+            if "error" in result:
+                self.stderr.write(f"{name}: {result['error']}")
+                return
+            self.stdout.write(
+                f"{name}: median {result['median_seconds']:.3f}s, "
+                f"min {result['min_seconds']:.3f}s, "
+                f"+{result['memory_mb']:.0f} MiB (peak RSS "
+                f"{result['peak_rss_mb']:.0f} MiB)"
+            )
+
+        results = suite.run_suite(
+            profiles=_names(options["profiles"], PROFILES),
+            stages=_names(options["stages"], suite.STAGES),
+            scale=options["scale"],
+            repeat=options["repeat"],
+            seed=options["seed"],
+            corpus_dir=options["corpus_dir"],
+            progress=progress,
+        )
+        suite.save(results, options["output"])
+        self.stdout.write(f"Results written to {options['output']}")
+
+        baseline_path = options["baseline"]
+        if options["update_baseline"]:
+            suite.save(results, baseline_path)
+            self.stdout.write(f"Baseline updated: {baseline_path}")
+            return
+        if not os.path.exists(baseline_path):
+            self.stdout.write(
+                f"No baseline at {baseline_path}, run with --update-baseline"
+            )
+            return
+
+        baseline = suite.load(baseline_path)
+        if baseline["meta"].get("scale") != results["meta"]["scale"]:
+            raise CommandError("The baseline was recorded with a different --scale")
+        rows = suite.compare(results, baseline, options["threshold"])
+        for row in rows:
+            if "time_ratio" not in row:
+                self.stdout.write(f"{row['name']}: {row['status']}")
+                continue
+            self.stdout.write(
+                f"{row['name']}: {row['status']}, "
+                f"x{row['time_ratio']} time ({row['baseline_seconds']:.3f}s -> "
+                f"{row['median_seconds']:.3f}s), "
+                f"x{row['memory_ratio']} memory ({row['baseline_memory_mb']:.0f} -> "
+                f"{row['memory_mb']:.0f} MiB)"
+            )
+        regressions = [row["name"] for row in rows if row["status"] == "regression"]
+        failed = [
+            name for name, result in results["results"].items() if "error" in result
+        ]
+        if regressions or failed:
+            raise CommandError(
+                f"{len(regressions)} regressions, {len(failed)} failed operations"
+            )
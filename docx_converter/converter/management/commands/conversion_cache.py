@@ -0,0 +1,27 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from converter import cache as conversion_cache
+
+
+class Command(BaseCommand):
+    help = "Show conversion cache statistics, evict or clear the cache"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--evict",
+            type=int,
+            metavar="BYTES",
+            help="Evict least recently used entries until the cache fits in BYTES",
+        )
+        parser.add_argument(
+            "--clear", action="store_true", help="Remove every cache entry"
+        )
+
+    def handle(self, *args, **options):
+        if options["clear"]:
+            conversion_cache.clear()
+        elif options["evict"] is not None:
+            conversion_cache.evict(options["evict"])
+        self.stdout.write(json.dumps(conversion_cache.stats(), indent=2))
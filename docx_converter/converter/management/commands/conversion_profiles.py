@@ -0,0 +1,61 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from converter.models import ConversionProfile
+
+
+class Command(BaseCommand):
+    help = (
+        "List conversion profiles, load them from JSON files or write them to "
+        "a directory, one <name>.json per profile"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--load",
+            nargs="+",
+            metavar="FILE",
+            help="Create or update profiles from JSON files",
+        )
+        parser.add_argument(
+            "--dump", metavar="DIR", help="Write every profile to DIR/<name>.json"
+        )
+
+    def _load(self, path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            raise CommandError(f"{path}: {e}")
+        name = data.pop("name", None) or os.path.splitext(os.path.basename(path))[0]
+        unknown = set(data) - set(ConversionProfile.RULE_FIELDS) - {"description"}
+        if unknown:
+            raise CommandError(f"{path}: unknown fields {', '.join(sorted(unknown))}")
+        profile = ConversionProfile.objects.filter(name=name).first()
+        profile = profile or ConversionProfile(name=name)
+        for field, value in data.items():
+            setattr(profile, field, value)
+        profile.full_clean()
+        profile.save()
+        self.stdout.write(f"{profile.name}: version {profile.version}")
+
+    def handle(self, *args, **options):
+        for path in options["load"] or []:
+            self._load(path)
+        if options["dump"]:
+            os.makedirs(options["dump"], exist_ok=True)
+            for profile in ConversionProfile.objects.order_by("name"):
+                path = os.path.join(options["dump"], f"{profile.name}.json")
+                data = {"name": profile.name, "description": profile.description}
+                data.update(profile.rules())
+                with open(path, "w", encoding="utf-8") as f:
+                    json.dump(data, f, indent=2, ensure_ascii=False)
+                self.stdout.write(f"Wrote {path}")
+        if not options["load"] and not options["dump"]:
+            for profile in ConversionProfile.objects.order_by("name"):
+                self.stdout.write(
+                    f"{profile.name}: version {profile.version}, "
+                    f"updated {profile.updated_at:%Y-%m-%d %H:%M}"
+                )
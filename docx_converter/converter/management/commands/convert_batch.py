@@ -0,0 +1,73 @@
+import json
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from tqdm import tqdm
+
+from converter.batch import convert_batch, default_workers
+
+
+class Command(BaseCommand):
+    help = (
+        "Convert every .docx in the given directories or glob patterns in a pool "
+        "of processes; rerun with the same state file to resume"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("paths", nargs="+", help="Directories or glob patterns")
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=default_workers(),
+            help="Number of worker processes (default: CPU count)",
+        )
+        parser.add_argument(
+            "--state",
+            default=os.path.join(settings.MEDIA_ROOT, "batch", "state.jsonl"),
+            help="Progress log used to resume an interrupted run",
+        )
+        parser.add_argument(
+            "--summary", help="Where to write the JSON summary (default: next to state)"
+        )
+        parser.add_argument(
+            "--restart",
+            action="store_true",
+            help="Ignore the progress log and convert every file again",
+        )
+        parser.add_argument(
+            "--no-progress", action="store_true", help="Do not show the progress bar"
+        )
+
+    def handle(self, *args, **options):
+        if options["workers"] < 1:
+            raise CommandError("--workers must be at least 1")
+        summary_path = options["summary"] or os.path.join(
+            os.path.dirname(os.path.abspath(options["state"])),
+            f"summary-{timezone.now():%Y%m%d-%H%M%S}.json",
+        )
+        with tqdm(
+            unit="doc", disable=options["no_progress"], dynamic_ncols=True
+        ) as progress:
+            summary = convert_batch(
+                options["paths"],
+                options["state"],
+                workers=options["workers"],
+                resume=not options["restart"],
+                progress=progress,
+            )
+        if not summary["files"]:
+            raise CommandError("No .docx files matched")
+
+        with open(summary_path, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        self.stdout.write(
+            f"{summary['converted']} converted, {summary['failed']} failed, "
+            f"{summary['skipped']} already done in {summary['elapsed_seconds']}s "
+            f"({summary['files_per_second']} files/s); summary: {summary_path}"
+        )
+        for failure in summary["failures"]:
+            self.stderr.write(f"{failure['path']}: {failure['error']}")
+        if summary["interrupted"]:
+            raise CommandError("Interrupted, run the same command again to resume")
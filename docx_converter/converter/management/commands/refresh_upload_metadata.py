@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from converter.models import DocumentUpload
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-check upload files on disk and update the stored sizes and health "
+        "flags shown in the archive"
+    )
+
+    def handle(self, *args, **options):
+        checked = broken = 0
+        for upload in DocumentUpload.objects.iterator():
+            upload.refresh_file_metadata()
+            checked += 1
+            broken += not upload.is_valid()
+        self.stdout.write(f"Checked {checked} uploads, {broken} with missing files")
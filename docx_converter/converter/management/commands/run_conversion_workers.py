@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from converter.jobs import conversion_work, requeue_stale_jobs
+from converter.workers import WorkerPool
+
+
+class Command(BaseCommand):
+    help = "Run a pool of background workers that process queued .docx conversions"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=settings.CONVERSION_WORKERS,
+            help="Number of worker processes",
+        )
+
+    def handle(self, *args, **options):
+        requeue_stale_jobs()
+        self.stdout.write(f"Starting {options['workers']} conversion workers")
+        WorkerPool(options["workers"], conversion_work, name_prefix="convert").run()
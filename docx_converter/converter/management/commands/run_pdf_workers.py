@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from converter.jobs import pdf_work, requeue_stale_jobs
+from converter.pdf import warm_up
+from converter.workers import WorkerPool
+
+
+class Command(BaseCommand):
+    help = "Run a pool of long-lived PDF renderer processes"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=settings.PDF_WORKERS,
+            help="Number of renderer processes",
+        )
+
+    def handle(self, *args, **options):
+        requeue_stale_jobs()
+        # Шрифты и стили разогреваем до fork: их получат все воркеры,
+        # в том числе перезапущенные после переработки
+        warm_up()
+        self.stdout.write(f"Starting {options['workers']} PDF renderer workers")
+        WorkerPool(options["workers"], pdf_work, name_prefix="pdf").run()
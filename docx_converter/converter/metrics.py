@@ -0,0 +1,326 @@
+import atexit
+import fcntl
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Счётчики и гистограммы в формате Prometheus. Конвертация идёт в воркерах,
+# а /metrics отдаёт веб-процесс, поэтому каждый процесс периодически
+# сбрасывает свои значения в METRICS_DIR/<host>-<pid>-<метка>.json, а /metrics
+# складывает все файлы. Файлы умерших процессов /metrics переносит в общий
+# retired.json, чтобы каталог не рос. Процесс, чей файл так перенесли, хотя он
+# жив (долго молчал на другом хосте), дальше пишет только прирост
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+FLUSH_INTERVAL = 5
+RETIRED_NAME = "retired.json"
+EMPTY = {"counters": [], "histograms": []}
+LOCK_NAME = ".lock"
+
+METRICS = {
+    "docx_stage_seconds": ("histogram", "Time spent in each conversion stage"),
+    "docx_jobs_total": ("counter", "Finished background jobs by kind and status"),
+    "docx_job_seconds": ("histogram", "Background job run time by kind"),
+    "docx_job_queued_seconds": ("histogram", "Time jobs spent waiting in the queue"),
+    "docx_images_total": ("counter", "Images extracted from converted documents"),
+    "docx_pdf_requests_total": ("counter", "PDF requests by cache result"),
+}
+
+_counters = {}
+_histograms = {}
+_lock = threading.Lock()
+_last_flush = 0.0
+# Метка отличает процесс от прежнего с тем же pid
+_token = f"{time.time_ns():x}"
+# Значения на момент последней записи и уже перенесённые в retired.json
+_written = None
+_retired = {}
+
+
+def _reset():
+    # Форкнутый воркер не должен повторно отчитываться за родителя
+    global _lock, _last_flush, _token, _written
+    _counters.clear()
+    _histograms.clear()
+    _lock = threading.Lock()
+    _last_flush = 0.0
+    _token = f"{time.time_ns():x}"
+    _written = None
+    _retired.clear()
+
+
+os.register_at_fork(after_in_child=_reset)
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name, amount=1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+    _maybe_flush()
+
+
+def observe(name, seconds, **labels):
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            # Счётчики по корзинам, затем сумма и количество
+            histogram = _histograms[key] = [0] * (len(BUCKETS) + 2)
+        for position, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                histogram[position] += 1
+        histogram[-2] += seconds
+        histogram[-1] += 1
+    _maybe_flush()
+
+
+def observe_stage(stage, seconds):
+    observe("docx_stage_seconds", seconds, stage=stage)
+
+
+@contextmanager
+def timed(name, **labels):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started, **labels)
+
+
+def _values():
+    with _lock:
+        values = {("counter", key): value for key, value in _counters.items()}
+        for key, histogram in _histograms.items():
+            values["histogram", key] = list(histogram)
+    return values
+
+
+def _snapshot(values=None):
+    # Без уже перенесённого в retired.json
+    values = _values() if values is None else values
+    snapshot = {"counters": [], "histograms": []}
+    for (kind, (name, labels)), value in values.items():
+        retired = _retired.get((kind, (name, labels)))
+        if kind == "counter":
+            snapshot["counters"].append([name, labels, value - (retired or 0)])
+        else:
+            if retired is not None:
+                value = [now - before for now, before in zip(value, retired)]
+            snapshot["histograms"].append([name, labels, value])
+    return snapshot
+
+
+def _metrics_dir():
+    return settings.METRICS_DIR
+
+
+def _snapshot_name():
+    return f"{socket.gethostname()}-{os.getpid()}-{_token}.json"
+
+
+@contextmanager
+def _dir_lock():
+    # Запись снимка и перенос в retired.json не должны пересекаться
+    os.makedirs(_metrics_dir(), exist_ok=True)
+    with open(os.path.join(_metrics_dir(), LOCK_NAME), "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _write_json(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def flush():
+    global _last_flush, _written
+    _last_flush = time.monotonic()
+    path = os.path.join(_metrics_dir(), _snapshot_name())
+    try:
+        with _dir_lock():
+            if _written is not None and not os.path.exists(path):
+                # Файл перенесли в retired.json: записанное там уже учтено
+                _retired.clear()
+                _retired.update(_written)
+            values = _values()
+            _write_json(path, _snapshot(values))
+            _written = values
+    except OSError as e:
+        logger.warning(f"Could not write metrics to {path}: {e}")
+
+
+def _maybe_flush():
+    if time.monotonic() - _last_flush > FLUSH_INTERVAL:
+        flush()
+
+
+def flush_at_exit():
+    # Последние FLUSH_INTERVAL секунд иначе терялись бы. Процессы
+    # multiprocessing выходят через os._exit и вызывают это сами
+    if _counters or _histograms:
+        flush()
+
+
+atexit.register(flush_at_exit)
+
+
+def _is_retired(name, now):
+    # Процесс этого хоста проверяем по pid, процессы других хостов - по
+    # возрасту файла
+    try:
+        age = now - os.path.getmtime(os.path.join(_metrics_dir(), name))
+    except FileNotFoundError:
+        return False
+    if age > settings.METRICS_SNAPSHOT_TTL:
+        return True
+    parts = name[: -len(".json")].rsplit("-", 2)
+    if len(parts) != 3 or parts[0] != socket.gethostname() or not parts[1].isdigit():
+        return False
+    try:
+        os.kill(int(parts[1]), 0)
+    except ProcessLookupError:
+        return True
+    except OSError:
+        pass
+    return False
+
+
+def _read_snapshot(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning(f"Skipping metrics file {path}: {e}")
+        return None
+
+
+def _merge(counters, histograms, snapshot):
+    for name, labels, value in snapshot["counters"]:
+        key = name, tuple(map(tuple, labels))
+        counters[key] = counters.get(key, 0) + value
+    for name, labels, values in snapshot["histograms"]:
+        key = name, tuple(map(tuple, labels))
+        total = histograms.setdefault(key, [0] * len(values))
+        for position, value in enumerate(values):
+            total[position] += value
+
+
+def _retire(names):
+    # Складывает снимки умерших процессов в retired.json, возвращает остальные
+    now = time.time()
+    retired = [name for name in names if _is_retired(name, now)]
+    if not retired:
+        return names
+    with _dir_lock():
+        retired_path = os.path.join(_metrics_dir(), RETIRED_NAME)
+        counters = {}
+        histograms = {}
+        _merge(counters, histograms, _read_snapshot(retired_path) or EMPTY)
+        for name in retired:
+            snapshot = _read_snapshot(os.path.join(_metrics_dir(), name))
+            if snapshot is not None:
+                _merge(counters, histograms, snapshot)
+        _write_json(
+            retired_path,
+            {
+                "counters": [
+                    [name, labels, value] for (name, labels), value in counters.items()
+                ],
+                "histograms": [
+                    [name, labels, values]
+                    for (name, labels), values in histograms.items()
+                ],
+            },
+        )
+        for name in retired:
+            try:
+                os.remove(os.path.join(_metrics_dir(), name))
+            except FileNotFoundError:
+                pass
+    logger.info(f"Folded {len(retired)} metrics files of finished processes")
+    return [name for name in names if name not in retired]
+
+
+def _load_snapshots():
+    own_name = _snapshot_name()
+    yield _snapshot()
+    try:
+        names = os.listdir(_metrics_dir())
+    except FileNotFoundError:
+        return
+    names = [
+        name
+        for name in names
+        if name.endswith(".json") and name not in (own_name, RETIRED_NAME)
+    ]
+    try:
+        names = _retire(names)
+    except OSError as e:
+        logger.warning(f"Could not fold old metrics files: {e}")
+    for name in [RETIRED_NAME, *names]:
+        snapshot = _read_snapshot(os.path.join(_metrics_dir(), name))
+        if snapshot is not None:
+            yield snapshot
+
+
+def collect():
+    counters = {}
+    histograms = {}
+    for snapshot in _load_snapshots():
+        _merge(counters, histograms, snapshot)
+    return counters, histograms
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels, extra=()):
+    pairs = [*labels, *extra]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def render():
+    counters, histograms = collect()
+    lines = []
+    for name, (kind, help_text) in METRICS.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        if kind == "counter":
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f"{name}{_labels(labels)} {value}")
+            continue
+        for (metric, labels), values in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = values[: len(BUCKETS)]
+            for bound, count in zip(BUCKETS, cumulative):
+                lines.append(f"{name}_bucket{_labels(labels, [('le', bound)])} {count}")
+            lines.append(
+                f"{name}_bucket{_labels(labels, [('le', '+Inf')])} {values[-1]}"
+            )
+            lines.append(f"{name}_sum{_labels(labels)} {values[-2]}")
+            lines.append(f"{name}_count{_labels(labels)} {values[-1]}")
+    return "\n".join(lines) + "\n"
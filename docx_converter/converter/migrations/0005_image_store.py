@@ -0,0 +1,40 @@
+# Generated by Django 5.2 on 2026-10-18 10:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("converter", "0004_conversion_cache"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="StoredImage",
+            fields=[
+                (
+                    "sha256",
+                    models.CharField(max_length=64, primary_key=True, serialize=False),
+                ),
+                ("path", models.CharField(max_length=255)),
+                ("size", models.BigIntegerField(default=0)),
+                ("refcount", models.PositiveIntegerField(default=0)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name="conversioncacheentry",
+            name="images",
+            field=models.ManyToManyField(
+                blank=True, related_name="cache_entries", to="converter.storedimage"
+            ),
+        ),
+        migrations.AddField(
+            model_name="documentupload",
+            name="images",
+            field=models.ManyToManyField(
+                blank=True, related_name="uploads", to="converter.storedimage"
+            ),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2 on 2026-10-18 10:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("converter", "0005_image_store"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="conversionjob",
+            name="kind",
+            field=models.CharField(
+                choices=[("convert", "Convert .docx"), ("pdf", "Render PDF")],
+                default="convert",
+                max_length=16,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="conversionjob",
+            name="original_filename",
+            field=models.CharField(blank=True, max_length=255),
+        ),
+    ]
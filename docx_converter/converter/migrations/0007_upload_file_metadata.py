@@ -0,0 +1,89 @@
+# Generated by Django 5.2 on 2026-10-18 10:11
+
+import os
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def backfill_file_metadata(apps, schema_editor):
+    DocumentUpload = apps.get_model("converter", "DocumentUpload")
+
+    def size(field_file):
+        if not field_file:
+            return None
+        try:
+            return os.path.getsize(field_file.path)
+        except OSError:
+            return None
+
+    for upload in DocumentUpload.objects.iterator():
+        upload.filename = os.path.basename(upload.docx_file.name)
+        upload.search_name = upload.filename.lower()
+        upload.docx_size = size(upload.docx_file)
+        upload.html_size = size(upload.html_file)
+        upload.zip_size = size(upload.images_zip)
+        upload.files_checked_at = timezone.now()
+        upload.save(
+            update_fields=[
+                "filename",
+                "search_name",
+                "docx_size",
+                "html_size",
+                "zip_size",
+                "files_checked_at",
+            ]
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("converter", "0006_conversionjob_kind"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="documentupload",
+            name="docx_size",
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="documentupload",
+            name="filename",
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name="documentupload",
+            name="files_checked_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="documentupload",
+            name="html_size",
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="documentupload",
+            name="search_name",
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name="documentupload",
+            name="zip_size",
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="documentupload",
+            index=models.Index(
+                fields=["uploaded_at", "id"], name="converter_d_uploade_74c433_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="documentupload",
+            index=models.Index(
+                fields=["search_name", "id"], name="converter_d_search__fca79b_idx"
+            ),
+        ),
+        migrations.RunPython(backfill_file_metadata, migrations.RunPython.noop),
+    ]
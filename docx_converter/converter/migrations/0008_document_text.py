@@ -0,0 +1,102 @@
+# Generated by Django 5.2 on 2026-10-18 10:11
+
+import os
+
+import django.db.models.deletion
+from django.db import migrations, models
+from lxml import etree
+
+SQLITE_FORWARD = [
+    "CREATE VIRTUAL TABLE converter_documenttext_fts USING fts5("
+    "text, content='converter_documenttext', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER converter_documenttext_ai AFTER INSERT ON converter_documenttext "
+    "BEGIN INSERT INTO converter_documenttext_fts(rowid, text) "
+    "VALUES (new.id, new.text); END",
+    "CREATE TRIGGER converter_documenttext_ad AFTER DELETE ON converter_documenttext "
+    "BEGIN INSERT INTO converter_documenttext_fts(converter_documenttext_fts, rowid, text) "
+    "VALUES ('delete', old.id, old.text); END",
+    "CREATE TRIGGER converter_documenttext_au AFTER UPDATE ON converter_documenttext "
+    "BEGIN INSERT INTO converter_documenttext_fts(converter_documenttext_fts, rowid, text) "
+    "VALUES ('delete', old.id, old.text); "
+    "INSERT INTO converter_documenttext_fts(rowid, text) VALUES (new.id, new.text); END",
+]
+SQLITE_BACKWARD = [
+    "DROP TRIGGER IF EXISTS converter_documenttext_au",
+    "DROP TRIGGER IF EXISTS converter_documenttext_ad",
+    "DROP TRIGGER IF EXISTS converter_documenttext_ai",
+    "DROP TABLE IF EXISTS converter_documenttext_fts",
+]
+# tsvector ограничен 1 МБ, поэтому индексируем начало очень длинных документов
+POSTGRES_FORWARD = [
+    "ALTER TABLE converter_documenttext ADD COLUMN search_vector tsvector "
+    "GENERATED ALWAYS AS (to_tsvector('simple', left(text, 500000))) STORED",
+    "CREATE INDEX converter_documenttext_search_idx "
+    "ON converter_documenttext USING GIN (search_vector)",
+]
+POSTGRES_BACKWARD = [
+    "DROP INDEX IF EXISTS converter_documenttext_search_idx",
+    "ALTER TABLE converter_documenttext DROP COLUMN IF EXISTS search_vector",
+]
+
+
+def _run(statements_by_vendor):
+    def run(apps, schema_editor):
+        statements = statements_by_vendor.get(schema_editor.connection.vendor, [])
+        for statement in statements:
+            schema_editor.execute(statement)
+
+    return run
+
+
+def backfill_text(apps, schema_editor):
+    DocumentUpload = apps.get_model("converter", "DocumentUpload")
+    DocumentText = apps.get_model("converter", "DocumentText")
+    parser = etree.HTMLParser(huge_tree=True)
+    for upload in DocumentUpload.objects.exclude(html_file="").iterator():
+        if not upload.html_file or not os.path.exists(upload.html_file.path):
+            continue
+        body = etree.parse(upload.html_file.path, parser).find("body")
+        if body is None:
+            continue
+        text = " ".join(" ".join(body.itertext()).split())
+        DocumentText.objects.update_or_create(upload=upload, defaults={"text": text})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("converter", "0007_upload_file_metadata"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DocumentText",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("text", models.TextField(blank=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "upload",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="document_text",
+                        to="converter.documentupload",
+                    ),
+                ),
+            ],
+        ),
+        migrations.RunPython(
+            _run({"sqlite": SQLITE_FORWARD, "postgresql": POSTGRES_FORWARD}),
+            _run({"sqlite": SQLITE_BACKWARD, "postgresql": POSTGRES_BACKWARD}),
+        ),
+        migrations.RunPython(backfill_text, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2 on 2026-10-18 10:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("converter", "0008_document_text"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="conversionjob",
+            name="kind",
+            field=models.CharField(
+                choices=[
+                    ("convert", "Convert .docx"),
+                    ("pdf", "Render PDF"),
+                    ("compress", "Precompress HTML"),
+                ],
+                default="convert",
+                max_length=16,
+            ),
+        ),
+    ]
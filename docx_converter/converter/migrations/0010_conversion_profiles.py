@@ -0,0 +1,77 @@
+# Generated by Django 5.2 on 2026-10-18 10:56
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("converter", "0009_conversionjob_compress_kind"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ConversionProfile",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.SlugField(max_length=64, unique=True)),
+                ("description", models.CharField(blank=True, max_length=255)),
+                (
+                    "style_map",
+                    models.TextField(
+                        blank=True, help_text="mammoth style map, one mapping per line"
+                    ),
+                ),
+                (
+                    "detect_code",
+                    models.BooleanField(
+                        default=True,
+                        help_text="Turn paragraphs and cells with markup into code",
+                    ),
+                ),
+                (
+                    "plain_html_tags",
+                    models.CharField(
+                        default="p,b,i,div,span,a,strong,em",
+                        help_text="Text starting with these tags is not treated as code",
+                        max_length=255,
+                    ),
+                ),
+                ("code_language", models.SlugField(default="markup", max_length=32)),
+                (
+                    "table_class",
+                    models.CharField(default="default-bordered-table", max_length=100),
+                ),
+                (
+                    "table_header_row",
+                    models.BooleanField(
+                        default=True,
+                        help_text="Mark the first row as header when there is no <th>",
+                    ),
+                ),
+                ("extra_css", models.TextField(blank=True)),
+                ("version", models.PositiveIntegerField(default=1, editable=False)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name="documentupload",
+            name="profile",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="uploads",
+                to="converter.conversionprofile",
+            ),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2 on 2026-10-18 11:18
+
+from django.db import migrations, models
+
+
+def mark_batch_jobs(apps, schema_editor):
+    # Раньше пакетные задачи отличались только полем worker
+    ConversionJob = apps.get_model("converter", "ConversionJob")
+    ConversionJob.objects.filter(kind="convert", worker__endswith="batch").update(
+        kind="batch"
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("converter", "0010_conversion_profiles"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="conversionjob",
+            name="kind",
+            field=models.CharField(
+                choices=[
+                    ("convert", "Convert .docx"),
+                    ("pdf", "Render PDF"),
+                    ("compress", "Precompress HTML"),
+                    ("batch", "Convert .docx (batch run)"),
+                ],
+                default="convert",
+                max_length=16,
+            ),
+        ),
+        migrations.RunPython(mark_batch_jobs, migrations.RunPython.noop),
+    ]
@@ -2,27 +2,233 @@ import os
 import uuid
 
 from django.db import models
+from django.utils import timezone
+
+# Поля с размерами файлов: None - файла нет
+FILE_SIZE_FIELDS = {
+    "docx_file": "docx_size",
+    "html_file": "html_size",
+    "images_zip": "zip_size",
+}
+
+
+def file_size(field_file):
+    if not field_file:
+        return None
+    try:
+        return os.path.getsize(field_file.path)
+    except OSError:
+        return None
+
+
+class ConversionProfile(models.Model):
+    # Правила конвертации для шаблона Word: style map mammoth, распознавание
+    # кода, оформление таблиц и дополнительный CSS в <head> документа.
+    # version растёт при каждом изменении правил: по ней процессы сбрасывают
+    # скомпилированный профиль, она же входит в ключ кэша конвертаций
+    RULE_FIELDS = [
+        "style_map",
+        "detect_code",
+        "plain_html_tags",
+        "code_language",
+        "table_class",
+        "table_header_row",
+        "extra_css",
+    ]
+
+    name = models.SlugField(max_length=64, unique=True)
+    description = models.CharField(max_length=255, blank=True)
+    style_map = models.TextField(
+        blank=True, help_text="mammoth style map, one mapping per line"
+    )
+    detect_code = models.BooleanField(
+        default=True, help_text="Turn paragraphs and cells with markup into code"
+    )
+    plain_html_tags = models.CharField(
+        max_length=255,
+        default="p,b,i,div,span,a,strong,em",
+        help_text="Text starting with these tags is not treated as code",
+    )
+    code_language = models.SlugField(max_length=32, default="markup")
+    table_class = models.CharField(max_length=100, default="default-bordered-table")
+    table_header_row = models.BooleanField(
+        default=True, help_text="Mark the first row as header when there is no <th>"
+    )
+    extra_css = models.TextField(blank=True)
+    version = models.PositiveIntegerField(default=1, editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.name
+
+    def rules(self):
+        return {name: getattr(self, name) for name in self.RULE_FIELDS}
+
+    def save(self, *args, **kwargs):
+        if self.pk:
+            previous = ConversionProfile.objects.filter(pk=self.pk).first()
+            if previous is not None and previous.rules() != self.rules():
+                self.version = previous.version + 1
+        super().save(*args, **kwargs)
 
 
 class DocumentUpload(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     docx_file = models.FileField(upload_to="uploads/%Y/%m/%d/", max_length=255)
     uploaded_at = models.DateTimeField(auto_now_add=True)
+    filename = models.CharField(max_length=255, blank=True)
+    # Имя в нижнем регистре для поиска по префиксу через индекс
+    search_name = models.CharField(max_length=255, blank=True)
     html_file = models.FileField(
         upload_to="output/%Y/%m/%d/", blank=True, null=True, max_length=255
     )
     images_zip = models.FileField(
         upload_to="output/%Y/%m/%d/", blank=True, null=True, max_length=255
     )
+    images = models.ManyToManyField("StoredImage", blank=True, related_name="uploads")
+    # None - встроенный профиль по умолчанию
+    profile = models.ForeignKey(
+        ConversionProfile,
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True,
+        related_name="uploads",
+    )
+    # Состояние файлов хранится в БД, чтобы архив не ходил на диск
+    docx_size = models.BigIntegerField(blank=True, null=True)
+    html_size = models.BigIntegerField(blank=True, null=True)
+    zip_size = models.BigIntegerField(blank=True, null=True)
+    files_checked_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["uploaded_at", "id"]),
+            models.Index(fields=["search_name", "id"]),
+        ]
 
     def __str__(self):
         return f"Upload {self.id}"
 
+    def save(self, *args, **kwargs):
+        self.search_name = self.filename.lower()
+        super().save(*args, **kwargs)
+
     def is_valid(self):
         return all(
-            [
-                self.html_file and os.path.exists(self.html_file.path),
-                self.images_zip and os.path.exists(self.images_zip.path),
-                self.docx_file and os.path.exists(self.docx_file.path),
-            ]
+            size is not None for size in (self.docx_size, self.html_size, self.zip_size)
+        )
+
+    @property
+    def total_size(self):
+        return sum(
+            size or 0 for size in (self.docx_size, self.html_size, self.zip_size)
         )
+
+    def refresh_file_metadata(self):
+        metadata = {
+            size_field: file_size(getattr(self, file_field))
+            for file_field, size_field in FILE_SIZE_FIELDS.items()
+        }
+        metadata["files_checked_at"] = timezone.now()
+        for name, value in metadata.items():
+            setattr(self, name, value)
+        DocumentUpload.objects.filter(pk=self.pk).update(**metadata)
+
+
+class ConversionJob(models.Model):
+    STATUS_QUEUED = "queued"
+    STATUS_RUNNING = "running"
+    STATUS_DONE = "done"
+    STATUS_FAILED = "failed"
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, "Queued"),
+        (STATUS_RUNNING, "Running"),
+        (STATUS_DONE, "Done"),
+        (STATUS_FAILED, "Failed"),
+    ]
+    KIND_CONVERT = "convert"
+    KIND_PDF = "pdf"
+    KIND_COMPRESS = "compress"
+    # Задачи convert_batch: их выполняет только сам пакетный запуск
+    KIND_BATCH = "batch"
+    KIND_CHOICES = [
+        (KIND_CONVERT, "Convert .docx"),
+        (KIND_PDF, "Render PDF"),
+        (KIND_COMPRESS, "Precompress HTML"),
+        (KIND_BATCH, "Convert .docx (batch run)"),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    upload = models.ForeignKey(
+        DocumentUpload, on_delete=models.CASCADE, related_name="jobs"
+    )
+    kind = models.CharField(max_length=16, choices=KIND_CHOICES, default=KIND_CONVERT)
+    original_filename = models.CharField(max_length=255, blank=True)
+    status = models.CharField(
+        max_length=16, choices=STATUS_CHOICES, default=STATUS_QUEUED
+    )
+    stage_timings = models.JSONField(default=dict, blank=True)
+    error = models.TextField(blank=True)
+    worker = models.CharField(max_length=64, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["status", "created_at"])]
+
+    def __str__(self):
+        return f"Job {self.id} ({self.status})"
+
+    @property
+    def is_finished(self):
+        return self.status in (self.STATUS_DONE, self.STATUS_FAILED)
+
+
+class ConversionCacheEntry(models.Model):
+    key = models.CharField(max_length=64, primary_key=True)
+    source_upload_id = models.UUIDField()
+    html_filename = models.CharField(max_length=255)
+    zip_filename = models.CharField(max_length=255)
+    size_bytes = models.BigIntegerField(default=0)
+    hits = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    images = models.ManyToManyField(
+        "StoredImage", blank=True, related_name="cache_entries"
+    )
+
+    def __str__(self):
+        return f"Cache entry {self.key[:12]}"
+
+
+class CacheCounter(models.Model):
+    name = models.CharField(max_length=32, primary_key=True)
+    value = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name}={self.value}"
+
+
+class StoredImage(models.Model):
+    sha256 = models.CharField(max_length=64, primary_key=True)
+    path = models.CharField(max_length=255)
+    size = models.BigIntegerField(default=0)
+    refcount = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Image {self.sha256[:12]} ({self.refcount} refs)"
+
+
+class DocumentText(models.Model):
+    # Текст документа для полнотекстового поиска. Индекс ведёт сама БД:
+    # tsvector + GIN в PostgreSQL, внешняя таблица FTS5 в SQLite (миграция 0008)
+    upload = models.OneToOneField(
+        DocumentUpload, on_delete=models.CASCADE, related_name="document_text"
+    )
+    text = models.TextField(blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Text of upload {self.upload_id}"
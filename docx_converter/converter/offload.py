@@ -0,0 +1,72 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+
+# Пулы для async-представлений: блокирующий файловый ввод-вывод и тяжёлые
+# вызовы (конвертация, сохранение правки, сборка скачиваемой версии, PDF)
+# не должны занимать цикл событий. Пул для тяжёлых вызовов маленький: наплыв
+# запросов ждёт в очереди, а не запускает десятки конвертаций разом
+
+_pools = {}
+_lock = threading.Lock()
+
+
+def _reset():
+    # Потоки пулов не переживают fork
+    global _lock
+    _pools.clear()
+    _lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset)
+
+
+def _get_pool(kind):
+    with _lock:
+        if kind not in _pools:
+            workers = (
+                settings.ASYNC_CPU_WORKERS
+                if kind == "cpu"
+                else settings.ASYNC_IO_WORKERS
+            )
+            _pools[kind] = ThreadPoolExecutor(
+                max_workers=workers, thread_name_prefix=f"async-{kind}"
+            )
+        return _pools[kind]
+
+
+def _call(func, args, kwargs):
+    # У каждого потока пула своё соединение с БД. Как и запрос Django,
+    # закрываем его до и после вызова, только если истёк CONN_MAX_AGE или
+    # соединение сломано; иначе следующий вызов в этом потоке его переиспользует
+    close_old_connections()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+async def _run(kind, func, args, kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_pool(kind), _call, func, args, kwargs)
+
+
+async def run_io(func, *args, **kwargs):
+    return await _run("io", func, args, kwargs)
+
+
+async def run_cpu(func, *args, **kwargs):
+    return await _run("cpu", func, args, kwargs)
+
+
+def _read_text(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+async def read_text(path):
+    return await run_io(_read_text, path)
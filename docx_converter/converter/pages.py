@@ -0,0 +1,66 @@
+import hashlib
+import os
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.cache import patch_cache_control
+from django.utils.http import http_date
+
+# Кэш страниц результата и редактора. Версия страницы - (mtime_ns, размер)
+# HTML-файла: ETag и записи кэша сверяются с ней, поэтому страница,
+# закэшированная другим процессом до правки, не отдаётся. invalidate()
+# освобождает память сразу после сохранения и удаления.
+# Меняем PAGES_VERSION при изменении шаблонов страниц
+
+PAGES_VERSION = "1"
+KINDS = ("result", "edit")
+
+
+def html_version(stat):
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _cache():
+    return caches[settings.PAGE_CACHE_ALIAS]
+
+
+def _key(kind, upload_id):
+    return f"{kind}:{upload_id}"
+
+
+def lookup(kind, upload_id, html_path):
+    # (версия, закэшированное значение или None); FileNotFoundError, если файла нет
+    version = html_version(os.stat(html_path))
+    if not settings.PAGE_CACHE_ENABLED:
+        return version, None
+    entry = _cache().get(_key(kind, upload_id))
+    if entry is not None and entry[0] == version:
+        return version, entry[1]
+    return version, None
+
+
+def store(kind, upload_id, version, value, size):
+    if settings.PAGE_CACHE_ENABLED and size <= settings.PAGE_CACHE_MAX_BYTES:
+        _cache().set(_key(kind, upload_id), (version, value))
+
+
+def invalidate(upload_id):
+    _cache().delete_many([_key(kind, upload_id) for kind in KINDS])
+
+
+def etag(kind, version, *parts):
+    digest = hashlib.sha256(
+        "\0".join([PAGES_VERSION, kind, *map(str, version), *parts]).encode("utf-8")
+    ).hexdigest()
+    return f'"{digest[:20]}"'
+
+
+def add_validators(response, tag, version, private=False):
+    # no-cache: браузер хранит страницу, но каждый раз сверяет ETag
+    response["ETag"] = tag
+    response["Last-Modified"] = http_date(version[0] / 1e9)
+    if private:
+        patch_cache_control(response, no_cache=True, private=True)
+    else:
+        patch_cache_control(response, no_cache=True)
+    return response
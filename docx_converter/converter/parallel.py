@@ -0,0 +1,172 @@
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from multiprocessing.util import Finalize
+
+from django.conf import settings
+from lxml import etree
+
+from .postprocess import _remove, continues_run, postprocess
+
+logger = logging.getLogger(__name__)
+
+# Постобработка больших документов кусками в пуле процессов. Документ режется
+# только между элементами верхнего уровня, так что таблица всегда целиком в
+# одном куске. Куски ходят между процессами как XML: его разбор не меняет
+# дерево, в отличие от повторного разбора HTML. Серии <pre> на стыках кусков
+# склеиваются здесь же, результат совпадает с postprocess() по всему дереву
+
+# Кусков больше, чем процессов: так они меньше ждут самый медленный кусок
+CHUNKS_PER_WORKER = 4
+
+_HEAD = "data-chunk-head"
+_OPEN = "data-chunk-open"
+
+_pools = {}
+_lock = threading.Lock()
+
+
+def _reset():
+    # Процессы пула принадлежат родителю и после fork недоступны
+    global _lock
+    _pools.clear()
+    _lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset)
+
+
+def _shutdown():
+    for pool in _pools.values():
+        pool.shutdown(cancel_futures=True)
+    _pools.clear()
+
+
+def _get_pool(workers):
+    # Процессы пула запускаются через spawn: в процессе конвертации уже
+    # работают потоки (пул imaging, пулы offload, потоки gunicorn), и fork мог
+    # бы унести в дочерний процесс чужую захваченную блокировку, а forkserver
+    # не переживает fork воркеров
+    with _lock:
+        if workers not in _pools:
+            if not _pools:
+                # Воркеры из workers и batch выходят через os._exit мимо
+                # atexit; финализаторы multiprocessing выполняются и там.
+                # Приоритет выше, чем у закрытия очередей пула (10)
+                Finalize(None, _shutdown, exitpriority=20)
+            _pools[workers] = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return _pools[workers]
+
+
+def use_chunks(html_size):
+    return (
+        settings.POSTPROCESS_WORKERS > 1
+        and html_size >= settings.POSTPROCESS_PARALLEL_MIN_BYTES
+    )
+
+
+def split(root, parts):
+    # Элементы верхнего уровня переносятся в контейнеры кусков примерно
+    # равного веса (элемент и его прямые потомки); текст до первого элемента
+    # остаётся в root. Каждый контейнер сериализуется одним вызовом
+    children = list(root)
+    weights = [1 + len(child) for child in children]
+    target = sum(weights) / max(parts, 1)
+    bodies = []
+    body = None
+    size = 0
+    for child, weight in zip(children, weights):
+        if body is None:
+            body = etree.Element("body")
+            bodies.append(body)
+        body.append(child)
+        size += weight
+        if size >= target:
+            body = None
+            size = 0
+    return bodies
+
+
+def process_chunk(chunk, rules):
+    root = etree.fromstring(chunk)
+    edges = {}
+    postprocess(root, rules, edges)
+    # Первую и открытую в конце серию помечаем атрибутами: по ним склейка
+    # находит эти <pre> после разбора результата
+    if edges.get("head") is not None:
+        edges["head"].set(_HEAD, "")
+    if edges.get("open") is not None:
+        edges["open"].set(_OPEN, "")
+    first, continues = edges.get("first", (None, None))
+    return etree.tostring(root, encoding="unicode"), first, continues
+
+
+def _pop_mark(root, name):
+    for element in root.iterfind(f".//pre[@{name}]"):
+        del element.attrib[name]
+        return element
+    return None
+
+
+def _last_element(root):
+    for child in reversed(root):
+        if isinstance(child.tag, str):
+            return child
+    return None
+
+
+def stitch(root, results):
+    # Собирает обработанные куски обратно в root (из него их вынул split)
+    # и склеивает серии <pre>, разрезанные границами кусков
+    run = None
+    for chunk, first, continues in results:
+        chunk = etree.fromstring(chunk)
+        head = _pop_mark(chunk, _HEAD)
+        open_run = _pop_mark(chunk, _OPEN)
+        # Текст, перенесённый в начало куска, относится к концу предыдущего
+        if chunk.text:
+            if len(root):
+                root[-1].tail = (root[-1].tail or "") + chunk.text
+            else:
+                root.text = (root.text or "") + chunk.text
+        previous = _last_element(root)
+        root.extend(chunk)
+        if first is None:
+            continue
+        if first == "run" and run is not None:
+            if continues is None:
+                continues = continues_run(previous)
+            if continues:
+                code = run[0]
+                code.text = f"{code.text or ''}\n{head[0].text or ''}"
+                _remove(head)
+                if open_run is head:
+                    open_run = run
+        run = open_run
+    return root
+
+
+def postprocess_chunked(root, rules, workers):
+    bodies = split(root, workers * CHUNKS_PER_WORKER)
+    if len(bodies) < 2:
+        for body in bodies:
+            root.extend(body)
+        return postprocess(root, rules)
+    try:
+        chunks = [etree.tostring(body, encoding="unicode") for body in bodies]
+        results = list(_get_pool(workers).map(process_chunk, chunks, repeat(rules)))
+    except Exception as e:
+        # Например, в тексте есть символы, которых не бывает в XML.
+        # Возвращаем элементы на место и обрабатываем документ целиком
+        logger.warning(f"Chunked post-processing failed, running it in one pass: {e}")
+        for body in bodies:
+            root.extend(body)
+        return postprocess(root, rules)
+    del bodies, chunks
+    logger.debug(f"Post-processed {len(results)} chunks in {workers} processes")
+    return stitch(root, results)
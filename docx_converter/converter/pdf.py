@@ -0,0 +1,245 @@
+import hashlib
+import logging
+import os
+import signal
+import threading
+import uuid
+from contextlib import contextmanager
+
+from bs4 import BeautifulSoup
+from django.conf import settings
+from weasyprint import CSS, HTML
+from weasyprint.text.fonts import FontConfiguration
+
+from . import highlighting, metrics
+from .export import read_cached
+from .highlighting import RawHTML, highlight_code
+
+logger = logging.getLogger(__name__)
+
+# Меняем при изменении подготовки HTML для PDF: версия входит в ключ кэша
+PDF_RENDER_VERSION = "3"
+CHUNK_SIZE = 1024 * 1024
+
+
+def pdf_stylesheet():
+    css_files = [
+        os.path.join(settings.STATIC_ROOT, "css", "styles.css"),
+    ]
+
+    css_content = ""
+    for css_file in css_files:
+        try:
+            content = read_cached(css_file)
+        except Exception as e:
+            logger.error(f"Error loading CSS {css_file}: {str(e)}")
+            continue
+        if content is None:
+            logger.error(f"Error loading CSS {css_file}: file not found")
+            continue
+        css_content += content + "\n"
+
+    css_content += highlighting.stylesheet()
+    return css_content
+
+
+# Шрифты и разобранная таблица стилей живут всё время жизни процесса:
+# в пуле рендеринга их разогревают один раз до запуска воркеров
+_font_config = None
+_parsed_stylesheet = (None, None)
+
+
+def font_config():
+    global _font_config
+    if _font_config is None:
+        _font_config = FontConfiguration()
+    return _font_config
+
+
+def parsed_stylesheet(css_content):
+    global _parsed_stylesheet
+    if _parsed_stylesheet[0] != css_content:
+        stylesheet = CSS(string=css_content, font_config=font_config())
+        _parsed_stylesheet = (css_content, stylesheet)
+    return _parsed_stylesheet[1]
+
+
+def warm_up():
+    css_content = pdf_stylesheet()
+    HTML(string="<p>warm-up</p>").write_pdf(
+        stylesheets=[parsed_stylesheet(css_content)], font_config=font_config()
+    )
+
+
+class RenderTimeout(Exception):
+    pass
+
+
+@contextmanager
+def _deadline(seconds):
+    # SIGALRM работает только в главном потоке; в остальных - без ограничения
+    if not seconds or threading.current_thread() is not threading.main_thread():
+        yield
+        return
+
+    def expired(*args):
+        raise RenderTimeout(f"PDF rendering took longer than {seconds}s")
+
+    previous = signal.signal(signal.SIGALRM, expired)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def prepare_pdf_html(html_content):
+    soup = BeautifulSoup(html_content, "html.parser")
+
+    for element in soup.find_all(["script", "link"]):
+        element.decompose()
+
+    for img in soup.find_all("img"):
+        if img["src"].startswith("/media/"):
+            img["src"] = "file://" + os.path.join(settings.MEDIA_ROOT, img["src"][7:])
+
+    for pre in soup.find_all("pre"):
+        language = None
+        for cls in pre.get("class", []):
+            if cls.startswith("language-"):
+                language = cls.replace("language-", "")
+                break
+
+        if not pre.code:
+            code = soup.new_tag("code")
+            code.string = pre.get_text()
+            pre.clear()
+            pre.append(code)
+
+        elif language:
+            try:
+                code_contents = []
+                for child in pre.code.contents:
+                    if child.name is None:  # Текстовые узлы
+                        code_contents.append(str(child))
+                    elif child.name == "br":  # Сохраняем переносы строк
+                        code_contents.append("\n")
+
+                code_text = "".join(code_contents).strip()
+
+                if code_text:  # Проверяем, что код не пустой
+                    highlighted = highlight_code(code_text, language)
+
+                    if highlighted:
+                        # Фрагмент вставляется как есть, без повторного разбора
+                        pre.replace_with(RawHTML(highlighted))
+                    else:
+                        logger.warning(f"Highlighting failed for {language}")
+                        pre.code["class"] = pre.code.get("class", []) + [
+                            f"language-{language}"
+                        ]
+                else:
+                    logger.warning("Empty code block found")
+
+            except Exception as e:
+                logger.error(f"Error processing code block: {str(e)}")
+                pre.code["class"] = pre.code.get("class", []) + [f"language-{language}"]
+
+    return str(soup)
+
+
+def pdf_path_for(html_path):
+    return html_path.replace(".html", ".pdf")
+
+
+def _key_path(pdf_path):
+    return f"{pdf_path}.key"
+
+
+def pdf_cache_key(html_path, css_content):
+    digest = hashlib.sha256()
+    with open(html_path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    digest.update(b"\0" + css_content.encode("utf-8"))
+    digest.update(b"\0" + PDF_RENDER_VERSION.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _stored_key(pdf_path):
+    try:
+        with open(_key_path(pdf_path), "r", encoding="utf-8") as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+def _tmp_path(path):
+    # Своё имя на каждую запись: один PDF могут строить параллельно потоки
+    # одного процесса
+    return f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+
+
+def _write_atomic(path, data):
+    tmp_path = _tmp_path(path)
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def render_pdf(html_path, pdf_path, css_content):
+    with open(html_path, "r", encoding="utf-8") as f:
+        html_content = f.read()
+    prepared = prepare_pdf_html(html_content)
+
+    # Стили передаются только через stylesheets: раньше они ещё и
+    # встраивались в <style>, и WeasyPrint разбирал их дважды
+    tmp_path = _tmp_path(pdf_path)
+    document = HTML(string=prepared, base_url=settings.MEDIA_ROOT, encoding="utf-8")
+    try:
+        document.write_pdf(
+            tmp_path,
+            stylesheets=[parsed_stylesheet(css_content)],
+            font_config=font_config(),
+        )
+        os.replace(tmp_path, pdf_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def cached_pdf(html_path, key=None):
+    # Готовый PDF переиспользуем, пока не изменились HTML, CSS или версия
+    if key is None:
+        key = pdf_cache_key(html_path, pdf_stylesheet())
+    pdf_path = pdf_path_for(html_path)
+    if _stored_key(pdf_path) == key and os.path.exists(pdf_path):
+        return pdf_path
+    return None
+
+
+def get_pdf(html_path, timeout=None):
+    css_content = pdf_stylesheet()
+    key = pdf_cache_key(html_path, css_content)
+    pdf_path = cached_pdf(html_path, key=key)
+    if pdf_path is not None:
+        logger.debug(f"PDF cache hit for {html_path}")
+        metrics.inc("docx_pdf_requests_total", result="hit")
+        return pdf_path
+    logger.debug(f"Rendering PDF for {html_path}")
+    metrics.inc("docx_pdf_requests_total", result="render")
+    pdf_path = pdf_path_for(html_path)
+    with _deadline(timeout), metrics.timed("docx_stage_seconds", stage="render_pdf"):
+        render_pdf(html_path, pdf_path, css_content)
+    _write_atomic(_key_path(pdf_path), key)
+    return pdf_path
+
+
+def invalidate_pdf(html_path):
+    pdf_path = pdf_path_for(html_path)
+    for path in (_key_path(pdf_path), pdf_path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,441 @@
+import logging
+import re
+from collections import namedtuple
+from functools import lru_cache
+from html import unescape
+
+from lxml import etree
+
+# Постобработка HTML после mammoth за один обход дерева lxml.
+# На выводе mammoth результат побайтно совпадает с прежним многопроходным
+# конвейером на BeautifulSoup (см. converter/benchmarks/legacy.py и
+# bench_postprocess): текст из одних пробелов parse_fragment сводит к одному
+# символу, как html.parser. На произвольном HTML разбор отличается: парсер lxml
+# выбрасывает управляющие символы и сам разрывает <p>, вложенный прямо в <p>,
+# а html.parser оставляет и то и другое.
+
+logger = logging.getLogger(__name__)
+
+_PARSER = etree.HTMLParser(huge_tree=True)
+
+PLAIN_HTML_TAGS = ["p", "b", "i", "div", "span", "a", "strong", "em"]
+TABLE_CLASS = "default-bordered-table"
+
+# Пробельные символы HTML (ASCII_SPACES в BeautifulSoup)
+_SPACES = " \t\n\r\f"
+_PRESERVE_WHITESPACE = {"pre", "textarea"}
+
+_COMMENT_LIKE = re.compile(r"^\s*(?:-+|\.{3,})\s*$")
+
+
+# Текст похож на разметку, если в нём есть тег или инструкция обработки
+# (<?xml ...?>), но он не начинается с обычного HTML-тега вроде <p> или <b>
+_MARKUP = re.compile(r"<\w+\b[^>]*>|</\w+>|<\?[\w-]+")
+
+
+def _html_start(tags):
+    alternatives = "|".join(re.escape(tag) for tag in tags)
+    return re.compile(rf"\s*<(?:{alternatives})\b", re.IGNORECASE)
+
+
+# Правила постобработки, которые задаёт профиль конвертации (см. profiles)
+Rules = namedtuple(
+    "Rules",
+    [
+        "detect_code",
+        "html_start",
+        "code_class",
+        "code_language_class",
+        "table_class",
+        "table_header_row",
+    ],
+)
+
+
+def make_rules(
+    detect_code=True,
+    plain_html_tags=PLAIN_HTML_TAGS,
+    code_language="markup",
+    table_class=TABLE_CLASS,
+    table_header_row=True,
+):
+    language_class = f"language-{code_language}"
+    return Rules(
+        detect_code,
+        _html_start(plain_html_tags),
+        f"code {language_class}",
+        language_class,
+        table_class,
+        table_header_row,
+    )
+
+
+DEFAULT_RULES = make_rules()
+
+# Ячейки таблиц часто повторяются; длинные тексты не кэшируем
+CLASSIFIER_CACHE_SIZE = 8192
+CLASSIFIER_CACHE_MAX_TEXT = 512
+
+
+def _classify(text, html_start):
+    return _MARKUP.search(text) is not None and html_start.match(text) is None
+
+
+@lru_cache(maxsize=CLASSIFIER_CACHE_SIZE)
+def _classify_cached(text, html_start):
+    return _classify(text, html_start)
+
+
+def is_xml_like(text, rules=DEFAULT_RULES):
+    text = text.strip()
+    if "<" not in text:
+        return False
+    if len(text) <= CLASSIFIER_CACHE_MAX_TEXT:
+        return _classify_cached(text, rules.html_start)
+    return _classify(text, rules.html_start)
+
+
+def _collapse(text):
+    # Как в BeautifulSoup: текст из одних пробелов становится "\n", если в нём
+    # был перевод строки, иначе " "
+    if text and not text.strip(_SPACES):
+        return "\n" if "\n" in text else " "
+    return text
+
+
+def _collapse_whitespace(root):
+    # Внутри <pre> и <textarea> html.parser пробелы не трогает
+    stack = [(root, False)]
+    while stack:
+        element, preserve = stack.pop()
+        preserve = preserve or element.tag in _PRESERVE_WHITESPACE
+        if not preserve and isinstance(element.tag, str):
+            element.text = _collapse(element.text)
+        for child in element:
+            if not preserve:
+                child.tail = _collapse(child.tail)
+            stack.append((child, preserve))
+
+
+def parse_fragment(html_content):
+    document = etree.fromstring(f"<html><body>{html_content}</body></html>", _PARSER)
+    root = document.find("body")
+    _collapse_whitespace(root)
+    return root
+
+
+def _text(element):
+    return "".join(element.itertext())
+
+
+def _new_code_block(text, rules):
+    pre = etree.Element("pre", {"class": rules.code_class})
+    code = etree.SubElement(pre, "code", {"class": rules.code_language_class})
+    code.text = text
+    return pre
+
+
+def _replace(old, new):
+    new.tail = old.tail
+    old.getparent().replace(old, new)
+
+
+def _is_element(node):
+    return isinstance(node.tag, str)
+
+
+def _previous_element(element):
+    previous = element.getprevious()
+    while previous is not None and not _is_element(previous):
+        previous = previous.getprevious()
+    return previous
+
+
+def _add_class(element, name):
+    classes = (element.get("class") or "").split()
+    classes.append(name)
+    element.set("class", " ".join(classes))
+
+
+def continues_run(previous):
+    # Может ли <pre> после элемента previous продолжить серию <pre>
+    return (
+        previous is None
+        or previous.tag in ("pre", "br")
+        or (previous.tag == "p" and not _text(previous).strip())
+    )
+
+
+class _CodeRun:
+    # Серия подряд идущих <pre> вне таблиц, которые склеиваются в первый из них
+    def __init__(self, pre, text):
+        self.pre = pre
+        self.code = pre[0]
+        self.texts = [text]
+
+    def accepts(self, pre):
+        return continues_run(_previous_element(pre))
+
+    def close(self):
+        self.code.text = "\n".join(self.texts)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Merged {len(self.texts)} <pre> blocks: {self.texts}")
+
+
+def _process_td(td, rules):
+    xml_content = []
+    non_xml_content = []
+    children = [td.text] if td.text else []
+    for child in td:
+        if _is_element(child):
+            children.append(_text(child))
+        if child.tail:
+            children.append(child.tail)
+    # Ячеек тысячи: сообщение собираем, только если DEBUG включён
+    debug = logger.isEnabledFor(logging.DEBUG)
+    if debug:
+        tags = [child.tag for child in td if _is_element(child)]
+    for child_text in children:
+        child_text = unescape(child_text.strip())
+        if child_text:
+            if is_xml_like(child_text, rules):
+                xml_content.append(child_text)
+            elif _COMMENT_LIKE.match(child_text):
+                xml_content.append(f"<!-- {child_text} -->")
+            else:
+                non_xml_content.append(child_text)
+    if xml_content:
+        td.text = None
+        for child in list(td):
+            td.remove(child)
+        td.append(_new_code_block("\n".join(xml_content), rules))
+        for non_xml in non_xml_content:
+            etree.SubElement(td, "p").text = non_xml
+    if debug:
+        logger.debug(
+            f"TD children: {tags}, XML content: {xml_content}, "
+            f"non-XML content: {non_xml_content}"
+        )
+
+
+def _process_tables(outer_table, rules):
+    # Вложенные таблицы обрабатываются в том же порядке, что и раньше:
+    # сначала все ячейки внешней таблицы (включая вложенные), затем внутренние
+    for table in list(outer_table.iter("table")):
+        classes = (table.get("class") or "").split() + rules.table_class.split()
+        if "mce-item-table" in classes:
+            classes.remove("mce-item-table")
+        table.set("class", " ".join(classes))
+        if rules.table_header_row and next(table.iter("th"), None) is None:
+            first_tr = next(table.iter("tr"), None)
+            if first_tr is not None:
+                for td in first_tr.iter("td"):
+                    _add_class(td, "table-header")
+        if rules.detect_code:
+            for td in list(table.iter("td")):
+                _process_td(td, rules)
+
+
+def _move_text_before(element, text):
+    previous = element.getprevious()
+    if previous is not None:
+        previous.tail = (previous.tail or "") + text
+    else:
+        parent = element.getparent()
+        parent.text = (parent.text or "") + text
+
+
+def _remove(element):
+    # В lxml хвостовой текст принадлежит элементу, в BeautifulSoup - нет
+    if element.tail:
+        _move_text_before(element, element.tail)
+    element.getparent().remove(element)
+
+
+def _unwrap(element):
+    if element.text:
+        _move_text_before(element, element.text)
+    parent = element.getparent()
+    index = parent.index(element)
+    for offset, child in enumerate(list(element)):
+        parent.insert(index + offset, child)
+    _remove(element)
+
+
+def _first_code_block(root, pre, in_table):
+    # Как первый блок кода куска стыкуется с серией, открытой в конце
+    # предыдущего куска: "table" - прерывает её, "run" - начинает новую или
+    # продолжает прежнюю. Для <pre> в начале куска это решает сосед слева
+    if in_table:
+        return "table", None
+    previous = _previous_element(pre)
+    if previous is None and pre.getparent() is root:
+        return "run", None
+    return "run", continues_run(previous)
+
+
+def postprocess(root, rules=DEFAULT_RULES, edges=None):
+    # edges - словарь для обработки документа кусками (см. parallel): в него
+    # записываются первый блок кода куска и серия, открытая в конце
+    run = None
+    table_depth = 0
+    # Обход в глубину с событиями входа и выхода: (элемент, вышли_ли)
+    stack = [(child, False) for child in reversed(root) if _is_element(child)]
+    while stack:
+        element, leaving = stack.pop()
+        tag = element.tag
+
+        if leaving:
+            if tag == "table":
+                table_depth -= 1
+                if table_depth == 0:
+                    _process_tables(element, rules)
+            elif tag == "p":
+                # Прямо вложенный <p> парсер уже разорвал; сюда доходит только
+                # <p> внутри строчного элемента, например <p><span><p>
+                nested_p = next(element.iterdescendants("p"), None)
+                if nested_p is not None:
+                    _unwrap(nested_p)
+            continue
+
+        if tag in ("p", "pre"):
+            text = _text(element).strip()
+            if tag == "pre" or (rules.detect_code and is_xml_like(text, rules)):
+                pre = _new_code_block(text, rules)
+                _replace(element, pre)
+                if edges is not None and "first" not in edges:
+                    edges["first"] = _first_code_block(root, pre, table_depth)
+                    edges["head"] = None if table_depth else pre
+                if table_depth:
+                    # <pre> внутри таблицы прерывает серию
+                    if run is not None:
+                        run.close()
+                        run = None
+                elif run is not None and run.accepts(pre):
+                    run.texts.append(text)
+                    _remove(pre)
+                else:
+                    if run is not None:
+                        run.close()
+                    run = _CodeRun(pre, text)
+                continue
+
+        if tag == "table":
+            table_depth += 1
+        stack.append((element, True))
+        stack.extend(
+            (child, False) for child in reversed(element) if _is_element(child)
+        )
+
+    if run is not None:
+        run.close()
+        if edges is not None:
+            edges["open"] = run.pre
+    return root
+
+
+# Сериализация в том же виде, что и str() у BeautifulSoup с html.parser
+VOID_ELEMENTS = frozenset(
+    [
+        "area",
+        "base",
+        "br",
+        "col",
+        "embed",
+        "hr",
+        "img",
+        "input",
+        "keygen",
+        "link",
+        "menuitem",
+        "meta",
+        "param",
+        "source",
+        "track",
+        "wbr",
+        "basefont",
+        "bgsound",
+        "command",
+        "frame",
+        "image",
+        "isindex",
+        "nextid",
+        "spacer",
+    ]
+)
+_RAW_TEXT_ELEMENTS = frozenset(["script", "style"])
+_LIST_ATTRIBUTES = {"class", "accesskey", "dropzone"}
+_TAG_LIST_ATTRIBUTES = {
+    "a": {"rel", "rev"},
+    "link": {"rel", "rev"},
+    "td": {"headers"},
+    "th": {"headers"},
+    "form": {"accept-charset"},
+    "object": {"archive"},
+    "area": {"rel"},
+    "icon": {"sizes"},
+    "iframe": {"sandbox"},
+    "output": {"for"},
+}
+_ESCAPE = str.maketrans({"&": "&amp;", "<": "&lt;", ">": "&gt;"})
+
+
+def escape_text(text):
+    return text.translate(_ESCAPE)
+
+
+def _attribute(tag, name, value):
+    if value is None:
+        value = ""
+    elif name in _LIST_ATTRIBUTES or name in _TAG_LIST_ATTRIBUTES.get(tag, ()):
+        value = " ".join(value.split())
+    value = value.translate(_ESCAPE)
+    if '"' in value:
+        if "'" in value:
+            return f' {name}="{value.replace(chr(34), "&quot;")}"'
+        return f" {name}='{value}'"
+    return f' {name}="{value}"'
+
+
+def _start_tag(element):
+    tag = element.tag
+    attributes = "".join(
+        _attribute(tag, name, value) for name, value in sorted(element.items())
+    )
+    if tag in VOID_ELEMENTS and not len(element) and not element.text:
+        return f"<{tag}{attributes}/>", None
+    return f"<{tag}{attributes}>", f"</{tag}>"
+
+
+def _serialize(element, out, raw_text=False):
+    if _is_element(element):
+        start, end = _start_tag(element)
+        out.append(start)
+        if end is not None:
+            inner_raw = element.tag in _RAW_TEXT_ELEMENTS
+            if element.text:
+                out.append(element.text if inner_raw else escape_text(element.text))
+            for child in element:
+                _serialize(child, out, inner_raw)
+            out.append(end)
+    elif element.tag is etree.Comment:
+        out.append(f"<!--{element.text or ''}-->")
+    if element.tail:
+        out.append(element.tail if raw_text else escape_text(element.tail))
+
+
+def to_html(element):
+    out = []
+    _serialize(element, out)
+    return "".join(out)
+
+
+def iter_children_html(root):
+    if root.text:
+        yield escape_text(root.text)
+    for child in root:
+        yield to_html(child)
+
+
+def children_html(root):
+    return "".join(iter_children_html(root))
@@ -0,0 +1,129 @@
+import hashlib
+import json
+import logging
+import threading
+from collections import namedtuple
+
+import mammoth
+from mammoth import conversion, docx, options
+
+from .models import ConversionProfile
+from .postprocess import PLAIN_HTML_TAGS, TABLE_CLASS, make_rules
+
+logger = logging.getLogger(__name__)
+
+# Профили конвертации. Профиль компилируется один раз на процесс: style map
+# разбирается во внутреннее представление mammoth, правила постобработки -
+# в регулярные выражения. Скомпилированный профиль сверяется с версией из БД,
+# так что правка профиля в админке доходит до всех процессов
+
+DEFAULT_NAME = "default"
+
+STYLE_MAP = """
+    p[style-name='Warning'] => div.warning
+    p[style-name='Important'] => div.important
+    p[style-name='Code'] => pre.code
+    h1 => h1.title
+    h2 => h2.subtitle
+"""
+
+DEFAULT_RULES = {
+    "style_map": STYLE_MAP,
+    "detect_code": True,
+    "plain_html_tags": ",".join(PLAIN_HTML_TAGS),
+    "code_language": "markup",
+    "table_class": TABLE_CLASS,
+    "table_header_row": True,
+    "extra_css": "",
+}
+
+CompiledProfile = namedtuple(
+    "CompiledProfile", ["name", "version", "key", "style_map", "rules", "extra_css"]
+)
+
+_compiled = {}
+_lock = threading.Lock()
+
+
+def _parse_style_map(text):
+    result = options._read_style_map(text)
+    for message in result.messages:
+        logger.warning(f"Style map: {message.message}")
+    return result.value
+
+
+def compile_profile(name, version, rules):
+    # key - отпечаток правил: входит в ключ кэша конвертаций вместе с версией
+    digest = hashlib.sha256(
+        json.dumps([name, version, rules], sort_keys=True).encode("utf-8")
+    ).hexdigest()
+    tags = [tag.strip() for tag in rules["plain_html_tags"].split(",") if tag.strip()]
+    return CompiledProfile(
+        name,
+        version,
+        f"{name}:{version}:{digest[:16]}",
+        _parse_style_map(rules["style_map"]),
+        make_rules(
+            detect_code=rules["detect_code"],
+            plain_html_tags=tags,
+            code_language=rules["code_language"],
+            table_class=rules["table_class"],
+            table_header_row=rules["table_header_row"],
+        ),
+        rules["extra_css"],
+    )
+
+
+def get_compiled(profile=None):
+    # profile - ConversionProfile или None для встроенного профиля
+    pk, name, version = (
+        (None, DEFAULT_NAME, 0)
+        if profile is None
+        else (profile.pk, profile.name, profile.version)
+    )
+    with _lock:
+        compiled = _compiled.get(pk)
+        if compiled is None or (compiled.name, compiled.version) != (name, version):
+            rules = DEFAULT_RULES if profile is None else profile.rules()
+            compiled = compile_profile(name, version, rules)
+            _compiled[pk] = compiled
+            logger.debug(f"Compiled conversion profile {compiled.key}")
+        return compiled
+
+
+def for_upload(upload):
+    # Профиль перечитывается из БД: его могли изменить в другом процессе
+    if upload.profile_id is None:
+        return get_compiled()
+    profile = ConversionProfile.objects.filter(pk=upload.profile_id).first()
+    return get_compiled(profile)
+
+
+def profile_names():
+    return list(
+        ConversionProfile.objects.order_by("name").values_list("name", flat=True)
+    )
+
+
+def get_profile(name):
+    if not name:
+        return None
+    return ConversionProfile.objects.filter(name=name).first()
+
+
+def convert_to_html(fileobj, profile, convert_image):
+    # mammoth.convert_to_html без разбора style map на каждый вызов. Порядок
+    # правил тот же: профиль, style map из самого .docx, правила mammoth
+    embedded = mammoth.read_embedded_style_map(fileobj)
+    style_map = profile.style_map
+    if embedded:
+        style_map = style_map + _parse_style_map(embedded)
+    style_map = style_map + options._default_style_map
+    return docx.read(fileobj).bind(
+        lambda document: conversion.convert_document_element_to_html(
+            document,
+            style_map=style_map,
+            ignore_empty_paragraphs=True,
+            convert_image=convert_image,
+        )
+    )
@@ -0,0 +1,139 @@
+import html
+import re
+
+from django.db import connection
+from lxml import etree
+
+from .models import DocumentText, DocumentUpload
+
+# Полнотекстовый поиск по содержимому документов: tsvector/GIN в PostgreSQL,
+# FTS5 в SQLite (см. миграцию 0008). Остальные БД - медленный icontains
+SEARCH_PAGE_SIZE = 20
+SNIPPET_WORDS = 16
+
+# Маркеры совпадений в сниппете: заменяются на <mark> после экранирования
+_START, _STOP = "\x02", "\x03"
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+_PARSER = etree.HTMLParser(huge_tree=True)
+
+
+def extract_text(root):
+    return " ".join(" ".join(root.itertext()).split())
+
+
+def html_to_text(html_content):
+    document = etree.fromstring(html_content, _PARSER)
+    if document is None:
+        return ""
+    body = document.find("body")
+    return extract_text(body if body is not None else document)
+
+
+def index_text(upload_id, text):
+    # Индекс обновляют триггеры (SQLite) или генерируемый столбец (PostgreSQL)
+    DocumentText.objects.update_or_create(upload_id=upload_id, defaults={"text": text})
+
+
+def index_html_file(upload_id, html_path):
+    with open(html_path, "r", encoding="utf-8") as f:
+        index_text(upload_id, html_to_text(f.read()))
+
+
+def _snippet_html(snippet):
+    snippet = html.escape(snippet or "")
+    return snippet.replace(_START, "<mark>").replace(_STOP, "</mark>")
+
+
+def _fts5_query(query):
+    # Каждое слово - отдельная фраза с поиском по префиксу, все через AND
+    return " ".join(f'"{token}"*' for token in _TOKEN.findall(query))
+
+
+def _search_sqlite(query, limit, offset):
+    fts_query = _fts5_query(query)
+    if not fts_query:
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT d.upload_id, bm25(converter_documenttext_fts), "
+            "snippet(converter_documenttext_fts, 0, %s, %s, '…', %s) "
+            "FROM converter_documenttext_fts "
+            "JOIN converter_documenttext d ON d.id = converter_documenttext_fts.rowid "
+            "WHERE converter_documenttext_fts MATCH %s "
+            "ORDER BY bm25(converter_documenttext_fts), d.id LIMIT %s OFFSET %s",
+            [_START, _STOP, SNIPPET_WORDS, fts_query, limit, offset],
+        )
+        # bm25 меньше - лучше; переворачиваем, чтобы ранг рос с релевантностью
+        return [(upload_id, -rank, snippet) for upload_id, rank, snippet in cursor]
+
+
+def _search_postgresql(query, limit, offset):
+    options = (
+        f"StartSel={_START}, StopSel={_STOP}, MaxWords={SNIPPET_WORDS * 2}, "
+        f"MinWords={SNIPPET_WORDS // 2}, MaxFragments=2"
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT page.upload_id, page.rank, "
+            "ts_headline('simple', page.text, page.query, %s) "
+            "FROM (SELECT d.upload_id, d.text, q AS query, "
+            "ts_rank_cd(d.search_vector, q) AS rank, d.id "
+            "FROM converter_documenttext d, websearch_to_tsquery('simple', %s) q "
+            "WHERE d.search_vector @@ q "
+            "ORDER BY rank DESC, d.id LIMIT %s OFFSET %s) page "
+            "ORDER BY page.rank DESC, page.id",
+            [options, query, limit, offset],
+        )
+        return list(cursor)
+
+
+def _search_fallback(query, limit, offset):
+    texts = DocumentText.objects.filter(text__icontains=query).order_by("-updated_at")
+    results = []
+    for upload_id, text in texts.values_list("upload_id", "text")[
+        offset : offset + limit
+    ]:
+        position = text.lower().find(query.lower())
+        if position < 0:
+            results.append((upload_id, 0.0, text[:160]))
+            continue
+        start = max(0, position - 80)
+        snippet = (
+            text[start:position]
+            + _START
+            + text[position : position + len(query)]
+            + _STOP
+            + text[position + len(query) : position + len(query) + 80]
+        )
+        results.append((upload_id, 0.0, snippet))
+    return results
+
+
+_BACKENDS = {
+    "sqlite": _search_sqlite,
+    "postgresql": _search_postgresql,
+}
+
+
+def search_documents(query, page=1, page_size=SEARCH_PAGE_SIZE):
+    # Возвращает [(upload, rank, snippet_html)] и признак следующей страницы.
+    # Ранжирование и сниппеты считает БД, в Python приходит только страница
+    query = query.strip()
+    if not query:
+        return [], False
+    backend = _BACKENDS.get(connection.vendor, _search_fallback)
+    offset = (max(page, 1) - 1) * page_size
+    rows = backend(query, page_size + 1, offset)
+    has_next = len(rows) > page_size
+    # SQLite отдаёт UUID строкой без дефисов
+    to_uuid = DocumentUpload._meta.pk.to_python
+    rows = [(to_uuid(upload_id), rank, snippet) for upload_id, rank, snippet in rows]
+    rows = rows[:page_size]
+    uploads = DocumentUpload.objects.in_bulk([upload_id for upload_id, _, _ in rows])
+    results = [
+        (uploads[upload_id], rank, _snippet_html(snippet))
+        for upload_id, rank, snippet in rows
+        if upload_id in uploads
+    ]
+    return results, has_next
@@ -6,8 +6,11 @@ app_name = "converter"
 
 urlpatterns = [
     path("", views.upload_docx, name="upload_docx"),
+    path("bulk/", views.upload_bulk, name="upload_bulk"),
+    path("jobs/<uuid:job_id>/", views.job_status, name="job_status"),
     path("result/<uuid:upload_id>/", views.result, name="result"),
     path("edit/<uuid:upload_id>/", views.edit_html, name="edit_html"),
+    path("edit/<uuid:upload_id>/blocks/", views.edit_blocks, name="edit_blocks"),
     path(
         "download/<uuid:upload_id>/<str:file_type>/",
         views.download_file,
@@ -16,5 +19,8 @@ urlpatterns = [
     path("upload_image/", views.upload_image, name="upload_image"),
     path("archive/", views.archive_view, name="archive"),
     path("download/pdf/<uuid:upload_id>/", views.download_pdf, name="download_pdf"),
+    # Без слэша, в отличие от остальных адресов: Prometheus по умолчанию
+    # опрашивает /metrics (metrics_path), а редирект APPEND_SLASH ему ни к чему
+    path("metrics", views.metrics_view, name="metrics"),
     path("delete/<uuid:upload_id>/", views.delete_upload, name="delete_upload"),
 ]
@@ -1,210 +1,235 @@
+import logging
 import os
 import re
-import uuid
+import time
 import zipfile
-from html import unescape
+from collections import namedtuple
 
 import mammoth
 from bs4 import BeautifulSoup
 from django.conf import settings
 
+from .blocks import (
+    apply_changes,
+    assign_block_ids,
+    document_text,
+    segments,
+    write_blocks,
+)
+from . import compression, imaging, metrics, pages, parallel
+from .export import write_download_html
+from .imaging import PENDING_PREFIX, apply_images
+from .images import discard, image_path, store_stream
+from .memory import current_rss_mb, peak_rss_mb, reset_peak_rss
+from .pdf import invalidate_pdf
+from .postprocess import escape_text, parse_fragment, postprocess
+from .profiles import convert_to_html, get_compiled
+from .search import index_text
 
-def process_docx(docx_path, upload_id, original_filename):
+logger = logging.getLogger(__name__)
+
+# Меняем при любом изменении логики конвертации: версия входит в ключ кэша
+CONVERTER_VERSION = "5"
+
+STYLESHEETS = [
+    "/static/js/tinymce/plugins/codesample/css/prism.css",
+    "/static/css/styles.css",
+]
+SCRIPTS = [
+    "/static/js/tinymce/plugins/codesample/js/prism-core.js",
+    "/static/js/tinymce/plugins/codesample/js/prism-markup.js",
+    "/static/js/tinymce/plugins/codesample/js/prism-java.js",
+    "/static/js/tinymce/plugins/codesample/js/prism-bash.js",
+    "/static/js/tinymce/plugins/codesample/js/prism-json.js",
+]
+HEAD_HTML = (
+    '<meta charset="utf-8"/>'
+    + "".join(f'<link href="{href}" rel="stylesheet"/>' for href in STYLESHEETS)
+    + "".join(f'<script src="{src}"></script>' for src in SCRIPTS)
+)
+
+
+ConversionResult = namedtuple(
+    "ConversionResult",
+    [
+        "html_path",
+        "zip_path",
+        "html_filename",
+        "zip_filename",
+        "images",
+    ],
+)
+
+
+def output_filenames(original_filename):
+    base_name = re.sub(r"[^\w\-]", "_", os.path.splitext(original_filename)[0])
+    return f"{base_name}.html", f"{base_name}_images.zip"
+
+
+def document_start(extra_css=""):
+    # extra_css профиля хранится в <head> документа и попадает в скачиваемую
+    # версию и PDF вместе с ним
+    style = ""
+    if extra_css:
+        style = "<style>" + re.sub(r"</(style)", r"<\\/\1", extra_css, flags=re.I)
+        style += "</style>"
+    return f"<!DOCTYPE html>\n<html><head>{HEAD_HTML}{style}</head><body>"
+
+
+DOCUMENT_START = document_start()
+DOCUMENT_END = "</body></html>"
+
+
+def wrap_document(body_html, extra_css=""):
+    return f"{document_start(extra_css)}{body_html}{DOCUMENT_END}"
+
+
+def _record_stage(timings, stage, started, excluded=0.0):
+    elapsed = time.perf_counter() - started - excluded
+    metrics.observe_stage(stage, elapsed)
+    if timings is not None:
+        timings[stage] = round(elapsed, 4)
+
+
+def _record_memory(timings, docx_path, start_rss):
+    # Пик памяти за конвертацию и его отношение к размеру .docx
+    peak_rss = peak_rss_mb()
+    # Для маленьких файлов отношение ничего не говорит: считаем от 1 MiB
+    docx_mb = max(os.path.getsize(docx_path) / 1024**2, 1.0)
+    ratio = max(0.0, peak_rss - start_rss) / docx_mb
+    if timings is not None:
+        timings["peak_rss_mb"] = round(peak_rss, 1)
+        timings["rss_ratio"] = round(ratio, 1)
+    if ratio > settings.CONVERSION_RSS_RATIO_TARGET:
+        logger.warning(
+            f"Converting {os.path.basename(docx_path)} ({docx_mb:.1f} MiB) "
+            f"took {peak_rss - start_rss:.0f} MiB, ratio {ratio:.1f} is above "
+            f"the target {settings.CONVERSION_RSS_RATIO_TARGET:g}"
+        )
+
+
+def process_docx(docx_path, upload_id, original_filename, timings=None, profile=None):
+    # Промежуточные представления освобождаются сразу после использования:
+    # строка mammoth - после разбора, дерево - по мере записи HTML блоками.
+    # profile - скомпилированный профиль (profiles.get_compiled)
+    profile = profile or get_compiled()
     output_dir = os.path.join(settings.MEDIA_ROOT, "output", str(upload_id))
-    images_dir = os.path.join(output_dir, "images")
     os.makedirs(output_dir, exist_ok=True)
-    os.makedirs(images_dir, exist_ok=True)
 
-    base_name = re.sub(r"[^\w\-]", "_", os.path.splitext(original_filename)[0])
-    html_filename = f"{base_name}.html"
-    zip_filename = f"{base_name}_images.zip"
+    html_filename, zip_filename = output_filenames(original_filename)
     html_path = os.path.join(output_dir, html_filename)
     zip_path = os.path.join(output_dir, zip_filename)
-
-    style_map = """
-        p[style-name='Warning'] => div.warning
-        p[style-name='Important'] => div.important
-        p[style-name='Code'] => pre.code
-        h1 => h1.title
-        h2 => h2.subtitle
-    """
+    pending = {}
+    sources = []
+    image_count = 0
+    image_time = 0.0
+    reset_peak_rss()
+    start_rss = current_rss_mb()
 
     def convert_image(image):
+        # Картинка по кускам пишется в хранилище, в пул уходит только ссылка
+        # на файл, а в HTML пока попадает временный адрес; одинаковые
+        # картинки обрабатываются один раз
+        nonlocal image_count, image_time
+        started = time.perf_counter()
         ext = image.content_type.split("/")[-1]
-        image_name = f"image_{uuid.uuid4().hex[:8]}.{ext}"
-        image_path = os.path.join(images_dir, image_name)
         with image.open() as image_bytes:
-            with open(image_path, "wb") as f:
-                f.write(image_bytes.read())
-        return {"src": f"/media/output/{upload_id}/images/{image_name}"}
+            ref = store_stream(image_bytes, ext)
+        key = f"{PENDING_PREFIX}{ref.sha256}"
+        if key not in pending:
+            sources.append(ref)
+            pending[key] = imaging.submit(ref, ext)
+        image_count += 1
+        image_time += time.perf_counter() - started
+        return {"src": key}
 
+    started = time.perf_counter()
     with open(docx_path, "rb") as docx_file:
-        result = mammoth.convert_to_html(
-            docx_file,
-            style_map=style_map,
-            convert_image=mammoth.images.img_element(convert_image),
-        )
-        html_content = result.value
+        html_content = convert_to_html(
+            docx_file, profile, mammoth.images.img_element(convert_image)
+        ).value
+    # Картинки обрабатываются параллельно с конвертацией, их время считаем
+    # отдельно: чтение и ожидание пула
+    _record_stage(timings, "convert", started, excluded=image_time)
 
-    soup = BeautifulSoup(html_content, "html.parser")
+    started = time.perf_counter()
+    processed = {key: future.result() for key, future in pending.items()}
+    del pending
+    image_time += time.perf_counter() - started
+    images = [ref for image in processed.values() for ref in image.refs]
+    zip_images = [image.zip_ref for image in processed.values()]
+    # Исходники, заменённые сжатыми версиями, в хранилище не остаются
+    kept = {ref.sha256 for ref in images}
+    discard([ref for ref in sources if ref.sha256 not in kept])
+    if timings is not None:
+        timings["images"] = round(image_time, 4)
+    metrics.observe_stage("images", image_time)
+    metrics.inc("docx_images_total", image_count)
 
-    def is_xml_like(text):
-        text = text.strip()
-        html_tags = ["p", "b", "i", "div", "span", "a", "strong", "em"]
-        return bool(
-            text
-            and (
-                re.match(r"^\s*<\w+\b[^>]*>.*</\w+>\s*$", text, re.DOTALL)
-                or re.search(r"<\w+\b[^>]*>|</\w+>|<\?[\w-]+", text)
-            )
-            and not any(
-                re.match(rf"^\s*<{tag}\b", text, re.IGNORECASE) for tag in html_tags
-            )
-        )
+    started = time.perf_counter()
+    html_size = len(html_content)
+    root = parse_fragment(html_content)
+    del html_content
+    apply_images(root, processed)
+    _record_stage(timings, "parse", started)
 
-    # Обработка параграфов и pre
-    for tag in soup.find_all(["p", "pre"]):
-        text = tag.get_text().strip()
-        if tag.name == "pre" or is_xml_like(text):
-            new_pre = soup.new_tag("pre")
-            new_pre["class"] = ["code", "language-markup"]
-            new_code = soup.new_tag("code", attrs={"class": "language-markup"})
-            new_code.string = text
-            new_pre.append(new_code)
-            tag.replace_with(new_pre)
-
-    # Объединяем последовательные <pre> вне таблиц
-    pre_tags = soup.find_all("pre", recursive=True)
-    i = 0
-    while i < len(pre_tags):
-        current_pre = pre_tags[i]
-        if current_pre.find_parent("table") is None:
-            xml_content = [current_pre.code.text]
-            j = i + 1
-            while j < len(pre_tags) and pre_tags[j].find_parent("table") is None:
-                # Пропускаем незначительные элементы (пустые <p>, <br>)
-                prev_sibling = pre_tags[j].find_previous_sibling()
-                if (
-                    prev_sibling is None
-                    or prev_sibling.name in ["pre", "br"]
-                    or (
-                        prev_sibling.name == "p" and not prev_sibling.get_text().strip()
-                    )
-                ):
-                    xml_content.append(pre_tags[j].code.text)
-                    pre_tags[j].decompose()
-                    j += 1
-                else:
-                    break
-            current_pre.code.string = "\n".join(xml_content)
-            print(f"Non-table pre content: {xml_content}")
-            i = j
-        else:
-            i += 1
-
-    # Обработка таблиц
-    for table in soup.find_all("table"):
-        table["class"] = table.get("class", []) + ["default-bordered-table"]
-        if "mce-item-table" in table["class"]:
-            table["class"].remove("mce-item-table")
-        has_th = bool(table.find("th"))
-        if not has_th:
-            first_tr = table.find("tr")
-            if first_tr:
-                for td in first_tr.find_all("td"):
-                    td["class"] = td.get("class", []) + ["table-header"]
-        for td in table.find_all("td"):
-            xml_content = []
-            non_xml_content = []
-            print(f"TD children: {[child for child in td.children]}")
-            for child in td.children:
-                child_text = unescape(child.get_text().strip())
-                if child_text:
-                    if is_xml_like(child_text):
-                        xml_content.append(child_text)
-                    elif re.match(r"^\s*-+\s*$", child_text) or re.match(
-                        r"^\s*\.{3,}\s*$", child_text
-                    ):
-                        xml_content.append(f"<!-- {child_text} -->")
-                    else:
-                        non_xml_content.append(child_text)
-            if xml_content:
-                new_pre = soup.new_tag("pre")
-                new_pre["class"] = ["code", "language-markup"]
-                new_code = soup.new_tag("code", attrs={"class": "language-markup"})
-                new_code.string = "\n".join(xml_content)
-                new_pre.append(new_code)
-                td.clear()
-                td.append(new_pre)
-                for non_xml in non_xml_content:
-                    new_p = soup.new_tag("p")
-                    new_p.string = non_xml
-                    td.append(new_p)
-            print(f"TD XML content: {xml_content}")
-            print(f"TD non-XML content: {non_xml_content}")
-
-    # Удаляем вложенные <p>
-    for p in soup.find_all("p"):
-        nested_p = p.find("p")
-        if nested_p:
-            nested_p.unwrap()
-
-    html_doc = BeautifulSoup(
-        "<!DOCTYPE html><html><head></head><body></body></html>",
-        "html.parser",
-    )
-    head = html_doc.head
-    head.append(html_doc.new_tag("meta", charset="utf-8"))
-    head.append(
-        html_doc.new_tag(
-            "link",
-            rel="stylesheet",
-            href="/static/js/tinymce/plugins/codesample/css/prism.css",
-        )
-    )
-    head.append(
-        html_doc.new_tag("link", rel="stylesheet", href="/static/css/styles.css")
-    )
-    head.append(
-        html_doc.new_tag(
-            "script", src="/static/js/tinymce/plugins/codesample/js/prism-core.js"
-        )
-    )
-    head.append(
-        html_doc.new_tag(
-            "script", src="/static/js/tinymce/plugins/codesample/js/prism-markup.js"
-        )
-    )
-    head.append(
-        html_doc.new_tag(
-            "script", src="/static/js/tinymce/plugins/codesample/js/prism-java.js"
-        )
-    )
-    head.append(
-        html_doc.new_tag(
-            "script", src="/static/js/tinymce/plugins/codesample/js/prism-bash.js"
-        )
-    )
-    head.append(
-        html_doc.new_tag(
-            "script", src="/static/js/tinymce/plugins/codesample/js/prism-json.js"
-        )
+    started = time.perf_counter()
+    if parallel.use_chunks(html_size):
+        parallel.postprocess_chunked(root, profile.rules, settings.POSTPROCESS_WORKERS)
+    else:
+        postprocess(root, profile.rules)
+    _record_stage(timings, "postprocess", started)
+
+    started = time.perf_counter()
+    next_block = assign_block_ids(root)
+    _record_stage(timings, "assign_blocks", started)
+
+    # Сериализация идёт вместе с записью: каждый блок пишется в файл и
+    # удаляется из дерева
+    started = time.perf_counter()
+    prefix = document_start(profile.extra_css)
+    if root.text:
+        prefix += escape_text(root.text)
+    index = write_blocks(
+        html_path,
+        prefix.encode("utf-8"),
+        segments(root, consume=True),
+        DOCUMENT_END.encode("utf-8"),
+        next_block,
     )
-    html_doc.body.append(soup)
+    del root
+    _record_stage(timings, "write_html", started)
 
-    with open(html_path, "w", encoding="utf-8") as f:
-        f.write(str(html_doc))
+    started = time.perf_counter()
+    index_text(upload_id, document_text(index))
+    _record_stage(timings, "index_text", started)
 
-    with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zipf:
-        for root, _, files in os.walk(images_dir):
-            for file in files:
-                file_path = os.path.join(root, file)
-                zipf.write(file_path, os.path.join("images", file))
+    # Время сборки скачиваемой версии учитывает сама export.write_download_html
+    started = time.perf_counter()
+    write_download_html(html_path, body=tuple(index["body"]))
+    if timings is not None:
+        timings["download_html"] = round(time.perf_counter() - started, 4)
+
+    started = time.perf_counter()
+    write_images_zip(zip_path, zip_images)
+    _record_stage(timings, "zip", started)
+
+    _record_memory(timings, docx_path, start_rss)
+    return ConversionResult(html_path, zip_path, html_filename, zip_filename, images)
 
-    return html_path, zip_path, str(html_doc), html_filename, zip_filename
+
+def write_images_zip(zip_path, images):
+    # Архив собирается из общего хранилища, каждая картинка - один раз
+    written = set()
+    with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zipf:
+        for ref in images:
+            name = os.path.basename(ref.path)
+            if name not in written:
+                written.add(name)
+                zipf.write(image_path(ref.path), os.path.join("images", name))
 
 
-def save_edited_html(html_content, upload_id, html_filename):
+def save_edited_html(html_content, upload_id, html_filename, profile=None):
     output_dir = os.path.join(settings.MEDIA_ROOT, "output", str(upload_id))
     html_path = os.path.join(output_dir, html_filename)
 
@@ -212,50 +237,22 @@ def save_edited_html(html_content, upload_id, html_filename):
     if soup.head:
         soup.head.decompose()
 
-    html_doc = BeautifulSoup(
-        "<!DOCTYPE html><html><head></head><body></body></html>",
-        "html.parser",
-    )
-    head = html_doc.head
-    head.append(html_doc.new_tag("meta", charset="utf-8"))
-    head.append(
-        html_doc.new_tag(
-            "link",
-            rel="stylesheet",
-            href="/static/js/tinymce/plugins/codesample/css/prism.css",
-        )
-    )
-    head.append(
-        html_doc.new_tag("link", rel="stylesheet", href="/static/css/styles.css")
-    )
-    head.append(
-        html_doc.new_tag(
-            "script", src="/static/js/tinymce/plugins/codesample/js/prism-core.js"
-        )
-    )
-    head.append(
-        html_doc.new_tag(
-            "script", src="/static/js/tinymce/plugins/codesample/js/prism-markup.js"
-        )
-    )
-    head.append(
-        html_doc.new_tag(
-            "script", src="/static/js/tinymce/plugins/codesample/js/prism-java.js"
-        )
-    )
-    head.append(
-        html_doc.new_tag(
-            "script", src="/static/js/tinymce/plugins/codesample/js/prism-bash.js"
-        )
-    )
-    head.append(
-        html_doc.new_tag(
-            "script", src="/static/js/tinymce/plugins/codesample/js/prism-json.js"
-        )
-    )
-    html_doc.body.append(soup)
-
     with open(html_path, "w", encoding="utf-8") as f:
-        f.write(str(html_doc))
+        document = wrap_document(str(soup), (profile or get_compiled()).extra_css)
+        f.write(document)
+    compression.discard(html_path)
+    write_download_html(html_path, document)
+    invalidate_pdf(html_path)
+    pages.invalidate(upload_id)
+    index_text(upload_id, " ".join(soup.get_text(" ").split()))
 
     return html_path
+
+
+def save_edited_blocks(upload_id, html_path, changes, version=None):
+    # Правка отдельных блоков; скачиваемая версия пересоберётся при скачивании
+    index, assigned = apply_changes(html_path, changes, version)
+    invalidate_pdf(html_path)
+    pages.invalidate(upload_id)
+    index_text(upload_id, document_text(index))
+    return index, assigned
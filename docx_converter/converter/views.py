@@ -1,400 +1,458 @@
-import html
+import asyncio
+import json
 import logging
 import os
-import uuid
+import shutil
 
-from bs4 import BeautifulSoup
 from django.conf import settings
-from django.http import HttpResponse, JsonResponse
-from django.shortcuts import get_object_or_404, redirect, render
-from pygments import highlight
-from pygments.formatters import HtmlFormatter
-from pygments.lexers import get_lexer_by_name
-from weasyprint import CSS, HTML
-
-from .forms import DocumentUploadForm, HtmlEditForm
-from .models import DocumentUpload
-from .utils import process_docx, save_edited_html
+from django.core.exceptions import ValidationError
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.shortcuts import aget_object_or_404, get_object_or_404, redirect, render
+from django.urls import reverse
+from django.utils.cache import get_conditional_response
+
+from . import images as image_store
+from . import imaging, metrics, pages, profiles
+from .archive import DEFAULT_SORT, archive_page
+from .blocks import BlockEditError, VersionConflict, ensure_index
+from .bulk import BulkUploadError, collect_documents, create_uploads
+from .delivery import send_file
+from .export import ensure_download_html
+from .forms import BulkUploadForm, DocumentUploadForm, HtmlEditForm
+from .jobs import (
+    aiter_finished_jobs,
+    await_job,
+    enqueue_conversion,
+    enqueue_conversions,
+    enqueue_pdf_render,
+    iter_finished_jobs,
+    precompress_html,
+    prerender_pdf,
+)
+from .models import ConversionJob, DocumentUpload
+from .offload import read_text, run_cpu, run_io
+from .pdf import cached_pdf, get_pdf
+from .search import search_documents
+from .utils import save_edited_blocks, save_edited_html
 
 logger = logging.getLogger(__name__)
 
 
-def upload_docx(request):
+def _run_jobs(func, *args):
+    # Без очереди задача выполняется прямо в запросе - это тяжёлый вызов
+    if settings.CONVERSION_QUEUE_ENABLED:
+        return run_io(func, *args)
+    return run_cpu(func, *args)
+
+
+async def upload_docx(request):
+    job = None
+    names = await run_io(profiles.profile_names)
     if request.method == "POST":
-        form = DocumentUploadForm(request.POST, request.FILES)
-        if form.is_valid():
-            upload = DocumentUpload.objects.create(
-                docx_file=form.cleaned_data["docx_file"]
+        form = DocumentUploadForm(request.POST, request.FILES, profiles=names)
+        if await run_io(form.is_valid):
+            docx_file = form.cleaned_data["docx_file"]
+            profile = await run_io(
+                profiles.get_profile, form.cleaned_data.get("profile")
             )
-            original_filename = form.cleaned_data["docx_file"].name
-            html_path, zip_path, html_content, html_filename, zip_filename = (
-                process_docx(upload.docx_file.path, upload.id, original_filename)
+            upload = await run_io(
+                DocumentUpload.objects.create,
+                docx_file=docx_file,
+                filename=docx_file.name,
+                docx_size=docx_file.size,
+                profile=profile,
             )
-            upload.html_file = os.path.relpath(html_path, settings.MEDIA_ROOT)
-            upload.images_zip = os.path.relpath(zip_path, settings.MEDIA_ROOT)
-            upload.save()
-            logger.debug(
-                f"Uploaded document {upload.id}, HTML: {html_filename}, redirecting to edit"
-            )
-            return redirect("converter:edit_html", upload_id=upload.id)
+            original_filename = docx_file.name
+            job = await _run_jobs(enqueue_conversion, upload, original_filename)
+            logger.debug(f"Uploaded document {upload.id}, queued job {job.id}")
+            if request.headers.get("x-requested-with") == "XMLHttpRequest":
+                return JsonResponse(_job_payload(job), status=202)
+            if job.status == ConversionJob.STATUS_DONE:
+                return redirect("converter:edit_html", upload_id=upload.id)
+            return redirect(f"{reverse('converter:upload_docx')}?job={job.id}")
     else:
-        form = DocumentUploadForm()
-    return render(request, "converter/upload.html", {"form": form})
+        form = DocumentUploadForm(profiles=names)
+        job_id = request.GET.get("job")
+        if job_id:
+            try:
+                job = await ConversionJob.objects.filter(pk=job_id).afirst()
+            except ValidationError:
+                logger.warning(f"Invalid job id in upload page: {job_id}")
+    return render(
+        request,
+        "converter/upload.html",
+        {"form": form, "bulk_form": BulkUploadForm(profiles=names), "job": job},
+    )
 
 
-def edit_html(request, upload_id):
-    upload = get_object_or_404(DocumentUpload, id=upload_id)
+def _job_payload(job):
+    payload = {
+        "id": str(job.id),
+        "upload_id": str(job.upload_id),
+        "status": job.status,
+        "stage_timings": job.stage_timings,
+        "error": job.error,
+        "status_url": reverse("converter:job_status", args=[job.id]),
+    }
+    if job.status == ConversionJob.STATUS_DONE:
+        payload["redirect_url"] = reverse("converter:edit_html", args=[job.upload_id])
+    return payload
+
+
+def _ndjson(payload):
+    return json.dumps(payload, ensure_ascii=False) + "\n"
+
+
+def _bulk_line(job, counts):
+    counts[job.status] = counts.get(job.status, 0) + 1
+    return _ndjson({"filename": job.original_filename, **_job_payload(job)})
+
+
+def _rejected_lines(rejected):
+    for filename, error in rejected:
+        yield _ndjson({"filename": filename, "status": "rejected", "error": error})
+
+
+def _bulk_results(jobs, rejected):
+    yield from _rejected_lines(rejected)
+    counts = {}
+    for job in iter_finished_jobs(jobs, settings.BULK_UPLOAD_WAIT_TIMEOUT):
+        yield _bulk_line(job, counts)
+    yield _ndjson({"status": "complete", "rejected": len(rejected), **counts})
+
+
+async def _abulk_results(jobs, rejected):
+    # Под ASGI синхронный итератор Django дочитывает до конца, прежде чем
+    # отправить ответ, поэтому строки отдаёт асинхронный генератор
+    for line in _rejected_lines(rejected):
+        yield line
+    counts = {}
+    async for job in aiter_finished_jobs(jobs, settings.BULK_UPLOAD_WAIT_TIMEOUT):
+        yield _bulk_line(job, counts)
+    yield _ndjson({"status": "complete", "rejected": len(rejected), **counts})
+
+
+async def upload_bulk(request):
+    # Ответ - NDJSON: строка на каждый файл по мере готовности, последней итог
+    if request.method != "POST":
+        return HttpResponse(status=405, headers={"Allow": "POST"})
+    names = await run_io(profiles.profile_names)
+    form = BulkUploadForm(request.POST, request.FILES, profiles=names)
+    if not await run_io(form.is_valid):
+        return JsonResponse({"errors": form.errors}, status=400)
+    try:
+        documents, rejected = await run_io(
+            collect_documents, form.cleaned_data["files"]
+        )
+    except BulkUploadError as e:
+        return JsonResponse({"errors": {"files": [str(e)]}}, status=400)
+    profile = await run_io(profiles.get_profile, form.cleaned_data.get("profile"))
+    uploads = await run_io(create_uploads, documents, profile)
+    jobs = await run_io(enqueue_conversions, uploads)
+    logger.debug(f"Bulk upload: {len(jobs)} documents, {len(rejected)} rejected")
+    results = _abulk_results if isinstance(request, ASGIRequest) else _bulk_results
+    response = StreamingHttpResponse(
+        results(jobs, rejected), content_type="application/x-ndjson"
+    )
+    # nginx не должен копить ответ до конца
+    response["X-Accel-Buffering"] = "no"
+    response["Cache-Control"] = "no-store"
+    return response
+
+
+def job_status(request, job_id):
+    job = get_object_or_404(ConversionJob, id=job_id)
+    return JsonResponse(_job_payload(job))
+
+
+async def edit_html(request, upload_id):
+    upload = await aget_object_or_404(
+        DocumentUpload.objects.select_related("profile"), id=upload_id
+    )
+    block_version = None
     if request.method == "POST":
         form = HtmlEditForm(request.POST)
         if form.is_valid():
             html_content = form.cleaned_data["html_content"]
-            html_path = save_edited_html(
-                html_content, upload.id, os.path.basename(upload.html_file.name)
+            html_path = await run_cpu(
+                save_edited_html,
+                html_content,
+                upload.id,
+                os.path.basename(upload.html_file.name),
+                profiles.get_compiled(upload.profile),
             )
             upload.html_file = os.path.relpath(html_path, settings.MEDIA_ROOT)
-            upload.save()
+            await upload.asave()
+            await run_io(upload.refresh_file_metadata)
+            await _run_jobs(prerender_pdf, upload)
+            await _run_jobs(precompress_html, upload)
             logger.debug(
                 f"Saved edited HTML for upload {upload.id}, HTML: {os.path.basename(html_path)}"
             )
             return redirect("converter:result", upload_id=upload.id)
     else:
-        with open(upload.html_file.path, "r", encoding="utf-8") as f:
-            html_content = f.read()
+        html_path = upload.html_file.path
+        version, cached = await run_io(pages.lookup, "edit", upload.id, html_path)
+        # В странице CSRF-токен: ETag свой для каждого секрета из cookie,
+        # без cookie страница всегда отдаётся заново
+        csrf_secret = request.META.get("CSRF_COOKIE")
+        if csrf_secret:
+            tag = pages.etag("edit", version, csrf_secret)
+            response = get_conditional_response(
+                request, etag=tag, last_modified=version[0] // 10**9
+            )
+            if response is not None:
+                return pages.add_validators(response, tag, version, private=True)
+        if cached is None:
+            # Документы, сконвертированные до поблочной правки, размечаются здесь
+            index = await run_cpu(ensure_index, html_path)
+            html_content = await read_text(html_path)
+            version = (index["mtime_ns"], index["size"])
+            cached = (html_content, index["version"])
+            await run_io(
+                pages.store, "edit", upload.id, version, cached, len(html_content)
+            )
+        html_content, block_version = cached
+        if version[1] != upload.html_size:
+            await run_io(upload.refresh_file_metadata)
         form = HtmlEditForm(initial={"html_content": html_content})
     logger.debug(f"Rendering edit.html for upload {upload.id}")
-    return render(
+    response = render(
         request,
         "converter/edit.html",
         {
             "form": form,
             "upload": upload,
+            "block_version": block_version,
         },
     )
+    if request.method == "POST":
+        return response
+    # Секрет мог появиться только что, при выдаче токена в шаблоне
+    tag = pages.etag("edit", version, request.META["CSRF_COOKIE"])
+    return pages.add_validators(response, tag, version, private=True)
 
 
-def download_file(request, upload_id, file_type):
-    upload = get_object_or_404(DocumentUpload, id=upload_id)
+async def edit_blocks(request, upload_id):
+    # Сохранение изменённых блоков: {"version": n, "changes": [...]},
+    # см. blocks.apply_changes
+    upload = await aget_object_or_404(DocumentUpload, id=upload_id)
+    if request.method != "POST":
+        return HttpResponse(status=405, headers={"Allow": "POST"})
+    try:
+        payload = json.loads(request.body)
+        changes = payload["changes"]
+        version = payload.get("version")
+        if not isinstance(changes, list):
+            raise TypeError("changes must be a list")
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        return JsonResponse({"error": f"Invalid request: {e}"}, status=400)
+    try:
+        index, assigned = await run_cpu(
+            save_edited_blocks, upload.id, upload.html_file.path, changes, version
+        )
+    except VersionConflict as e:
+        return JsonResponse({"error": str(e)}, status=409)
+    except BlockEditError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    await run_io(upload.refresh_file_metadata)
+    await _run_jobs(prerender_pdf, upload)
+    await _run_jobs(precompress_html, upload)
+    logger.debug(
+        f"Saved {len(changes)} block changes for upload {upload.id}, "
+        f"version {index['version']}"
+    )
+    return JsonResponse({"version": index["version"], "ids": assigned})
+
+
+async def download_file(request, upload_id, file_type):
+    upload = await aget_object_or_404(DocumentUpload, id=upload_id)
     if file_type == "html":
         file_path = upload.html_file.path
-        with open(file_path, "r", encoding="utf-8") as f:
-            html_content = f.read()
-        soup = BeautifulSoup(html_content, "html.parser")
-        head = soup.new_tag("head")
-        head.append(soup.new_tag("meta", charset="utf-8"))
-        head.append(
-            soup.new_tag(
-                "meta",
-                attrs={
-                    "name": "viewport",
-                    "content": "width=device-width, initial-scale=1.0",
-                },
-            )
-        )
-        head.append(soup.new_tag("title"))
-        head.title.string = "Converted Document"
-        head.append(
-            soup.new_tag(
-                "link",
-                rel="stylesheet",
-                href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/css/bootstrap.min.css",
-            )
-        )
-        head.append(
-            soup.new_tag(
-                "link",
-                rel="stylesheet",
-                href="https://cdnjs.cloudflare.com/ajax/libs/prism/1.29.0/themes/prism.min.css",
-            )
-        )
         try:
-            with open(
-                os.path.join(settings.STATICFILES_DIRS[0], "css/styles.css"),
-                "r",
-                encoding="utf-8",
-            ) as f:
-                css_content = f.read()
+            download_path = await run_cpu(ensure_download_html, file_path)
         except FileNotFoundError:
-            logger.error(f"styles.css not found in {settings.STATICFILES_DIRS[0]}")
-            css_content = ""
-        style = soup.new_tag("style")
-        style.string = css_content
-        head.append(style)
-        head.append(
-            soup.new_tag(
-                "script",
-                src="https://cdnjs.cloudflare.com/ajax/libs/prism/1.29.0/prism.min.js",
-            )
-        )
-        head.append(
-            soup.new_tag(
-                "script",
-                src="https://cdnjs.cloudflare.com/ajax/libs/prism/1.29.0/components/prism-markup.min.js",
-            )
+            raise Http404("HTML file not found")
+        return await run_io(
+            send_file,
+            request,
+            download_path,
+            "text/html; charset=utf-8",
+            filename=os.path.basename(file_path),
+            precompressed=True,
         )
-        head.append(
-            soup.new_tag(
-                "script",
-                src="https://cdnjs.cloudflare.com/ajax/libs/prism/1.29.0/components/prism-java.min.js",
-            )
-        )
-        head.append(
-            soup.new_tag(
-                "script",
-                src="https://cdnjs.cloudflare.com/ajax/libs/prism/1.29.0/components/prism-bash.min.js",
-            )
-        )
-        head.append(
-            soup.new_tag(
-                "script",
-                src="https://cdnjs.cloudflare.com/ajax/libs/prism/1.29.0/components/prism-json.min.js",
-            )
-        )
-        if soup.head:
-            soup.head.replace_with(head)
-        else:
-            soup.html.insert(0, head)
-        body_content = soup.body.extract() if soup.body else soup
-        new_body = soup.new_tag("body")
-        container = soup.new_tag("div", attrs={"class": "container-sm mt-5"})
-        container.append(body_content)
-        new_body.append(container)
-        if soup.html.body:
-            soup.html.body.replace_with(new_body)
-        else:
-            soup.html.append(new_body)
-        response = HttpResponse(str(soup), content_type="text/html; charset=utf-8")
-        response["Content-Disposition"] = (
-            f"attachment; filename={os.path.basename(file_path)}"
-        )
-        return response
     elif file_type == "zip":
-        file_path = upload.images_zip.path
-        content_type = "application/zip"
-        with open(file_path, "rb") as f:
-            response = HttpResponse(f.read(), content_type=content_type)
-            response["Content-Disposition"] = (
-                f"attachment; filename={os.path.basename(file_path)}"
-            )
-            return response
+        return await run_io(
+            send_file, request, upload.images_zip.path, "application/zip"
+        )
     else:
         return HttpResponse(status=404)
 
 
-def upload_image(request):
+async def upload_image(request):
     if request.method == "POST" and request.FILES.get("file"):
         upload_id = request.POST.get("upload_id")
-        upload = get_object_or_404(DocumentUpload, id=upload_id)
+        upload = await aget_object_or_404(DocumentUpload, id=upload_id)
         image = request.FILES["file"]
-        images_dir = os.path.join(
-            settings.MEDIA_ROOT, "output", str(upload.id), "images"
-        )
-        os.makedirs(images_dir, exist_ok=True)
-        image_name = f"uploaded_{uuid.uuid4().hex[:8]}{os.path.splitext(image.name)[1]}"
-        image_path = os.path.join(images_dir, image_name)
-        with open(image_path, "wb") as f:
-            for chunk in image.chunks():
-                f.write(chunk)
-        image_url = f"/media/output/{upload.id}/images/{image_name}"
-        return JsonResponse({"location": image_url})
+        ext = os.path.splitext(image.name)[1]
+        ref = await run_io(image_store.store_stream, image, ext)
+        # Картинку обрабатывает пул imaging, цикл событий только ждёт;
+        # submit может ждать свободный поток, поэтому он тоже вне цикла
+        future = await run_io(imaging.submit, ref, ext)
+        processed = await asyncio.wrap_future(future)
+        await run_io(image_store.acquire, upload, processed.refs)
+        if ref not in processed.refs:
+            await run_io(image_store.discard, [ref])
+        return JsonResponse({"location": processed.src})
     return JsonResponse({"error": "Invalid request"}, status=400)
 
 
-def result(request, upload_id):
-    upload = get_object_or_404(DocumentUpload, id=upload_id)
+async def result(request, upload_id):
+    upload = await aget_object_or_404(DocumentUpload, id=upload_id)
     output_dir = os.path.join(settings.MEDIA_ROOT, "output", str(upload.id))
     html_filename = os.path.basename(upload.html_file.name)
     zip_filename = os.path.basename(upload.images_zip.name)
     html_path = os.path.join(output_dir, html_filename)
     logger.debug(f"Attempting to open HTML file: {html_path}")
     try:
-        with open(html_path, "r", encoding="utf-8") as f:
-            html_content = f.read()
+        version, page = await run_io(pages.lookup, "result", upload.id, html_path)
+        tag = pages.etag("result", version)
+        response = get_conditional_response(
+            request, etag=tag, last_modified=version[0] // 10**9
+        )
+        if response is None and page is not None:
+            response = HttpResponse(page)
+        if response is None:
+            html_content = await read_text(html_path)
+            logger.debug(
+                f"Rendering result.html for upload {upload_id}, HTML: {html_filename}"
+            )
+            response = render(
+                request,
+                "converter/result.html",
+                {
+                    "upload": upload,
+                    "html_content": html_content,
+                    "html_filename": html_filename,
+                    "zip_filename": zip_filename,
+                },
+            )
+            await run_io(
+                pages.store,
+                "result",
+                upload.id,
+                version,
+                response.content,
+                len(response.content),
+            )
     except FileNotFoundError:
         logger.error(f"HTML file not found: {html_path}")
         return render(
             request, "converter/result.html", {"error": "HTML file not found"}
         )
-    logger.debug(f"Rendering result.html for upload {upload_id}, HTML: {html_filename}")
-    return render(
-        request,
-        "converter/result.html",
-        {
-            "upload": upload,
-            "html_content": html_content,
-            "html_filename": html_filename,
-            "zip_filename": zip_filename,
-        },
-    )
+    return pages.add_validators(response, tag, version)
 
 
 def archive_view(request):
     query = request.GET.get("q", "")
-    sort_by = request.GET.get("sort", "-uploaded_at")
-    uploads = DocumentUpload.objects.all()
-    if query:
-        uploads = uploads.filter(docx_file__icontains=query)
-    uploads = uploads.order_by(sort_by)
+    if query and request.GET.get("in") == "content":
+        return _content_search(request, query)
+    uploads, sort_by, next_cursor = archive_page(
+        query, request.GET.get("sort", DEFAULT_SORT), request.GET.get("after")
+    )
     return render(
         request,
         "converter/archive.html",
-        {"uploads": uploads, "query": query, "sort": sort_by},
+        {
+            "uploads": uploads,
+            "query": query,
+            "sort": sort_by,
+            "next_cursor": next_cursor,
+            "is_first_page": not request.GET.get("after"),
+        },
     )
 
 
-def highlight_code(code, language):
+def _content_search(request, query):
     try:
-        language_map = {
-            "markup": "xml",
-            "bash": "bash",
-            "java": "java",
-            "json": "json",
-        }
-
-        lexer_name = language_map.get(language, "xml")
-        lexer = get_lexer_by_name(lexer_name)
-        logger.debug(f"Using lexer: {lexer}")
-
-        formatter = HtmlFormatter(
-            cssclass="highlight",
-            nowrap=False,
-            style="default",
-            full=True,
-        )
-
-        highlighted = highlight(code, lexer, formatter)
-
-        return highlighted
-
-    except Exception:
-        return f'<code class="language-{language}">{html.escape(code)}</code>'
-
-
-def download_pdf(request, upload_id):
-    upload = get_object_or_404(DocumentUpload, id=upload_id)
-    pdf_path = upload.html_file.path.replace(".html", ".pdf")
-
-    with open(upload.html_file.path, "r", encoding="utf-8") as f:
-        html_content = f.read()
-
-    soup = BeautifulSoup(html_content, "html.parser")
-
-    for element in soup.find_all(["script", "link"]):
-        element.decompose()
-
-    for img in soup.find_all("img"):
-        if img["src"].startswith("/media/"):
-            img["src"] = "file://" + os.path.join(settings.MEDIA_ROOT, img["src"][7:])
-
-    for pre in soup.find_all("pre"):
-        language = None
-        for cls in pre.get("class", []):
-            if cls.startswith("language-"):
-                language = cls.replace("language-", "")
-                break
-
-        if not pre.code:
-            code = soup.new_tag("code")
-            code.string = pre.get_text()
-            pre.clear()
-            pre.append(code)
-
-        elif language:
-            try:
-                code_contents = []
-                for child in pre.code.contents:
-                    if child.name is None:  # Текстовые узлы
-                        code_contents.append(str(child))
-                    elif child.name == "br":  # Сохраняем переносы строк
-                        code_contents.append("\n")
-
-                code_text = "".join(code_contents).strip()
-
-                if code_text:  # Проверяем, что код не пустой
-                    highlighted = highlight_code(code_text, language)
-
-                    if highlighted:  # Проверяем результат подсветки
-                        logger.debug(f"Highlighted code!!!: {highlighted}")
-                        new_code = BeautifulSoup(highlighted, "html.parser").find(
-                            "div", class_="highlight"
-                        )
-                        logger.debug(f"New code: {new_code}")
-                        if new_code:  # Убеждаемся, что нашли code-блок
-                            pre.replace_with(new_code)
-                        else:
-                            logger.warning(
-                                f"No code block found in highlighted content for {language}"
-                            )
-                            pre.code["class"] = pre.code.get("class", []) + [
-                                f"language-{language}"
-                            ]
-                    else:
-                        logger.warning(
-                            f"Highlighting returned empty content for {language}"
-                        )
-                        pre.code["class"] = pre.code.get("class", []) + [
-                            f"language-{language}"
-                        ]
-                else:
-                    logger.warning("Empty code block found")
-
-            except Exception as e:
-                logger.error(f"Error processing code block: {str(e)}")
-                pre.code["class"] = pre.code.get("class", []) + [f"language-{language}"]
-
-    css_files = [
-        os.path.join(settings.STATIC_ROOT, "css", "styles.css"),
-    ]
-
-    css_content = ""
-    for css_file in css_files:
-        try:
-            with open(css_file, "r", encoding="utf-8") as f:
-                css_content += f.read() + "\n"
-        except Exception as e:
-            logger.error(f"Error loading CSS {css_file}: {str(e)}")
-
-    pygments_css = HtmlFormatter().get_style_defs(".highlight")
-    css_content += pygments_css
-
-    style_tag = soup.new_tag("style")
-    style_tag.string = css_content
-    if not soup.head:
-        soup.html.insert(0, soup.new_tag("head"))
-    soup.head.append(style_tag)
+        page = max(int(request.GET.get("page", 1)), 1)
+    except ValueError:
+        page = 1
+    results, has_next = search_documents(query, page)
+    uploads = []
+    for upload, _, snippet in results:
+        upload.snippet = snippet
+        uploads.append(upload)
+    return render(
+        request,
+        "converter/archive.html",
+        {
+            "uploads": uploads,
+            "query": query,
+            "search_in": "content",
+            "page": page,
+            "has_next": has_next,
+            "is_first_page": page == 1,
+        },
+    )
 
-    html = HTML(string=str(soup), base_url=settings.MEDIA_ROOT, encoding="utf-8")
 
-    html.write_pdf(
-        pdf_path,
-        stylesheets=[CSS(string=css_content)],
-    )
+async def download_pdf(request, upload_id):
+    upload = await aget_object_or_404(DocumentUpload, id=upload_id)
+    html_path = upload.html_file.path
+    if not settings.PDF_POOL_ENABLED:
+        pdf_path = await run_cpu(get_pdf, html_path)
+        return await run_io(send_file, request, pdf_path, "application/pdf")
 
-    with open(pdf_path, "rb") as f:
-        response = HttpResponse(f.read(), content_type="application/pdf")
-        response["Content-Disposition"] = (
-            f'attachment; filename="{os.path.basename(pdf_path)}"'
+    # Рендерит пул PDF-воркеров, веб-процесс только ждёт результат
+    pdf_path = await run_io(cached_pdf, html_path)
+    if pdf_path is None:
+        job = await await_job(
+            await _run_jobs(enqueue_pdf_render, upload), settings.PDF_WAIT_TIMEOUT
         )
+        if job.status == ConversionJob.STATUS_FAILED:
+            logger.error(f"PDF render failed for upload {upload.id}: {job.error}")
+            return HttpResponse("PDF rendering failed", status=500)
+        pdf_path = await run_io(cached_pdf, html_path)
+    if pdf_path is None:
+        response = HttpResponse("PDF is still rendering, retry shortly", status=503)
+        response["Retry-After"] = "5"
+        return response
+    return await run_io(send_file, request, pdf_path, "application/pdf")
 
-    # Debugging
-    with open(pdf_path.replace(".pdf", "_processed.html"), "w", encoding="utf-8") as f:
-        f.write(str(soup))
 
-    return response
+def _remove_path(path, remove):
+    try:
+        remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.error(f"Could not remove {path}: {e}")
 
 
 def delete_upload(request, upload_id):
     upload = get_object_or_404(DocumentUpload, id=upload_id)
     if request.method == "POST":
-        try:
-            if upload.html_file:
-                os.remove(upload.html_file.path)
-            if upload.images_zip:
-                os.remove(upload.images_zip.path)
-            if upload.docx_file:
-                os.remove(upload.docx_file.path)
+        # В output/<id> лежат и производные файлы: скачиваемая версия, PDF,
+        # индекс блоков, .br/.gz. Сначала удаляем запись, потом файлы: если
+        # удалятся не все, на остатки никто не ссылается
+        output_dir = os.path.join(settings.MEDIA_ROOT, "output", str(upload.id))
+        docx_path = upload.docx_file.path if upload.docx_file else None
+        with transaction.atomic():
+            image_store.release(upload)
             upload.delete()
-            logger.debug(f"Deleted upload {upload_id}")
-        except Exception as e:
-            logger.error(f"Error deleting upload {upload_id}: {e}")
+        pages.invalidate(upload_id)
+        _remove_path(output_dir, shutil.rmtree)
+        if docx_path:
+            _remove_path(docx_path, os.remove)
+        logger.debug(f"Deleted upload {upload_id}")
         return redirect("converter:archive")
     return HttpResponse(status=405)
+
+
+def metrics_view(request):
+    return HttpResponse(
+        metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
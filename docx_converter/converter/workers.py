@@ -0,0 +1,71 @@
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import time
+
+from django.db import connections
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def _child_main(worker_name, target):
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda *args: stopping.append(True))
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    try:
+        target(worker_name, lambda: bool(stopping))
+    finally:
+        metrics.flush_at_exit()
+
+
+# Пул процессов-воркеров: запускает, перезапускает упавшие и гасит по сигналу
+class WorkerPool:
+    def __init__(self, size, target, name_prefix="worker"):
+        self.size = size
+        self.target = target
+        self.name_prefix = name_prefix
+        self.context = multiprocessing.get_context("fork")
+        self.processes = {}
+        self.stopping = False
+
+    def _spawn(self, slot):
+        worker_name = f"{socket.gethostname()}-{os.getpid()}-{self.name_prefix}{slot}"
+        # Соединения с БД нельзя делить между процессами
+        connections.close_all()
+        process = self.context.Process(
+            target=_child_main, args=(worker_name, self.target), name=worker_name
+        )
+        process.start()
+        self.processes[slot] = process
+        logger.info(f"Started {worker_name} (pid {process.pid})")
+
+    def stop(self, *args):
+        self.stopping = True
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for slot in range(self.size):
+            self._spawn(slot)
+        while not self.stopping:
+            for slot, process in list(self.processes.items()):
+                if not process.is_alive():
+                    if process.exitcode == 0:
+                        # Воркер сам завершился ради переработки
+                        logger.info(f"{process.name} finished, replacing it")
+                    else:
+                        logger.warning(
+                            f"{process.name} exited with code {process.exitcode}, "
+                            "restarting"
+                        )
+                    self._spawn(slot)
+            time.sleep(1)
+        for process in self.processes.values():
+            process.terminate()
+        for process in self.processes.values():
+            process.join()
+        logger.info("Worker pool stopped")